@@ -0,0 +1,109 @@
+# src/analysis_store.py
+
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+import uuid
+from pathlib import Path
+
+from cache import normalize_text
+
+
+def text_hash(text: str) -> str:
+    """
+    Hash av normaliserad text – samma chunk ger samma hash även om
+    radbrytningar och mellanslag runt den ändrats.
+    """
+    return hashlib.sha256(normalize_text(text).encode("utf-8")).hexdigest()
+
+
+class AnalysisStore:
+    """
+    Sparade analyser i en lokal SQLite-fil: per analys dokumentets hash,
+    modellernas fingeravtryck (revision + avkodning per uppgift), varje
+    chunks hash och extract-svar (None om chunken inte kördes) samt hela
+    resultatet. Gör att en ny version av ett dokument kan analyseras om
+    inkrementellt, även efter en omstart.
+    """
+
+    _COLUMNS = ("id", "parent", "text_hash", "fingerprint", "created", "chunks", "result")
+    _JSON_COLUMNS = ("fingerprint", "chunks", "result")
+
+    def __init__(self, path: str | Path):
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        self._db = sqlite3.connect(str(path), check_same_thread=False)
+        self._lock = threading.Lock()
+        with self._lock:
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS analyses ("
+                " id TEXT PRIMARY KEY, parent TEXT, text_hash TEXT, fingerprint TEXT,"
+                " created REAL, chunks TEXT, result TEXT)"
+            )
+            self._db.execute("CREATE INDEX IF NOT EXISTS analyses_text ON analyses (text_hash, created)")
+            self._db.commit()
+
+    def _analysis(self, row: tuple) -> dict:
+        data = dict(zip(self._COLUMNS, row))
+        for c in self._JSON_COLUMNS:
+            data[c] = json.loads(data[c])
+        return data
+
+    def save(
+        self,
+        text: str,
+        fingerprint: dict,
+        chunks: list[dict],
+        result: dict,
+        parent: str | None = None,
+    ) -> str:
+        """
+        Sparar en analys och returnerar dess id. chunks är [{"hash", "output"}]
+        i dokumentordning.
+        """
+        analysis_id = uuid.uuid4().hex
+        row = (
+            analysis_id, parent, text_hash(text), json.dumps(fingerprint, sort_keys=True),
+            time.time(), json.dumps(chunks, ensure_ascii=False), json.dumps(result, ensure_ascii=False),
+        )
+        with self._lock:
+            self._db.execute(
+                f"INSERT INTO analyses ({', '.join(self._COLUMNS)}) "
+                f"VALUES ({', '.join('?' * len(self._COLUMNS))})",
+                row,
+            )
+            self._db.commit()
+        return analysis_id
+
+    def get(self, analysis_id: str) -> dict | None:
+        with self._lock:
+            row = self._db.execute(
+                f"SELECT {', '.join(self._COLUMNS)} FROM analyses WHERE id = ?", (analysis_id,)
+            ).fetchone()
+        return self._analysis(row) if row else None
+
+    def result(self, analysis_id: str) -> dict | None:
+        """
+        Bara resultatet (utan chunkarnas svar) för en sparad analys.
+        """
+        with self._lock:
+            row = self._db.execute("SELECT result FROM analyses WHERE id = ?", (analysis_id,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def latest_for_text(self, text: str) -> dict | None:
+        """
+        Senaste sparade analysen av exakt den här texten (efter normalisering).
+        """
+        with self._lock:
+            row = self._db.execute(
+                f"SELECT {', '.join(self._COLUMNS)} FROM analyses WHERE text_hash = ?"
+                " ORDER BY created DESC LIMIT 1",
+                (text_hash(text),),
+            ).fetchone()
+        return self._analysis(row) if row else None
+
+    def stats(self) -> dict:
+        with self._lock:
+            count = self._db.execute("SELECT COUNT(*) FROM analyses").fetchone()[0]
+        return {"analyses": count}
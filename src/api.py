@@ -1,93 +1,1127 @@
 # src/api.py
 
-from fastapi import FastAPI, Body, HTTPException
-from transformers import AutoTokenizer, AutoModelForSeq2SeqLM
-import torch
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+from typing import Literal, NamedTuple
+from dataclasses import asdict, dataclass
+from fastapi import FastAPI, Body, Depends, Header, HTTPException, Query
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
+from pydantic import BaseModel
+import asyncio
+import hmac
 import json
+import os
+import time
+import uuid
+
+import chunking
+import inference
+from analysis_store import AnalysisStore, text_hash
+from constrained import JsonTemplate, check_transformers_support, generate_constrained
+from faq import FaqEngine
+from cache import ResultCache, make_key
+from inference import TASK_MAX_INPUT_LENGTH, TASK_MAX_LENGTH
+from jobs import InMemoryJobBackend, JobManager, QueueFullError, SqliteJobBackend
+from metrics import REGISTRY, STAGE_SECONDS, span
+from model_registry import ModelEntry, ModelRegistry
+from preprocess import BOOLEAN_KEYS
+from relevance import RelevanceIndex, priority_order, select_chunks
+from scheduler import InferenceScheduler
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    scheduler.start()
+    await job_manager.start()
+    # Modellerna laddas och värms upp i bakgrunden: servern svarar direkt på
+    # /healthz, och /readyz blir 200 när alla är uppvärmda
+    preload = asyncio.create_task(asyncio.to_thread(models.warmup_all, warmup)) if MODEL_PRELOAD else None
+    yield
+    if preload is not None:
+        preload.cancel()
+    await job_manager.stop()
+    scheduler.stop()
+    await asyncio.to_thread(result_cache.flush)
 
 app = FastAPI(
     title="Vårdförsäkring T5-API",
     description="Analyserar en hel försäkringstext (även mycket långa) "
                 "genom att dela upp i chunkar, köra ‘extract’ per chunk och "
                 "sedan ‘compare’ + ‘faq’ på det aggregerade resultatet.",
-    version="1.0.0"
+    version="1.0.0",
+    lifespan=lifespan
+)
+
+# ----------------------------------------------------------------------------------
+# Modeller och tokenizers (laddas lat, se model_registry.py)
+# ----------------------------------------------------------------------------------
+# En modell för alla uppgifter som standard. MODELS (JSON eller sökväg till en
+# JSON-fil) registrerar flera, t.ex.
+#   {"default": {"path": "models/all-tasks-t5-swedish"},
+#    "extractor": {"path": "models/extract-relevant-mt5", "task_prefix": false}}
+# och TASK_MODELS routar uppgifter till dem, t.ex. "extract=extractor".
+# En destillerad student (src/train_distill.py) har samma tokenizer och
+# prefix som läraren och kan ersätta den direkt:
+# MODEL_PATH=models/all-tasks-t5-student, eller bytas in under drift via
+# POST /models/default/swap (se ADMIN_TOKEN nedan). DRAFT_MODEL_PATH registrerar den bredvid läraren som
+# utkastmodell "draft" för profilen "assisted".
+MODEL_PATH = os.environ.get("MODEL_PATH", "models/all-tasks-t5-swedish")
+DRAFT_MODEL_PATH = os.environ.get("DRAFT_MODEL_PATH") or None
+# Inferensbackend: "torch" (fp32), "torch-int8" eller "onnx" (se inference.py)
+INFERENCE_BACKEND = os.environ.get("INFERENCE_BACKEND", "torch")
+# Ladda vikterna minnesmappat från model.safetensors
+MODEL_MMAP    = os.environ.get("MODEL_MMAP", "0").lower() in ("1", "true", "yes")
+# Ladda och värm upp modellen när appen startar (annars vid första anropet)
+MODEL_PRELOAD = os.environ.get("MODEL_PRELOAD", "1").lower() in ("1", "true", "yes")
+# Inferensprocesser per modell som delar vikterna (0 = inferens i API-processen)
+# och intra-op-trådar per process (standard: kärnorna delat på processerna)
+INFERENCE_WORKERS = int(os.environ.get("INFERENCE_WORKERS", "0"))
+INFERENCE_THREADS_PER_WORKER = int(os.environ.get("INFERENCE_THREADS_PER_WORKER", "0")) or None
+# POST /models/{name}/swap kräver headern X-Admin-Token = ADMIN_TOKEN (utan
+# ADMIN_TOKEN är endpointen avstängd) och tar bara checkpoints under SWAP_MODELS_DIR
+ADMIN_TOKEN     = os.environ.get("ADMIN_TOKEN") or None
+SWAP_MODELS_DIR = os.path.realpath(os.environ.get("SWAP_MODELS_DIR", "models"))
+models = ModelRegistry.from_config(
+    os.environ.get("MODELS"), os.environ.get("TASK_MODELS"),
+    default_path=MODEL_PATH, default_backend=INFERENCE_BACKEND, mmap=MODEL_MMAP,
+    workers=INFERENCE_WORKERS, threads_per_worker=INFERENCE_THREADS_PER_WORKER, draft_path=DRAFT_MODEL_PATH
 )
 
+# Avkodning av extract/compare: "beam" (fri beam search) eller "constrained"
+# (fyller i JSON-mallen med BOOLEAN_KEYS, se constrained.py). faq körs alltid
+# med beam search. "constrained" kräver en PyTorch-backend.
+DECODING_MODES      = ("beam", "constrained")
+CONSTRAINED_TASKS   = ("extract", "compare")
+EXTRACT_DECODING    = os.environ.get("EXTRACT_DECODING", "beam")
+if EXTRACT_DECODING not in DECODING_MODES:
+    raise ValueError(f"Okänd EXTRACT_DECODING '{EXTRACT_DECODING}', välj en av {', '.join(DECODING_MODES)}.")
+if EXTRACT_DECODING == "constrained" and any(models.for_task(t).backend == "onnx" for t in CONSTRAINED_TASKS):
+    raise ValueError("EXTRACT_DECODING=constrained stöds inte med backend 'onnx'.")
+if EXTRACT_DECODING == "constrained":
+    check_transformers_support()
+
+# Genereringsprofiler för fri generering (se inference.GENERATION_PROFILES),
+# valbara per request. GENERATION_PROFILES (JSON eller sökväg till en
+# JSON-fil) lägger till eller ersätter profiler, t.ex.
+#   {"basic": {"num_beams": 1}, "assisted": {"num_beams": 1, "draft": "t5-small"}}
+# där "draft" är namnet på en modell i MODELS. GENERATION_PROFILE väljer standard.
+_profiles_spec = os.environ.get("GENERATION_PROFILES")
+if _profiles_spec and os.path.isfile(_profiles_spec):
+    _profiles_spec = open(_profiles_spec, encoding="utf-8").read()
+GENERATION_PROFILES = {**inference.GENERATION_PROFILES, **(json.loads(_profiles_spec) if _profiles_spec else {})}
+GENERATION_PROFILE  = os.environ.get("GENERATION_PROFILE", "accurate")
+
+def profile_error(profile: str) -> str | None:
+    """
+    Varför profilen inte kan användas (None om den kan det).
+    """
+    if profile not in GENERATION_PROFILES:
+        return f"Okänd genereringsprofil '{profile}', välj en av {', '.join(GENERATION_PROFILES)}."
+    draft = GENERATION_PROFILES[profile].get("draft")
+    if draft is not None and draft not in models.names():
+        return f"Profilen '{profile}' kräver utkastmodellen '{draft}' i MODELS."
+    return None
+
+if profile_error(GENERATION_PROFILE):
+    raise ValueError(f"GENERATION_PROFILE: {profile_error(GENERATION_PROFILE)}")
+
+# Chunkning: max antal token per chunk och hur många token en chunk får
+# överlappa föregående. Chunkarna tokeniseras en gång och deras token går
+# direkt in i extract-prompten, så max tokens begränsas så att prompten ryms
+# i TASK_MAX_INPUT_LENGTH["extract"] utan trunkering.
+CHUNK_MAX_TOKENS = int(os.environ.get("CHUNK_MAX_TOKENS", "1000"))
+CHUNK_OVERLAP    = int(os.environ.get("CHUNK_OVERLAP", "0"))
+
+# Antal chunkar som körs genom model.generate i samma (paddade) batch
+EXTRACT_BATCH_SIZE = int(os.environ.get("EXTRACT_BATCH_SIZE", "8"))
+
+# Dynamisk batchning över samtidiga requests: max antal anrop per batch och
+# hur länge (ms) det äldsta anropet får vänta på att batchen fylls
+SCHEDULER_MAX_BATCH   = int(os.environ.get("SCHEDULER_MAX_BATCH", str(EXTRACT_BATCH_SIZE)))
+SCHEDULER_MAX_WAIT_MS = float(os.environ.get("SCHEDULER_MAX_WAIT_MS", "10"))
+# Antal batchar som körs samtidigt – en per inferensprocess, och minst två så
+# att compare och faq (olika max_length, olika nycklar) körs parallellt
+SCHEDULER_CONCURRENCY = int(os.environ.get("SCHEDULER_CONCURRENCY", str(max(2, INFERENCE_WORKERS))))
+
+# Resultatcache: antal poster i minnes-LRU:n och (valfri) SQLite-fil på disk
+RESULT_CACHE_SIZE = int(os.environ.get("RESULT_CACHE_SIZE", "4096"))
+RESULT_CACHE_PATH = os.environ.get("RESULT_CACHE_PATH") or None
+
+# Jobb-API: antal jobb som körs samtidigt, max antal köade jobb (därefter 429)
+# och var jobben lagras ("memory" eller "sqlite"). Avslutade jobb glöms efter
+# JOB_TTL_S sekunder; i minnet behålls dessutom högst JOB_MAX_FINISHED.
+JOB_WORKERS      = int(os.environ.get("JOB_WORKERS", "2"))
+JOB_QUEUE_SIZE   = int(os.environ.get("JOB_QUEUE_SIZE", "100"))
+JOB_BACKEND      = os.environ.get("JOB_BACKEND", "memory")
+JOB_DB_PATH      = os.environ.get("JOB_DB_PATH", "data/jobs.sqlite")
+JOB_TTL_S        = float(os.environ.get("JOB_TTL_S", "86400"))
+JOB_MAX_FINISHED = int(os.environ.get("JOB_MAX_FINISHED", "1000"))
+
+# Sparade analyser (per-chunk extract-svar) för inkrementell omanalys av nya
+# versioner av ett dokument. Av som standard (filen växer med varje analys
+# och rensas inte); sätt t.ex. ANALYSIS_STORE_PATH=data/analyses.sqlite
+ANALYSIS_STORE_PATH = os.environ.get("ANALYSIS_STORE_PATH") or None
+analysis_store      = AnalysisStore(ANALYSIS_STORE_PATH) if ANALYSIS_STORE_PATH else None
+
+# Relevansförfilter före extract: av/på som standard, minsta poäng för att en
+# chunk ska köras och (valfritt) max antal chunkar per dokument (0 = obegränsat)
+RELEVANCE_FILTER    = os.environ.get("RELEVANCE_FILTER", "0").lower() in ("1", "true", "yes")
+RELEVANCE_MIN_SCORE = float(os.environ.get("RELEVANCE_MIN_SCORE", "5.0"))
+RELEVANCE_TOP_K     = int(os.environ.get("RELEVANCE_TOP_K", "0"))
+relevance_index     = RelevanceIndex()
+
+# FAQ-blocket: "model" (standard) genererar svaren med faq-uppgiften,
+# "template" renderar dem direkt från aggregatets booleaner (FAQ_TEMPLATES/
+# ANSWER_TEMPLATES, se faq.py) – snabbare men med andra formuleringar än
+# modellens, så det väljs explicit. Template faller tillbaka på modellen om
+# aggregatet saknar booleaner.
+FAQ_MODES  = ("template", "model")
+FAQ_MODE   = os.environ.get("FAQ_MODE", "model")
+if FAQ_MODE not in FAQ_MODES:
+    raise ValueError(f"Okänd FAQ_MODE '{FAQ_MODE}', välj en av {', '.join(FAQ_MODES)}.")
+faq_engine = FaqEngine(relevance_index)
+# Antal sparade analysers aggregat som /faq håller i minnet
+FAQ_CACHE_SIZE = int(os.environ.get("FAQ_CACHE_SIZE", "1024"))
+
+# Max antal dokument per anrop till /analyze/batch
+ANALYZE_BATCH_MAX_DOCS = int(os.environ.get("ANALYZE_BATCH_MAX_DOCS", "32"))
+
+# Early exit: sluta köra extract när alla BOOLEAN_KEYS redan är True (OR-
+# aggregatet kan inte ändras mer), och i vilken ordning chunkarna körs
+# ("document", "relevance" eller "heading")
+EARLY_EXIT    = os.environ.get("EARLY_EXIT", "0").lower() in ("1", "true", "yes")
+EXTRACT_ORDER = os.environ.get("EXTRACT_ORDER", "document")
+BOOLEAN_KEY_NAMES = [bk["key"] for bk in BOOLEAN_KEYS]
+
 # ----------------------------------------------------------------------------------
-# Initiera modell och tokenizer
+# Mätvärden (exponeras på /metrics)
 # ----------------------------------------------------------------------------------
-MODEL_PATH = "models/all-tasks-t5-swedish"
-tokenizer  = AutoTokenizer.from_pretrained(MODEL_PATH)
-model      = AutoModelForSeq2SeqLM.from_pretrained(MODEL_PATH)
-device     = torch.device("cuda" if torch.cuda.is_available() else "cpu")
-model.to(device)
+ANALYZE_REQUESTS   = REGISTRY.counter("analyze_requests_total", "Antal analyser per utfall.")
+CHUNKS_PER_REQUEST = REGISTRY.histogram(
+    "analyze_chunks_per_request", "Antal chunkar per analyserad text.",
+    buckets=(1, 2, 5, 10, 20, 50, 100, 200, 500)
+)
+GENERATED_TOKENS   = REGISTRY.counter("generated_tokens_total", "Antal genererade token per uppgift.")
+GENERATIONS        = REGISTRY.counter("generations_total", "Antal genererade svar per uppgift.")
+CHUNKS_SKIPPED     = REGISTRY.counter("analyze_chunks_skipped_total", "Chunkar som aldrig kördes genom modellen.")
+JSON_PARSE_FAILURES = REGISTRY.counter(
+    "json_parse_failures_total", "Modellsvar som inte gick att tolka som JSON, per uppgift."
+)
 
 def chunk_text_by_tokens(text: str, max_tokens: int = 1000) -> list[str]:
     """
     Dela upp texten i mindre strängar, vardera max max_tokens token långa.
     """
-    encoding = tokenizer(text, return_offsets_mapping=True, add_special_tokens=False)
-    offsets = encoding["offset_mapping"]
-    total_tokens = len(offsets)
-    chunks = []
-    start = 0
-    while start < total_tokens:
-        end = min(start + max_tokens, total_tokens)
-        char_start = offsets[start][0]
-        char_end   = offsets[end - 1][1]
-        chunks.append(text[char_start:char_end])
-        start = end
-    return chunks
+    return chunking.chunk_text_by_tokens(models.for_task("extract").tokenizer, text, max_tokens)
 
-def extract_chunk(chunk_text: str) -> dict:
+def task_prefix_ids(task: str, entry: ModelEntry | None = None) -> list[int]:
     """
-    Kör 'extract' på en enda chunk och returnerar ett dict (eller tomt om fel).
+    Token för prefixet f"{task}:" i modellen som kör uppgiften (tokeniseras
+    en gång per laddad modell). Tomt för modeller tränade utan prefix.
+    """
+    entry = entry or models.for_task(task)
+    if not entry.task_prefix:
+        return []
+    return entry.derived(
+        f"prefix:{task}", lambda: entry.tokenizer(f"{task}:", add_special_tokens=False)["input_ids"]
+    )
+
+def task_prompt(task: str, text: str, entry: ModelEntry | None = None) -> str:
+    entry = entry or models.for_task(task)
+    return f"{task}: {text}" if entry.task_prefix else text
+
+def extract_template(entry: ModelEntry) -> JsonTemplate:
+    return entry.derived("extract_template", lambda: JsonTemplate(entry.tokenizer))
+
+def chunk_document(text: str) -> list[chunking.Chunk]:
+    """
+    Strukturmedveten chunkning med en enda tokenisering av hela texten
+    (se chunking.chunk_document), med tokenizern för modellen som kör extract.
+    """
+    entry = models.for_task("extract")
+    max_tokens = min(CHUNK_MAX_TOKENS, TASK_MAX_INPUT_LENGTH["extract"] - len(task_prefix_ids("extract", entry)) - 1)
+    return chunking.chunk_document(entry.tokenizer, text, max_tokens, CHUNK_OVERLAP)
+
+def extract_prompt(chunk: chunking.Chunk) -> list[int]:
+    """
+    input_ids för f"extract: {chunk.text}" byggda av chunkens redan
+    tokeniserade token – ingen ny tokenisering och ingen trunkering.
+    """
+    entry = models.for_task("extract")
+    return task_prefix_ids("extract", entry) + chunk.input_ids + [entry.tokenizer.eos_token_id]
+
+def generate_batch(
+    prompts: list[str | list[int]],
+    max_input_length: int,
+    max_length: int | list[int],
+    batch_size: int = EXTRACT_BATCH_SIZE,
+    token_counts: list[int] | None = None,
+    decoding: str = "beam",
+    entry: ModelEntry | None = None,
+    profile: str | None = None,
+) -> list[str]:
+    """
+    Kör modellen (standard: den som kör extract) på prompts i längdsorterade,
+    paddade mikrobatchar (se inference.generate_batch) med genereringsprofilen
+    profile (None = GENERATION_PROFILE). Med decoding="constrained" fylls
+    extract-mallen i i stället (max_length och profil används då inte).
+    """
+    entry = entry or models.for_task("extract")
+    entry.load()
+    settings = GENERATION_PROFILES[profile or GENERATION_PROFILE]
+    if entry.pool is not None:
+        # Arbetsprocesserna har ingen utkastmodell: assisterade profiler körs
+        # där som vanlig girig avkodning (samma svar)
+        return entry.pool.generate(
+            prompts,
+            max_input_length=max_input_length,
+            max_length=max_length,
+            batch_size=batch_size,
+            token_counts=token_counts,
+            decoding=decoding,
+            generation_kwargs=inference.profile_generation_kwargs(settings)
+        )
+    if decoding == "constrained":
+        return generate_constrained(
+            entry.model, entry.tokenizer, entry.device, prompts,
+            max_input_length=max_input_length,
+            template=extract_template(entry),
+            batch_size=batch_size,
+            token_counts=token_counts
+        )
+    return inference.generate_batch(
+        entry.model, entry.tokenizer, entry.device, prompts,
+        max_input_length=max_input_length,
+        max_length=max_length,
+        batch_size=batch_size,
+        token_counts=token_counts,
+        **inference.profile_generation_kwargs(
+            settings, models.get(settings["draft"]).model if "draft" in settings else None
+        )
+    )
+
+def warmup(entry: ModelEntry) -> None:
+    """
+    En kort generering (per avkodningsläge som används) så att vikter,
+    trådpooler och kärnor är initierade innan /readyz svarar 200.
+    """
+    body = entry.tokenizer("Försäkringen omfattar specialistvård.", add_special_tokens=False)["input_ids"]
+    prompt = task_prefix_ids("extract", entry) + body + [entry.tokenizer.eos_token_id]
+    generate_batch(
+        [prompt], max_input_length=TASK_MAX_INPUT_LENGTH["extract"], max_length=8, batch_size=1, entry=entry
+    )
+    if EXTRACT_DECODING == "constrained" and entry.backend != "onnx":
+        generate_batch(
+            [prompt], max_input_length=TASK_MAX_INPUT_LENGTH["extract"], max_length=8,
+            batch_size=1, decoding="constrained", entry=entry
+        )
+
+def tokenize_shared_prompt(tasks: list[str], body: str, max_input_length: int) -> list[list[int]]:
+    """
+    Tokeniserar body en gång (per modell som kör någon av tasks) och bygger
+    input_ids för f"{task}: {body}" för varje task genom att lägga till det
+    (korta) tokeniserade prefixet. Trunkeringen motsvarar
+    tokenizer(..., truncation=True, max_length=...).
+    """
+    body_ids: dict[str, list[int]] = {}
+    prompts = []
+    for task in tasks:
+        entry = models.for_task(task)
+        if entry.uid not in body_ids:
+            body_ids[entry.uid] = entry.tokenizer(body, add_special_tokens=False)["input_ids"]
+        prefix_ids = task_prefix_ids(task, entry)
+        room = max_input_length - len(prefix_ids) - 1
+        prompts.append(prefix_ids + body_ids[entry.uid][:room] + [entry.tokenizer.eos_token_id])
+    return prompts
+
+def parse_extract(out_str: str) -> dict:
+    """
+    Tolkar modellens extract-svar som JSON (tomt dict om det inte går).
     """
-    prompt = f"extract: {chunk_text}"
-    inputs = tokenizer(
-        prompt,
-        return_tensors="pt",
-        truncation=True,
-        max_length=1024
-    )
-    inputs = {k: v.to(device) for k, v in inputs.items()}
-    outputs = model.generate(
-        **inputs,
-        max_length=512,
-        num_beams=4,
-        early_stopping=True
-    )
-    out_str = tokenizer.batch_decode(outputs, skip_special_tokens=True)[0]
     try:
-        return json.loads(out_str)
+        data = json.loads(out_str)
     except (json.JSONDecodeError, TypeError):
+        data = None
+    if not isinstance(data, dict):
+        JSON_PARSE_FAILURES.inc(task="extract")
         return {}
+    return data
+
+def extract_chunks(chunks: list[str], batch_size: int = EXTRACT_BATCH_SIZE) -> list[dict]:
+    """
+    Kör 'extract' på alla chunkar i paddade mikrobatchar.
+    Returnerar ett dict per chunk (tomt om fel), i samma ordning som chunks.
+    """
+    prompts = [task_prompt("extract", chunk) for chunk in chunks]
+    outputs = generate_batch(
+        prompts,
+        max_input_length=TASK_MAX_INPUT_LENGTH["extract"],
+        max_length=TASK_MAX_LENGTH["extract"],
+        batch_size=batch_size
+    )
+    return [parse_extract(out_str) for out_str in outputs]
+
+def extract_chunk(chunk_text: str) -> dict:
+    """
+    Kör 'extract' på en enda chunk och returnerar ett dict (eller tomt om fel).
+    """
+    return extract_chunks([chunk_text], batch_size=1)[0]
+
+def merge_extract(aggregated: dict, data: dict) -> dict:
+    """
+    Slår ihop ett chunk-resultat med aggregatet: första giltiga chunk blir bas,
+    därefter OR-aggregeras boolean-fälten.
+    """
+    if not data:
+        return aggregated
+    if not aggregated:
+        return data.copy()
+    for key, val in data.items():
+        if key in aggregated and isinstance(val, bool):
+            aggregated[key] = aggregated[key] or val
+        # övriga fält (t.ex. "försäkring") behåller vi från första chunk
+    return aggregated
 
-def aggregate_extract(chunks: list[str]) -> dict:
+def aggregate_extract(chunks: list[str], batch_size: int = EXTRACT_BATCH_SIZE) -> dict:
     """
-    Går igenom alla chunkar, kör extract på varje, och OR-aggregerar boolean-fälten.
+    Kör extract på alla chunkar (batchat) och OR-aggregerar boolean-fälten.
     """
     aggregated = {}
-    for i, chunk in enumerate(chunks):
-        data = extract_chunk(chunk)
-        if not data:
-            continue
-        if i == 0:
-            aggregated = data.copy()
+    for data in extract_chunks(chunks, batch_size=batch_size):
+        aggregated = merge_extract(aggregated, data)
+    return aggregated
+
+# ----------------------------------------------------------------------------------
+# Schemaläggare för inferens (delas av alla requests)
+# ----------------------------------------------------------------------------------
+class GenerationKey(NamedTuple):
+    """
+    Anrop med samma nyckel kan köras i samma model.generate-batch. max_length
+    ingår eftersom ett längre max_length som kortas av efteråt inte ger samma
+    svar med beam search; compare och faq blir därmed olika batchar, som
+    schemaläggaren kör parallellt (SCHEDULER_CONCURRENCY). model är
+    ModelEntry.uid, så att anrop som köats före ett modellbyte körs klart
+    på den gamla modellen. profile är genereringsprofilen ("" vid
+    decoding="constrained").
+    """
+    max_input_length: int
+    max_length: int = 0
+    decoding: str = "beam"
+    model: str = ""
+    profile: str = ""
+
+class GenerationItem(NamedTuple):
+    """
+    Ett anrop i schemaläggarens kö: prompt (text eller input_ids), max_length
+    och uppgiften (för mätvärden).
+    """
+    prompt: str | list[int]
+    max_length: int
+    task: str
+
+def run_generation_batch(key: GenerationKey, items: list[GenerationItem]) -> list[str]:
+    """
+    Körs på schemaläggarens arbetstråd med en batch anrop av samma sort.
+    """
+    token_counts: list[int] = []
+    outputs = generate_batch(
+        [item.prompt for item in items],
+        max_input_length=key.max_input_length,
+        max_length=[item.max_length for item in items],
+        batch_size=len(items),
+        token_counts=token_counts,
+        decoding=key.decoding,
+        entry=models.lookup(key.model),
+        profile=key.profile or None
+    )
+    for item, n in zip(items, token_counts):
+        GENERATED_TOKENS.inc(n, task=item.task)
+        GENERATIONS.inc(task=item.task)
+    return outputs
+
+scheduler = InferenceScheduler(
+    run_generation_batch,
+    max_batch_size=SCHEDULER_MAX_BATCH,
+    max_wait_ms=SCHEDULER_MAX_WAIT_MS,
+    concurrency=SCHEDULER_CONCURRENCY
+)
+
+result_cache = ResultCache(max_entries=RESULT_CACHE_SIZE, sqlite_path=RESULT_CACHE_PATH)
+
+def task_decoding(task: str, decoding: str | None) -> str:
+    """
+    Avkodningen för en uppgift: decoding (eller EXTRACT_DECODING) för
+    extract/compare, alltid beam search för faq.
+    """
+    if task not in CONSTRAINED_TASKS:
+        return "beam"
+    return decoding or EXTRACT_DECODING
+
+def submit_cached(
+    task_texts: list[tuple[str, str]],
+    prompts: list[str | list[int]] | None = None,
+    decoding: str | None = None,
+    profile: str | None = None
+) -> list[asyncio.Future]:
+    """
+    Köar f"{task}: {text}" för varje (task, text) i schemaläggaren och
+    returnerar en future per anrop (samma ordning som task_texts). Svar hämtas
+    från resultatcachen när samma (normaliserade) text redan körts med samma
+    modell och genereringsparametrar – då är futuren redan klar. Missarna köas
+    samtidigt så att anrop med samma GenerationKey hamnar i samma batch.
+    prompts kan ange färdigtokeniserade prompts (samma ordning som task_texts).
+    decoding väljer avkodning för extract/compare (None = EXTRACT_DECODING)
+    och profile genereringsprofil för fri generering (None = GENERATION_PROFILE).
+    """
+    loop = asyncio.get_running_loop()
+    futures = [loop.create_future() for _ in task_texts]
+    keys: dict[int, GenerationKey] = {}
+    cache_keys = []
+    entries = [models.for_task(task) for task, _ in task_texts]
+    profile = profile or GENERATION_PROFILE
+    for i, (task, text) in enumerate(task_texts):
+        mode = task_decoding(task, decoding)
+        params = {
+            "max_input_length": TASK_MAX_INPUT_LENGTH[task],
+            "max_length": TASK_MAX_LENGTH[task],
+            "generation": GENERATION_PROFILES[profile]
+        }
+        if mode != "beam":
+            params = {"max_input_length": TASK_MAX_INPUT_LENGTH[task], "decoding": mode}
+        cache_keys.append(make_key(task, text, entries[i].revision, params))
+        cached = result_cache.get_memory(cache_keys[i], namespace=task)
+        if cached is not None:
+            futures[i].set_result(cached)
+        else:
+            keys[i] = GenerationKey(
+                TASK_MAX_INPUT_LENGTH[task], TASK_MAX_LENGTH[task], mode, entries[i].uid,
+                profile if mode == "beam" else ""
+            )
+            # Räknas som pågående mot modellen tills svaret är klart (dränering vid byte)
+            entries[i].acquire()
+
+    def store(i: int, fut: asyncio.Future) -> None:
+        entries[i].release()
+        if fut.cancelled():
+            futures[i].cancel()
+        elif fut.exception() is not None:
+            if not futures[i].done():
+                futures[i].set_exception(fut.exception())
         else:
-            for key, val in data.items():
-                if key in aggregated and isinstance(val, bool):
-                    aggregated[key] = aggregated[key] or val
-                # övriga fält (t.ex. "försäkring") behåller vi från första chunk
+            result_cache.put(cache_keys[i], fut.result(), namespace=task_texts[i][0])
+            if not futures[i].done():
+                futures[i].set_result(fut.result())
+
+    def enqueue(misses: list[int]) -> None:
+        groups: dict[GenerationKey, list[int]] = {}
+        for i in misses:
+            groups.setdefault(keys[i], []).append(i)
+        for key, idx in groups.items():
+            items = [
+                GenerationItem(
+                    prompt=prompts[i] if prompts is not None else task_prompt(*task_texts[i], entries[i]),
+                    max_length=TASK_MAX_LENGTH[task_texts[i][0]],
+                    task=task_texts[i][0]
+                )
+                for i in idx
+            ]
+            for i, fut in zip(idx, scheduler.enqueue(key, items)):
+                fut.add_done_callback(lambda f, i=i: store(i, f))
+                # Callern gav upp: släpp anropet ur schemaläggarens kö
+                futures[i].add_done_callback(lambda f, inner=fut: inner.cancel() if f.cancelled() else None)
+
+    async def lookup_disk(misses: list[int]) -> None:
+        """
+        Minnesmissarna slås upp i SQLite-nivån i en tråd; resten köas.
+        """
+        try:
+            found = await asyncio.to_thread(
+                lambda: [result_cache.get_disk(cache_keys[i], namespace=task_texts[i][0]) for i in misses]
+            )
+        except Exception:  # noqa: BLE001 – cachen är en optimering, kör som vid miss
+            found = [None] * len(misses)
+        remaining = []
+        for i, value in zip(misses, found):
+            if value is None:
+                remaining.append(i)
+            else:
+                entries[i].release()
+                if not futures[i].done():
+                    futures[i].set_result(value)
+        if remaining:
+            try:
+                enqueue(remaining)
+            except Exception as exc:  # noqa: BLE001 – t.ex. stoppad schemaläggare
+                for i in remaining:
+                    entries[i].release()
+                    if not futures[i].done():
+                        futures[i].set_exception(exc)
+
+    misses = list(keys)
+    if misses and result_cache.disk:
+        task = asyncio.create_task(lookup_disk(misses))
+        _background_tasks.add(task)
+        task.add_done_callback(_background_tasks.discard)
+    elif misses:
+        enqueue(misses)
+    return futures
+
+# Bakgrundsuppgifter som måste hållas vid liv tills de är klara
+_background_tasks: set[asyncio.Task] = set()
+
+async def generate_cached(
+    task_texts: list[tuple[str, str]],
+    prompts: list[str | list[int]] | None = None,
+    decoding: str | None = None,
+    profile: str | None = None
+) -> list[str]:
+    """
+    Som submit_cached, men väntar in alla svar.
+    """
+    return list(await asyncio.gather(*submit_cached(task_texts, prompts, decoding, profile)))
+
+def aggregate_outputs(outputs: list[str]) -> dict:
+    """
+    OR-aggregerar råa extract-svar i chunkordning.
+    """
+    aggregated = {}
+    for out_str in outputs:
+        aggregated = merge_extract(aggregated, parse_extract(out_str))
     return aggregated
 
+async def aggregate_extract_async(chunks: list[str]) -> dict:
+    """
+    Som aggregate_extract, men chunkarna köas i schemaläggaren och kan dela
+    batch med chunkar från andra samtidiga requests. Oförändrade chunkar
+    hämtas från resultatcachen.
+    """
+    return aggregate_outputs(await generate_cached([("extract", chunk) for chunk in chunks]))
+
+def parse_json_or_raw(task: str, out_str: str) -> dict:
+    """
+    Tolkar ett compare/faq-svar som JSON, annars {"<task>_raw": svaret}.
+    """
+    try:
+        return json.loads(out_str)
+    except (json.JSONDecodeError, TypeError):
+        JSON_PARSE_FAILURES.inc(task=task)
+        return {f"{task}_raw": out_str}
+
+def faq_template_applies(faq_mode: str | None, compare_input_json: str) -> bool:
+    """
+    Renderas faq från mallarna? Bara i template-läge och om aggregatet har
+    någon boolean-nyckel – annars får modellen generera svaren.
+    """
+    if (faq_mode or FAQ_MODE) != "template":
+        return False
+    extract_agg = json.loads(compare_input_json)
+    return isinstance(extract_agg, dict) and any(isinstance(extract_agg.get(k), bool) for k in BOOLEAN_KEY_NAMES)
+
+async def compare_and_faq(
+    compare_input_json: str,
+    timings: dict | None = None,
+    decoding: str | None = None,
+    profile: str | None = None,
+    faq_mode: str | None = None
+) -> tuple[dict, dict]:
+    """
+    Kör 'compare' och 'faq' på samma aggregerade extract-JSON, köade samtidigt
+    under var sin GenerationKey så att schemaläggaren kör dem parallellt.
+    Tiden tills respektive svar är klart registreras per uppgift. Med
+    faq_mode="template" (standard: FAQ_MODE, som är "model") renderas faq
+    från mallarna och bara compare genereras.
+    """
+    start = time.perf_counter()
+    results = {}
+    tasks = ["compare", "faq"]
+    if faq_template_applies(faq_mode, compare_input_json):
+        results["faq"] = faq_engine.render(json.loads(compare_input_json))
+        STAGE_SECONDS.observe(time.perf_counter() - start, stage="faq")
+        if timings is not None:
+            timings["faq"] = time.perf_counter() - start
+        tasks = ["compare"]
+    # TASK_MAX_INPUT_LENGTH är samma för compare och faq, så de delar tokenisering
+    prompts = await asyncio.to_thread(
+        tokenize_shared_prompt, tasks, compare_input_json, TASK_MAX_INPUT_LENGTH["compare"]
+    )
+    futures = submit_cached(
+        [(task, compare_input_json) for task in tasks],
+        prompts=prompts,
+        decoding=decoding,
+        profile=profile
+    )
+    for task, fut in zip(tasks, futures):
+        out_str = await fut
+        elapsed = time.perf_counter() - start
+        STAGE_SECONDS.observe(elapsed, stage=task)
+        if timings is not None:
+            timings[task] = elapsed
+        results[task] = parse_json_or_raw(task, out_str)
+    return results["compare"], results["faq"]
+
+@app.get(
+    "/scheduler/stats",
+    summary="Mätvärden för inferensschemaläggaren",
+    description="Ködjup, batchstorlekar och väntetider – för att trimma SCHEDULER_MAX_BATCH/SCHEDULER_MAX_WAIT_MS."
+)
+async def scheduler_stats():
+    return scheduler.stats()
+
+@app.get(
+    "/generation/profiles",
+    summary="Genereringsprofiler",
+    description="Profilerna som kan väljas med ?profile= och vilken som är standard."
+)
+async def generation_profiles():
+    return {
+        "default": GENERATION_PROFILE,
+        "profiles": {
+            name: {**settings, "available": profile_error(name) is None}
+            for name, settings in GENERATION_PROFILES.items()
+        }
+    }
+
+@app.get(
+    "/cache/stats",
+    summary="Träffstatistik för resultatcachen",
+    description="Träffar/missar per nivå (extract per chunk, compare/faq per aggregat)."
+)
+async def cache_stats():
+    return result_cache.stats()
+
+def collect_runtime_stats() -> list:
+    """
+    Schemaläggarens, cachens och jobbkön stats() som Prometheus-serier.
+    """
+    sched = scheduler.stats()
+    cache = result_cache.stats()
+    jobs = job_manager.stats()
+    model_status = models.status()
+    memory = models.memory()
+    return [
+        ("scheduler_queue_depth", "gauge", "Anrop som väntar i inferenskön.", [({}, sched["queue_depth"])]),
+        ("scheduler_batches_total", "counter", "Körda generate-batchar.", [({}, sched["batches_total"])]),
+        ("scheduler_items_total", "counter", "Anrop körda i batchar.", [({}, sched["items_total"])]),
+        ("scheduler_batch_size", "gauge", "Antal batchar per batchstorlek.",
+         [({"size": size}, n) for size, n in sched["batch_size_histogram"].items()]),
+        ("result_cache_hits_total", "counter", "Träffar i resultatcachen per nivå.",
+         [({"namespace": ns}, v["hits"]) for ns, v in cache["namespaces"].items()]),
+        ("result_cache_misses_total", "counter", "Missar i resultatcachen per nivå.",
+         [({"namespace": ns}, v["misses"]) for ns, v in cache["namespaces"].items()]),
+        ("result_cache_entries", "gauge", "Poster i minnescachen.", [({}, cache["entries"])]),
+        ("jobs_queued", "gauge", "Köade analysjobb.", [({}, jobs["queued"])]),
+        ("jobs_running", "gauge", "Analysjobb som körs.", [({}, jobs["running"])]),
+        ("model_ready", "gauge", "1 när modellen är laddad och uppvärmd.",
+         [({"model": name}, int(m["state"] == "ready")) for name, m in model_status["models"].items()]),
+        ("model_load_seconds", "gauge", "Tid för laddning respektive uppvärmning per modell.",
+         [({"model": name, "phase": phase}, seconds)
+          for name, m in model_status["models"].items() for phase, seconds in m["timings"].items()]),
+        ("model_weights_bytes", "gauge", "Minne för vikterna per laddad modell (inkl. modeller som dräneras).",
+         [({"model": uid}, m.get("weights_bytes", 0)) for uid, m in memory["models"].items()]),
+        ("process_resident_memory_bytes", "gauge", "Processens RSS.", [({}, memory["process_rss_bytes"])]),
+    ]
+
+REGISTRY.add_collector(collect_runtime_stats)
+
+@app.get(
+    "/metrics",
+    summary="Mätvärden i Prometheus textformat",
+    response_class=PlainTextResponse
+)
+async def metrics():
+    # Insamlarna läser bl.a. jobbkön ur SQLite; rendera i en tråd så att
+    # event-loopen inte blockeras
+    text = await asyncio.to_thread(REGISTRY.render)
+    return PlainTextResponse(text, media_type="text/plain; version=0.0.4")
+
+@app.get(
+    "/healthz",
+    summary="Liveness",
+    description="Processen lever och svarar (oberoende av om modellen är laddad)."
+)
+async def healthz():
+    return {"status": "ok"}
+
+@app.get(
+    "/readyz",
+    summary="Readiness",
+    description="200 när modellen är laddad och uppvärmd, annars 503 – skicka bara trafik till redo poddar."
+)
+async def readyz():
+    return JSONResponse(models.status(), status_code=200 if models.ready else 503)
+
+@app.get(
+    "/models",
+    summary="Registrerade modeller",
+    description="Modeller, routning per uppgift, pågående byten och minnesanvändning."
+)
+async def list_models():
+    return {**models.status(), "memory": models.memory()}
+
+@app.post(
+    "/models/{name}/swap",
+    status_code=202,
+    summary="Byt checkpoint utan omstart",
+    description=(
+        "Laddar och värmer upp en ny checkpoint (under SWAP_MODELS_DIR) för modellen i bakgrunden. "
+        "När den är redo byts den in atomiskt; anrop som redan köats mot den gamla körs klart innan "
+        "den laddas ur. Kräver X-Admin-Token; förloppet syns som swap_status/swap_error i /models."
+    )
+)
+async def swap_model(
+    name: str,
+    path: str = Body(..., embed=True, description="Katalog med den nya checkpointen (under SWAP_MODELS_DIR)"),
+    backend: Literal["torch", "torch-int8", "onnx"] | None = Body(None, embed=True),
+    x_admin_token: str | None = Header(None)
+):
+    if ADMIN_TOKEN is None:
+        raise HTTPException(status_code=403, detail="Modellbyten är avstängda (sätt ADMIN_TOKEN).")
+    if x_admin_token is None or not hmac.compare_digest(x_admin_token, ADMIN_TOKEN):
+        raise HTTPException(status_code=401, detail="Fel eller saknad X-Admin-Token.")
+    if name not in models.names():
+        raise HTTPException(status_code=404, detail=f"Okänd modell '{name}'.")
+    if models.swapping(name):
+        raise HTTPException(status_code=409, detail=f"Ett byte av '{name}' pågår redan.")
+    current = models.get(name)
+    if current.workers and (backend or current.backend) != "torch":
+        raise HTTPException(
+            status_code=400,
+            detail=f"'{name}' har arbetsprocesser (workers={current.workers}), som bara stöder backend 'torch'."
+        )
+    real = os.path.realpath(path)
+    if os.path.commonpath([real, SWAP_MODELS_DIR]) != SWAP_MODELS_DIR:
+        raise HTTPException(status_code=400, detail=f"'{path}' ligger inte under {SWAP_MODELS_DIR}.")
+    if not os.path.isdir(real):
+        raise HTTPException(status_code=400, detail=f"Hittar ingen checkpoint i '{path}'.")
+    # Uppgiften sparas i registret (annars kan den skräpsamlas mitt i bytet);
+    # utfallet syns som swap_status/swap_error i /models
+    task = asyncio.create_task(asyncio.to_thread(models.swap, name, real, backend, warmup))
+    models.swap_tasks[name] = task
+
+    def done(t: asyncio.Task) -> None:
+        if not t.cancelled():
+            t.exception()  # redan sparat som swap_error
+        if models.swap_tasks.get(name) is t:
+            del models.swap_tasks[name]
+
+    task.add_done_callback(done)
+    return {"name": name, "path": real, "state": "loading"}
+
+class AnalysisError(Exception):
+    """
+    Fel i analysflödet som ska nå klienten med en viss HTTP-status.
+    """
+    def __init__(self, status_code: int, detail: str):
+        super().__init__(detail)
+        self.status_code = status_code
+        self.detail = detail
+
+def analysis_fingerprint(decoding: str | None, profile: str | None = None, faq_mode: str | None = None) -> dict:
+    """
+    Modellrevision, avkodning och genereringsinställningar per uppgift (och
+    FAQ-läget). En sparad analys återanvänds bara om fingeravtrycket är detsamma.
+    """
+    settings = GENERATION_PROFILES[profile or GENERATION_PROFILE]
+    fingerprint = {}
+    for task in ("extract", "compare", "faq"):
+        mode = task_decoding(task, decoding)
+        fingerprint[task] = [models.for_task(task).revision, mode, settings if mode == "beam" else None]
+    fingerprint["faq"].append(faq_mode or FAQ_MODE)
+    return fingerprint
+
+def all_booleans_resolved(aggregated: dict) -> bool:
+    """
+    Sant när varje boolean-nyckel redan är True – då kan ingen senare chunk
+    ändra OR-aggregatet.
+    """
+    return all(aggregated.get(key) is True for key in BOOLEAN_KEY_NAMES)
+
+async def iter_analysis(
+    text: str,
+    prefilter: bool | None = None,
+    early_exit: bool | None = None,
+    order: str | None = None,
+    decoding: str | None = None,
+    previous: str | None = None,
+    previous_text: str | None = None,
+    profile: str | None = None,
+    faq_mode: str | None = None
+):
+    """
+    Kör hela analysflödet och yieldar händelser allteftersom stegen blir klara:
+    'chunks', ett 'extract' per chunk (med löpande aggregat), 'compare', 'faq'
+    och till sist 'result' med samma innehåll som /analyze returnerar plus
+    'timings' (sekunder per steg). Kastar AnalysisError om texten inte går
+    att analysera. Parametrar som är None får serverns standard
+    (RELEVANCE_FILTER, EARLY_EXIT, EXTRACT_ORDER, EXTRACT_DECODING,
+    GENERATION_PROFILE, FAQ_MODE).
+
+    Inkrementellt: med previous (ett analysis_id) eller previous_text (en
+    tidigare version som analyserats förut) körs extract bara på chunkar
+    som inte finns oförändrade i den sparade analysen, och compare/faq bara
+    om aggregatet ändrats.
+    """
+    if prefilter is None:
+        prefilter = RELEVANCE_FILTER
+    if early_exit is None:
+        early_exit = EARLY_EXIT
+    order = order or EXTRACT_ORDER
+    if decoding == "constrained" and any(models.for_task(t).backend == "onnx" for t in CONSTRAINED_TASKS):
+        raise AnalysisError(400, "decoding=constrained stöds inte med backend 'onnx'.")
+    if profile is not None and profile_error(profile):
+        raise AnalysisError(400, profile_error(profile))
+    base = None
+    if previous or previous_text:
+        if analysis_store is None:
+            raise AnalysisError(400, "Inkrementell analys kräver ANALYSIS_STORE_PATH.")
+        if previous:
+            base = await asyncio.to_thread(analysis_store.get, previous)
+            if base is None:
+                raise AnalysisError(404, f"Okänd analys '{previous}'.")
+        else:
+            # Ingen sparad analys av den tidigare versionen: analysera allt
+            base = await asyncio.to_thread(analysis_store.latest_for_text, previous_text)
+    started = time.perf_counter()
+    timings: dict = {}
+    try:
+        async for event in _iter_analysis(
+            text, timings, prefilter, early_exit, order, decoding, profile, faq_mode, base
+        ):
+            if event["event"] == "result":
+                timings["total"] = time.perf_counter() - started
+                event["timings"] = timings
+            yield event
+    except AnalysisError:
+        ANALYZE_REQUESTS.inc(outcome="error")
+        raise
+    ANALYZE_REQUESTS.inc(outcome="ok")
+
+async def _iter_analysis(
+    text: str, timings: dict, prefilter: bool, early_exit: bool, order: str, decoding: str | None,
+    profile: str | None = None, faq_mode: str | None = None, base: dict | None = None
+):
+    # 1) Dela upp texten i chunkar om max CHUNK_MAX_TOKENS token vid stycke-/
+    #    rubrikgränser. Texten tokeniseras bara här; chunkarnas token återanvänds
+    #    som prompt.
+    with span("chunking", timings):
+        doc_chunks = await asyncio.to_thread(chunk_document, text)
+    chunks = [c.text for c in doc_chunks]
+    if not chunks:
+        raise AnalysisError(400, "Tom input‐text eller kunde ej chunkas.")
+    CHUNKS_PER_REQUEST.observe(len(chunks))
+
+    # 2) Relevansförfilter (valfritt): hoppa över chunkar utan nyckelord för
+    #    någon av boolean-nycklarna innan de når modellen.
+    selected = list(range(len(chunks)))
+    if prefilter:
+        with span("prefilter", timings):
+            scores = await asyncio.to_thread(relevance_index.score_chunks, chunks)
+        selected = select_chunks(scores, min_score=RELEVANCE_MIN_SCORE, top_k=RELEVANCE_TOP_K or None)
+        CHUNKS_SKIPPED.inc(len(chunks) - len(selected), reason="prefilter")
+    yield {"event": "chunks", "total": len(chunks), "selected": len(selected)}
+
+    # Köordning: de chunkar som troligast avgör booleanerna först, så att
+    # early exit slår till så tidigt som möjligt
+    if order in ("relevance", "heading") and len(selected) > 1:
+        with span("ordering", timings):
+            ranked = await asyncio.to_thread(priority_order, chunks, relevance_index, order)
+        keep = set(selected)
+        selected = [i for i in ranked if i in keep]
+
+    # Inkrementellt: chunkar vars text finns oförändrad i den tidigare
+    # analysen (samma modeller och avkodning) återanvänder dess extract-svar
+    fingerprint = analysis_fingerprint(decoding, profile, faq_mode)
+    if base is not None and base["fingerprint"] != fingerprint:
+        base = {**base, "chunks": [], "result": None}
+    hashes = [text_hash(c) for c in chunks] if analysis_store is not None else []
+    stored = {c["hash"]: c["output"] for c in base["chunks"] if c["output"] is not None} if base else {}
+    reused = [i for i in selected if stored and hashes[i] in stored]
+    pending = [i for i in selected if not (stored and hashes[i] in stored)]
+    CHUNKS_SKIPPED.inc(len(reused), reason="reused")
+
+    # 3) Kör extract per chunk och aggregera boolean‐fält allteftersom
+    #    chunkarna blir klara (i godtycklig ordning). Med early exit avbryts
+    #    resten när alla booleaner är True.
+    extract_started = time.perf_counter()
+    outputs: dict[int, str] = {}
+    timings["extract_chunks"] = [None] * len(chunks)
+    running: dict = {}
+    stopped_early = False
+    for i in reused:
+        outputs[i] = stored[hashes[i]]
+        data = parse_extract(outputs[i])
+        running = merge_extract(running, data)
+        yield {
+            "event": "extract",
+            "chunk": i,
+            "done": len(outputs),
+            "total": len(selected),
+            "result": data,
+            "aggregate": running,
+            "reused": True
+        }
+        if early_exit and all_booleans_resolved(running):
+            stopped_early = True
+            break
+
+    futures = [] if stopped_early else submit_cached(
+        [("extract", chunks[i]) for i in pending],
+        prompts=[extract_prompt(doc_chunks[i]) for i in pending],
+        decoding=decoding,
+        profile=profile
+    )
+
+    async def indexed(i: int, fut: asyncio.Future) -> tuple[int, str]:
+        return i, await fut
+
+    try:
+        for next_result in asyncio.as_completed([indexed(i, fut) for i, fut in zip(pending, futures)]):
+            i, out_str = await next_result
+            # Tid från att chunken köades tills dess svar var klart
+            elapsed = time.perf_counter() - extract_started
+            STAGE_SECONDS.observe(elapsed, stage="extract_chunk")
+            timings["extract_chunks"][i] = elapsed
+            outputs[i] = out_str
+            data = parse_extract(out_str)
+            running = merge_extract(running, data)
+            yield {
+                "event": "extract",
+                "chunk": i,
+                "done": len(outputs),
+                "total": len(selected),
+                "result": data,
+                "aggregate": running
+            }
+            if early_exit and all_booleans_resolved(running):
+                stopped_early = True
+                break
+    finally:
+        # Avbruten klient: släpp de chunkar som fortfarande ligger i kön
+        for fut in futures:
+            fut.cancel()
+
+    timings["extract"] = time.perf_counter() - extract_started
+    STAGE_SECONDS.observe(timings["extract"], stage="extract")
+
+    evaluated = sorted(outputs)
+    if stopped_early:
+        CHUNKS_SKIPPED.inc(len(selected) - len(evaluated), reason="early_exit")
+    chunk_stats = {
+        "total": len(chunks),
+        "evaluated": len(evaluated),
+        "skipped": len(chunks) - len(evaluated),
+        "reused": len([i for i in reused if i in outputs]),
+        "early_exit": stopped_early
+    }
+
+    # Slutligt aggregat i chunkordning (samma som utan streaming)
+    extract_agg = aggregate_outputs([outputs[i] for i in evaluated])
+    if not extract_agg:
+        raise AnalysisError(500, "Extract‐delen gav inget giltigt resultat på någon chunk.")
+
+    # 4) Kör compare och faq på det aggregerade extract‐resultatet. Prompten
+    #    tokeniseras en gång och båda uppgifterna köas samtidigt, i var sin
+    #    batch som körs parallellt. Oförändrat aggregat mot den
+    #    tidigare analysen: återanvänd dess compare/faq.
+    base_result = base["result"] if base is not None else None
+    aggregate_changed = base_result is None or base_result["extract"] != extract_agg
+    if aggregate_changed:
+        compare_input_json = json.dumps(extract_agg, ensure_ascii=False)
+        compare_data, faq_data = await compare_and_faq(
+            compare_input_json, timings, decoding, profile, faq_mode
+        )
+    else:
+        compare_data, faq_data = base_result["compare"], base_result["faq"]
+    yield {"event": "compare", "result": compare_data}
+    yield {"event": "faq", "result": faq_data}
+
+    # 5) Hela resultatet, sparat med extract-svaret per chunk så att nästa
+    #    version av dokumentet kan analyseras inkrementellt
+    result = {
+        "extract": extract_agg,
+        "compare": compare_data,
+        "faq": faq_data,
+        "chunks": chunk_stats
+    }
+    if base is not None:
+        result["incremental"] = {
+            "previous": base["id"],
+            "reused_chunks": chunk_stats["reused"],
+            "aggregate_changed": aggregate_changed
+        }
+    if analysis_store is not None:
+        result["analysis_id"] = await asyncio.to_thread(
+            analysis_store.save,
+            text,
+            fingerprint,
+            [{"hash": h, "output": outputs.get(i)} for i, h in enumerate(hashes)],
+            result,
+            base["id"] if base is not None else None
+        )
+    else:
+        # Utan analyslager får /faq bara aggregatet i minnet (FAQ_CACHE_SIZE)
+        result["analysis_id"] = uuid.uuid4().hex
+    remember_aggregate(result["analysis_id"], extract_agg)
+    yield {"event": "result", "result": result}
+
+@dataclass
+class AnalysisOptions:
+    """
+    Query-parametrarna som styr analysen, gemensamma för /analyze,
+    /analyze/batch, /analyze/stream och POST /jobs (som Depends()).
+    """
+    prefilter: bool | None = Query(
+        None, description="Hoppa över chunkar utan relevanta nyckelord (standard: RELEVANCE_FILTER)"
+    )
+    early_exit: bool | None = Query(
+        None, description="Sluta köra extract när alla booleaner är True (standard: EARLY_EXIT)"
+    )
+    order: Literal["document", "relevance", "heading"] | None = Query(
+        None, description="Ordning chunkarna körs i (standard: EXTRACT_ORDER)"
+    )
+    decoding: Literal["beam", "constrained"] | None = Query(
+        None, description="Avkodning för extract/compare (standard: EXTRACT_DECODING)"
+    )
+    profile: str | None = Query(
+        None, description="Genereringsprofil, se /generation/profiles (standard: GENERATION_PROFILE)"
+    )
+    faq: Literal["template", "model"] | None = Query(
+        None, description="FAQ från mallar eller genererad av modellen (standard: FAQ_MODE)"
+    )
+
+    def check(self) -> None:
+        """
+        Fel som kan upptäckas innan analysen köas (400).
+        """
+        if self.profile is not None and profile_error(self.profile):
+            raise HTTPException(status_code=400, detail=profile_error(self.profile))
+
+    def kwargs(self) -> dict:
+        """
+        Nyckelordsargument till iter_analysis.
+        """
+        options = asdict(self)
+        options["faq_mode"] = options.pop("faq")
+        return options
+
+@dataclass
+class IncrementalAnalysisOptions(AnalysisOptions):
+    """
+    AnalysisOptions för ett enskilt dokument, med en tidigare version att
+    analysera inkrementellt mot (i /analyze/batch anges den per dokument).
+    """
+    previous: str | None = Query(
+        None, description="analysis_id för en tidigare version av dokumentet: kör bara ändrade chunkar"
+    )
+
 @app.post(
     "/analyze",
     summary="Analysera en lång försäkringstext",
     description=(
         "Tar emot _ren text_ (Content-Type: text/plain), även >100 000 tecken. "
         "Delas upp i token‐baserade chunkar. Kör 'extract' på varje chunk, aggregerar "
-        "boolean‐fälten, och kör därefter 'compare' och 'faq' på det aggregerade resultatet."
+        "boolean‐fälten, och kör därefter 'compare' och 'faq' på det aggregerade resultatet. "
+        "Svaret har ett analysis_id; skicka det som previous med nästa version av dokumentet "
+        "så körs bara de chunkar som ändrats."
     )
 )
 async def analyze_long(
@@ -96,68 +1130,240 @@ async def analyze_long(
         media_type="text/plain",
         description="Hela försäkringstexten (ingen JSON‐inpackning), "
                     "kan vara mycket lång (>100 000 tecken)."
+    ),
+    timings: bool = Query(False, description="Ta med tid per steg (sekunder) i svaret"),
+    options: IncrementalAnalysisOptions = Depends()
+):
+    try:
+        result = await collect_analysis(text, **options.kwargs())
+    except AnalysisError as exc:
+        raise HTTPException(status_code=exc.status_code, detail=exc.detail)
+    if not timings:
+        result.pop("timings")
+    return result
+
+async def collect_analysis(text: str, **options) -> dict:
+    """
+    Kör iter_analysis till slut och returnerar resultatet (med 'timings').
+    """
+    result = None
+    async for event in iter_analysis(text, **options):
+        if event["event"] == "result":
+            result = {**event["result"], "timings": event["timings"]}
+    return result
+
+class BatchDocument(BaseModel):
+    id: str
+    text: str
+    # Tidigare version för inkrementell analys: ett analysis_id eller texten
+    previous: str | None = None
+    previous_text: str | None = None
+
+@app.post(
+    "/analyze/batch",
+    summary="Analysera flera försäkringstexter i ett anrop",
+    description=(
+        "Tar emot {\"documents\": [{\"id\": ..., \"text\": ...}, ...]}. Alla dokument analyseras "
+        "samtidigt, så deras chunkar delar extract-batchar och aggregaten delar compare- respektive faq-batchar "
+        "i schemaläggaren. Svaret har ett resultat eller ett fel per dokument – ett dokument som "
+        "misslyckas påverkar inte de andra."
     )
+)
+async def analyze_batch(
+    documents: list[BatchDocument] = Body(..., embed=True),
+    timings: bool = Query(False, description="Ta med tid per steg (sekunder) per dokument"),
+    options: AnalysisOptions = Depends()
 ):
-    # 1) Dela upp texten i chunkar om max 1 000 token.
-    chunks = chunk_text_by_tokens(text, max_tokens=1000)
-    if not chunks:
-        raise HTTPException(status_code=400, detail="Tom input‐text eller kunde ej chunkas.")
+    if not documents:
+        raise HTTPException(status_code=400, detail="Inga dokument att analysera.")
+    if len(documents) > ANALYZE_BATCH_MAX_DOCS:
+        raise HTTPException(
+            status_code=413, detail=f"Max {ANALYZE_BATCH_MAX_DOCS} dokument per anrop (fick {len(documents)})."
+        )
+    options.check()
+    started = time.perf_counter()
 
-    # 2) Kör extract per chunk och aggregera boolean‐fält
-    extract_agg = aggregate_extract(chunks)
-    if not extract_agg:
-        raise HTTPException(status_code=500, detail="Extract‐delen gav inget giltigt resultat på någon chunk.")
-
-    # 3) Kör compare på det aggregerade extract‐resultatet
-    compare_input_json = json.dumps(extract_agg, ensure_ascii=False)
-    compare_prompt     = f"compare: {compare_input_json}"
-    inputs = tokenizer(
-        compare_prompt,
-        return_tensors="pt",
-        truncation=True,
-        max_length=512
-    )
-    inputs = {k: v.to(device) for k, v in inputs.items()}
-    compare_outputs = model.generate(
-        **inputs,
-        max_length=512,
-        num_beams=4,
-        early_stopping=True
-    )
-    compare_json_str = tokenizer.batch_decode(compare_outputs, skip_special_tokens=True)[0]
-    try:
-        compare_data = json.loads(compare_json_str)
-    except (json.JSONDecodeError, TypeError):
-        compare_data = {"compare_raw": compare_json_str}
-
-    # 4) Kör faq på samma aggregerade extract‐data
-    faq_prompt = f"faq: {compare_input_json}"
-    inputs = tokenizer(
-        faq_prompt,
-        return_tensors="pt",
-        truncation=True,
-        max_length=512
-    )
-    inputs = {k: v.to(device) for k, v in inputs.items()}
-    faq_outputs = model.generate(
-        **inputs,
-        max_length=1024,
-        num_beams=4,
-        early_stopping=True
-    )
-    faq_json_str = tokenizer.batch_decode(faq_outputs, skip_special_tokens=True)[0]
-    try:
-        faq_data = json.loads(faq_json_str)
-    except (json.JSONDecodeError, TypeError):
-        faq_data = {"faq_raw": faq_json_str}
+    async def analyze_one(doc: BatchDocument) -> dict:
+        try:
+            result = await collect_analysis(
+                doc.text, previous=doc.previous, previous_text=doc.previous_text, **options.kwargs()
+            )
+        except AnalysisError as exc:
+            return {"id": doc.id, "error": {"status_code": exc.status_code, "detail": exc.detail}}
+        except Exception as exc:  # noqa: BLE001 – felet isoleras till dokumentet
+            ANALYZE_REQUESTS.inc(outcome="error")
+            return {"id": doc.id, "error": {"status_code": 500, "detail": f"{type(exc).__name__}: {exc}"}}
+        if not timings:
+            result.pop("timings")
+        return {"id": doc.id, "result": result}
 
-    # 5) Returnera allt som JSON
+    results = await asyncio.gather(*(analyze_one(doc) for doc in documents))
+    failed = sum(1 for r in results if "error" in r)
+    response = {"documents": results, "succeeded": len(results) - failed, "failed": failed}
+    if timings:
+        response["timings"] = {"total": time.perf_counter() - started}
+    return response
+
+@app.get(
+    "/analyses/{analysis_id}",
+    summary="Hämta en sparad analys",
+    description="Resultatet av en tidigare analys (se analysis_id i svaret från /analyze)."
+)
+async def get_analysis(analysis_id: str):
+    if analysis_store is None:
+        raise HTTPException(status_code=404, detail="Analyser sparas inte (ANALYSIS_STORE_PATH).")
+    stored = await asyncio.to_thread(analysis_store.get, analysis_id)
+    if stored is None:
+        raise HTTPException(status_code=404, detail=f"Okänd analys '{analysis_id}'.")
     return {
-        "extract": extract_agg,
-        "compare": compare_data,
-        "faq": faq_data
+        "id": stored["id"],
+        "parent": stored["parent"],
+        "created": stored["created"],
+        "result": stored["result"]
     }
 
+# Aggregaten för de senast använda analyserna (analysis_id → extract), så att
+# /faq inte behöver gå till SQLite för varje fråga. Utan ANALYSIS_STORE_PATH
+# är detta det enda stället /faq kan hitta en analys.
+_faq_aggregates: OrderedDict[str, dict] = OrderedDict()
+
+def remember_aggregate(analysis_id: str, extract_agg: dict) -> None:
+    _faq_aggregates[analysis_id] = extract_agg
+    _faq_aggregates.move_to_end(analysis_id)
+    while len(_faq_aggregates) > FAQ_CACHE_SIZE:
+        _faq_aggregates.popitem(last=False)
+
+async def stored_aggregate(analysis_id: str) -> dict | None:
+    extract_agg = _faq_aggregates.get(analysis_id)
+    if extract_agg is None:
+        if analysis_store is None:
+            return None
+        result = await asyncio.to_thread(analysis_store.result, analysis_id)
+        if result is None:
+            return None
+        extract_agg = result["extract"]
+    remember_aggregate(analysis_id, extract_agg)
+    return extract_agg
+
+@app.get(
+    "/faq",
+    summary="Besvara en fråga mot en tidigare analys",
+    description=(
+        "Svarar på en enskild fråga (t.ex. \"Omfattar försäkringen tandvård?\") utifrån "
+        "booleanerna i en tidigare analys, med samma svarsmallar som FAQ-blocket – ingen generering. "
+        "Utan ANALYSIS_STORE_PATH hittas bara de FAQ_CACHE_SIZE senaste analyserna i processen."
+    )
+)
+async def faq_answer(
+    analysis_id: str = Query(..., description="analysis_id från /analyze"),
+    question: str = Query(..., min_length=1, description="Frågan")
+):
+    extract_agg = await stored_aggregate(analysis_id)
+    if extract_agg is None:
+        raise HTTPException(status_code=404, detail=f"Okänd analys '{analysis_id}'.")
+    answer = faq_engine.answer(extract_agg, question)
+    if answer is None:
+        raise HTTPException(status_code=422, detail="Frågan gäller ingen känd förmån.")
+    return {"analysis_id": analysis_id, **answer}
+
+def format_event(event: dict, fmt: str) -> str:
+    """
+    Serialiserar en händelse som en NDJSON-rad eller ett Server-Sent Event.
+    """
+    data = json.dumps(event, ensure_ascii=False)
+    if fmt == "sse":
+        return f"event: {event['event']}\ndata: {data}\n\n"
+    return data + "\n"
+
+@app.post(
+    "/analyze/stream",
+    summary="Analysera en lång försäkringstext med strömmat svar",
+    description=(
+        "Som /analyze, men resultatet strömmas: först antalet chunkar, sedan ett "
+        "'extract'-event per chunk (med löpande aggregat) när den blir klar, därefter "
+        "'compare', 'faq' och till sist 'result'. Vid fel skickas ett 'error'-event. "
+        "format=ndjson (standard) ger en JSON-rad per händelse, format=sse ger Server-Sent Events."
+    )
+)
+async def analyze_stream(
+    text: str = Body(
+        ...,
+        media_type="text/plain",
+        description="Hela försäkringstexten (ingen JSON‐inpackning)."
+    ),
+    format: Literal["ndjson", "sse"] = Query("ndjson", description="ndjson eller sse"),
+    options: IncrementalAnalysisOptions = Depends()
+):
+    async def body():
+        try:
+            async for event in iter_analysis(text, **options.kwargs()):
+                yield format_event(event, format)
+        except AnalysisError as exc:
+            yield format_event(
+                {"event": "error", "status_code": exc.status_code, "detail": exc.detail}, format
+            )
+
+    media_type = "text/event-stream" if format == "sse" else "application/x-ndjson"
+    return StreamingResponse(body(), media_type=media_type)
+
+# ----------------------------------------------------------------------------------
+# Jobb-API för mycket långa dokument
+# ----------------------------------------------------------------------------------
+job_manager = JobManager(
+    SqliteJobBackend(JOB_DB_PATH, ttl=JOB_TTL_S) if JOB_BACKEND == "sqlite"
+    else InMemoryJobBackend(ttl=JOB_TTL_S, max_finished=JOB_MAX_FINISHED),
+    iter_analysis,
+    workers=JOB_WORKERS,
+    max_queued=JOB_QUEUE_SIZE
+)
+
+@app.post(
+    "/jobs",
+    status_code=202,
+    summary="Starta ett analysjobb",
+    description=(
+        "Som /analyze (samma query-parametrar), men svarar direkt med ett jobb-id. Jobbet körs i bakgrunden av "
+        "en begränsad pool arbetare; status och delresultat hämtas med GET /jobs/{id}. "
+        "Svarar 429 om jobbkön är full."
+    )
+)
+async def create_job(
+    text: str = Body(
+        ...,
+        media_type="text/plain",
+        description="Hela försäkringstexten (ingen JSON‐inpackning)."
+    ),
+    options: IncrementalAnalysisOptions = Depends()
+):
+    options.check()
+    try:
+        job = await job_manager.submit(text, options.kwargs())
+    except QueueFullError as exc:
+        raise HTTPException(status_code=429, detail=str(exc))
+    return {"id": job.id, "status": job.status}
+
+@app.get(
+    "/jobs/{job_id}",
+    summary="Status och (del)resultat för ett analysjobb",
+    description="partial innehåller senaste händelsen per steg, timings analysens sekunder per steg."
+)
+async def get_job(job_id: str):
+    job = await job_manager.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Okänt jobb‐id.")
+    return job.public()
+
+@app.delete(
+    "/jobs/{job_id}",
+    summary="Avbryt ett analysjobb",
+    description="Köade jobb avbryts direkt (cancelled); för jobb som körs svarar den cancelling tills jobbet stannat."
+)
+async def cancel_job(job_id: str):
+    job = await job_manager.cancel(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Okänt jobb‐id.")
+    return {"id": job.id, "status": job.status}
+
 if __name__ == "__main__":
     import uvicorn
     uvicorn.run(app, host="0.0.0.0", port=8000)
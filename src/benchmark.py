@@ -0,0 +1,358 @@
+# src/benchmark.py
+
+import argparse
+import json
+import os
+import platform
+import resource
+import sys
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+# 1) Paths och standardinställningar
+BASE_DIR        = Path(__file__).parent.parent
+RAW_DIR         = BASE_DIR / "data" / "raw"
+OUTPUT_PATH     = BASE_DIR / "bench_output.json"
+TINY_TOKENIZER  = "birgermoell/t5-base-swedish"
+
+def percentiles(values: list[float]) -> dict:
+    """
+    p50/p90/p99, medel och summa för en lista latenser (sekunder).
+    """
+    if not values:
+        return {"count": 0}
+    s = sorted(values)
+
+    def pct(p: float) -> float:
+        k = (len(s) - 1) * p
+        lo, hi = int(k), min(int(k) + 1, len(s) - 1)
+        return s[lo] + (s[hi] - s[lo]) * (k - lo)
+
+    return {
+        "count": len(s),
+        "p50": pct(0.50),
+        "p90": pct(0.90),
+        "p99": pct(0.99),
+        "mean": sum(s) / len(s),
+        "total": sum(s),
+    }
+
+def peak_rss_mb() -> float:
+    # ru_maxrss är i kB på Linux och i byte på macOS
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss / (1024 * 1024) if sys.platform == "darwin" else rss / 1024
+
+def make_tiny_model(tokenizer_name: str) -> str:
+    """
+    Skapar en liten slumpinitierad T5-modell (med riktig svensk tokenizer) i en
+    temporär katalog, så att pipelinen kan mätas utan den finjusterade checkpointen.
+    """
+    from transformers import AutoTokenizer, T5Config, T5ForConditionalGeneration
+
+    tokenizer = AutoTokenizer.from_pretrained(tokenizer_name)
+    config = T5Config(
+        vocab_size=len(tokenizer),
+        d_model=64,
+        d_ff=128,
+        d_kv=16,
+        num_layers=2,
+        num_decoder_layers=2,
+        num_heads=4,
+        pad_token_id=tokenizer.pad_token_id,
+        eos_token_id=tokenizer.eos_token_id,
+        decoder_start_token_id=tokenizer.pad_token_id,
+    )
+    path = tempfile.mkdtemp(prefix="tiny-t5-")
+    T5ForConditionalGeneration(config).save_pretrained(path)
+    tokenizer.save_pretrained(path)
+    return path
+
+def load_documents(raw_dir: Path, limit: int | None) -> dict[str, str]:
+    docs = {p.stem: p.read_text(encoding="utf-8") for p in sorted(raw_dir.glob("*.txt"))}
+    if limit:
+        docs = dict(list(docs.items())[:limit])
+    return docs
+
+def bench_pipeline(
+    docs: dict[str, str], batch_size: int, max_chunks: int | None, decoding: str = "beam",
+    profile: str | None = None, faq_mode: str | None = None
+) -> dict:
+    """
+    Kör pipelinens steg (chunkning, extract per chunk, compare, faq) direkt mot
+    funktionerna i api.py och mäter varje steg för sig. decoding gäller
+    extract och compare (faq genereras alltid med beam search). faq_mode
+    (standard: FAQ_MODE) avgör som i API:t om faq renderas från mallarna
+    eller genereras av modellen.
+    """
+    import api
+
+    stage_latencies: dict[str, list[float]] = {
+        "chunking": [], "extract_chunk": [], "extract_document": [], "compare": [], "faq": []
+    }
+    tokens = {"input": 0, "generated": 0}
+    stage_seconds = {"chunking": 0.0, "generation": 0.0}
+    per_doc = {}
+
+    def count_tokens(texts: list[str]) -> int:
+        return sum(len(ids) for ids in api.models.for_task("extract").tokenizer(texts, add_special_tokens=False)["input_ids"])
+
+    for name, text in docs.items():
+        print(f">>> {name} ({len(text)} tecken) …")
+        t0 = time.perf_counter()
+        chunks = api.chunk_document(text)
+        t_chunk = time.perf_counter() - t0
+        stage_latencies["chunking"].append(t_chunk)
+        stage_seconds["chunking"] += t_chunk
+        tokens["input"] += chunks[-1].token_end if chunks else 0
+        if max_chunks:
+            chunks = chunks[:max_chunks]
+
+        # Extract i mikrobatchar; latens per chunk = batchens tid / antal chunkar
+        outputs = []
+        t_doc = time.perf_counter()
+        for start in range(0, len(chunks), batch_size):
+            batch = chunks[start:start + batch_size]
+            t0 = time.perf_counter()
+            out = api.generate_batch(
+                [api.extract_prompt(c) for c in batch],
+                max_input_length=api.TASK_MAX_INPUT_LENGTH["extract"],
+                max_length=api.TASK_MAX_LENGTH["extract"],
+                batch_size=batch_size,
+                decoding=decoding,
+                profile=profile
+            )
+            dt = time.perf_counter() - t0
+            stage_latencies["extract_chunk"].extend([dt / len(batch)] * len(batch))
+            outputs.extend(out)
+        t_extract = time.perf_counter() - t_doc
+        stage_latencies["extract_document"].append(t_extract)
+        tokens["generated"] += count_tokens(outputs)
+
+        extract_agg = api.aggregate_outputs(outputs)
+        compare_input_json = json.dumps(extract_agg, ensure_ascii=False)
+        doc_stats = {"chars": len(text), "chunks": len(chunks), "chunking_s": t_chunk, "extract_s": t_extract}
+        doc_stats["faq_mode"] = "template" if api.faq_template_applies(faq_mode, compare_input_json) else "model"
+        for task in ("compare", "faq"):
+            t0 = time.perf_counter()
+            if task == "faq" and doc_stats["faq_mode"] == "template":
+                api.faq_engine.render(extract_agg)
+                dt = time.perf_counter() - t0
+                stage_latencies[task].append(dt)
+                doc_stats[f"{task}_s"] = dt
+                continue
+            [out] = api.generate_batch(
+                [api.task_prompt(task, compare_input_json)],
+                max_input_length=api.TASK_MAX_INPUT_LENGTH[task],
+                max_length=api.TASK_MAX_LENGTH[task],
+                batch_size=1,
+                decoding=api.task_decoding(task, decoding),
+                entry=api.models.for_task(task),
+                profile=profile
+            )
+            dt = time.perf_counter() - t0
+            stage_latencies[task].append(dt)
+            tokens["generated"] += count_tokens([out])
+            doc_stats[f"{task}_s"] = dt
+        stage_seconds["generation"] += t_extract + doc_stats["compare_s"]
+        if doc_stats["faq_mode"] == "model":
+            stage_seconds["generation"] += doc_stats["faq_s"]
+        per_doc[name] = doc_stats
+
+    return {
+        "stages": {stage: percentiles(v) for stage, v in stage_latencies.items()},
+        "chunks_per_document": percentiles([d["chunks"] for d in per_doc.values()]),
+        "tokens_per_second": {
+            "tokenization_input": tokens["input"] / stage_seconds["chunking"] if stage_seconds["chunking"] else None,
+            "generation_output": tokens["generated"] / stage_seconds["generation"] if stage_seconds["generation"] else None,
+        },
+        "tokens": tokens,
+        "documents": per_doc,
+    }
+
+def bench_decoding(docs: dict[str, str], batch_size: int, max_chunks: int | None) -> dict:
+    """
+    Kör extract på samma chunkar med fri beam search och med mallifyllning
+    (decoding="constrained") och jämför tid, andel giltig JSON och hur ofta
+    boolean-fälten blir desamma.
+    """
+    import api
+
+    chunks = []
+    for text in docs.values():
+        chunks.extend(api.chunk_document(text)[:max_chunks or None])
+    prompts = [api.extract_prompt(c) for c in chunks]
+    report = {"chunks": len(chunks)}
+    outputs = {}
+    for mode in api.DECODING_MODES:
+        print(f">>> extract med decoding={mode} ({len(chunks)} chunkar) …")
+        token_counts: list[int] = []
+        t0 = time.perf_counter()
+        outputs[mode] = api.generate_batch(
+            prompts,
+            max_input_length=api.TASK_MAX_INPUT_LENGTH["extract"],
+            max_length=api.TASK_MAX_LENGTH["extract"],
+            batch_size=batch_size,
+            token_counts=token_counts,
+            decoding=mode
+        )
+        dt = time.perf_counter() - t0
+        parsed = [api.parse_extract(o) for o in outputs[mode]]
+        report[mode] = {
+            "seconds": dt,
+            "seconds_per_chunk": dt / len(chunks) if chunks else None,
+            "decoder_tokens": sum(token_counts),
+            "valid_json_ratio": sum(1 for d in parsed if d) / len(parsed) if parsed else None,
+        }
+
+    keys = [bk["key"] for bk in api.BOOLEAN_KEYS]
+    same = total = 0
+    for beam_out, constrained_out in zip(outputs["beam"], outputs["constrained"]):
+        beam, constrained = api.parse_extract(beam_out), api.parse_extract(constrained_out)
+        if not beam:
+            continue
+        for k in keys:
+            if isinstance(beam.get(k), bool):
+                total += 1
+                same += beam[k] == constrained.get(k)
+    report["boolean_agreement"] = same / total if total else None
+    if report["constrained"]["seconds"]:
+        report["speedup"] = report["beam"]["seconds"] / report["constrained"]["seconds"]
+    return report
+
+def start_local_server(port: int) -> str:
+    """
+    Startar FastAPI-appen med uvicorn i en bakgrundstråd och returnerar bas-URL:en.
+    """
+    import uvicorn
+    import api
+
+    server = uvicorn.Server(uvicorn.Config(api.app, host="127.0.0.1", port=port, log_level="warning"))
+    threading.Thread(target=server.run, daemon=True).start()
+    while not server.started:
+        time.sleep(0.05)
+    return f"http://127.0.0.1:{port}"
+
+def bench_http(
+    base_url: str, docs: dict[str, str], concurrency: int, repeat: int, timeout: float, query: str = ""
+) -> dict:
+    """
+    End-to-end-last mot POST /analyze med concurrency samtidiga klienter.
+    query skickas med som query-sträng (t.ex. "early_exit=true&order=relevance");
+    chunkar totalt respektive faktiskt utvärderade summeras från svaren.
+    """
+    url = base_url.rstrip("/") + "/analyze" + (f"?{query}" if query else "")
+    work = [(name, text) for _ in range(repeat) for name, text in docs.items()]
+    chunk_keys = ("total", "evaluated")
+
+    def post(item: tuple[str, str]) -> tuple[str, float, int | str, dict]:
+        name, text = item
+        req = urllib.request.Request(
+            url, data=text.encode("utf-8"), method="POST",
+            headers={"Content-Type": "text/plain; charset=utf-8"}
+        )
+        t0 = time.perf_counter()
+        chunks = {}
+        try:
+            with urllib.request.urlopen(req, timeout=timeout) as resp:
+                body = json.loads(resp.read())
+                status = resp.status
+            chunks = body.get("chunks", {})
+        except urllib.error.HTTPError as exc:
+            status = exc.code
+        except (urllib.error.URLError, TimeoutError) as exc:
+            status = type(exc).__name__
+        return name, time.perf_counter() - t0, status, chunks
+
+    t0 = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        results = list(pool.map(post, work))
+    wall = time.perf_counter() - t0
+
+    # Summeras här i huvudtråden, inte i arbetstrådarna
+    chunk_totals = {k: sum(chunks.get(k, 0) for *_, chunks in results) for k in chunk_keys}
+    ok = [dt for _, dt, status, _ in results if status == 200]
+    return {
+        "url": url,
+        "concurrency": concurrency,
+        "requests": len(results),
+        "errors": {str(s): sum(1 for _, _, st, _ in results if st == s) for s in {st for _, _, st, _ in results if st != 200}},
+        "latency_s": percentiles(ok),
+        "requests_per_second": len(results) / wall if wall else None,
+        "wall_s": wall,
+        "chunks": chunk_totals,
+        "chunks_evaluated_ratio": (
+            chunk_totals["evaluated"] / chunk_totals["total"] if chunk_totals["total"] else None
+        ),
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark av analyspipelinen över data/raw.")
+    parser.add_argument("--tiny", action="store_true",
+                        help="Använd en liten slumpinitierad T5 i stället för den finjusterade modellen")
+    parser.add_argument("--tokenizer", default=TINY_TOKENIZER, help="Tokenizer för --tiny")
+    parser.add_argument("--raw-dir", type=Path, default=RAW_DIR)
+    parser.add_argument("--limit", type=int, default=None, help="Max antal dokument")
+    parser.add_argument("--max-chunks", type=int, default=None, help="Max antal chunkar per dokument")
+    parser.add_argument("--batch-size", type=int, default=int(os.environ.get("EXTRACT_BATCH_SIZE", "8")))
+    parser.add_argument("--http", default=None,
+                        help="Lastläge: bas-URL till en körande server, eller 'local' för att starta appen här")
+    parser.add_argument("--port", type=int, default=8765, help="Port för --http local")
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--repeat", type=int, default=1, help="Antal varv över dokumenten i lastläget")
+    parser.add_argument("--timeout", type=float, default=600.0)
+    parser.add_argument("--query", default="",
+                        help="Query-sträng till /analyze i lastläget, t.ex. 'early_exit=true&order=heading'")
+    parser.add_argument("--decoding", choices=["beam", "constrained", "compare"], default="beam",
+                        help="Avkodning för extract/compare; 'compare' jämför beam search mot mallifyllning")
+    parser.add_argument("--profile", default=None,
+                        help="Genereringsprofil (standard: GENERATION_PROFILE), se även eval_profiles.py")
+    parser.add_argument("--faq", choices=["template", "model"], default=None,
+                        help="FAQ-läge i pipelineläget (standard: FAQ_MODE)")
+    parser.add_argument("--output", type=Path, default=OUTPUT_PATH)
+    args = parser.parse_args()
+
+    # api läser MODEL_PATH när den importeras (modellen laddas först vid första
+    # anropet), så den måste sättas innan dess
+    if args.tiny:
+        os.environ["MODEL_PATH"] = make_tiny_model(args.tokenizer)
+
+    docs = load_documents(args.raw_dir, args.limit)
+    report = {
+        "config": {
+            "model_path": os.environ.get("MODEL_PATH", "models/all-tasks-t5-swedish"),
+            "tiny": args.tiny,
+            "backend": os.environ.get("INFERENCE_BACKEND", "torch"),
+            "batch_size": args.batch_size,
+            "max_chunks": args.max_chunks,
+            "decoding": args.decoding,
+            "profile": args.profile or os.environ.get("GENERATION_PROFILE", "accurate"),
+            "faq_mode": args.faq or os.environ.get("FAQ_MODE", "model"),
+            "documents": list(docs),
+            "python": platform.python_version(),
+            "machine": platform.machine(),
+            "cpu_count": os.cpu_count(),
+        }
+    }
+    if args.http:
+        base_url = start_local_server(args.port) if args.http == "local" else args.http
+        report["http"] = bench_http(
+            base_url, docs, args.concurrency, args.repeat, args.timeout, args.query
+        )
+    elif args.decoding == "compare":
+        report["decoding"] = bench_decoding(docs, args.batch_size, args.max_chunks)
+    else:
+        report["pipeline"] = bench_pipeline(
+            docs, args.batch_size, args.max_chunks, args.decoding, args.profile, args.faq
+        )
+    report["peak_rss_mb"] = peak_rss_mb()
+
+    args.output.write_text(json.dumps(report, ensure_ascii=False, indent=2, sort_keys=True), encoding="utf-8")
+    print(f"✅ Benchmark sparad till {args.output}")
+
+if __name__ == "__main__":
+    main()
@@ -1,6 +1,6 @@
 # src/build_extract_relevant.py
 
-import json
+from functools import lru_cache
 from pathlib import Path
 
 # 1) Sätt sökvägar
@@ -9,53 +9,27 @@ RAW_DIR       = BASE_DIR / "data" / "raw"
 DATASET_PATH  = BASE_DIR / "data" / "dataset.jsonl"
 OUTPUT_PATH   = BASE_DIR / "data" / "extract_relevant.jsonl"
 
+@lru_cache(maxsize=1)
+def raw_index():
+    from build_pipeline import RawIndex
+    return RawIndex(RAW_DIR)
+
 def find_raw_file(company_name: str) -> Path:
     """
     Försöker matcha ett försäkringsbolagsnamn (t.ex. "Folksam Bas") 
-    till en fil i data/raw/ (t.ex. Folksam.txt).
+    till en fil i data/raw/ (t.ex. Folksam.txt). data/raw/ listas bara en gång.
     """
-    key = company_name.split()[0].lower()  # "Folksam Bas" → "folksam"
-    for txt in RAW_DIR.glob("*.txt"):
-        if txt.stem.lower().startswith(key):
-            return txt
-    raise FileNotFoundError(f"Ingen råtext hittades för '{company_name}' (letade efter prefix '{key}').")
+    return raw_index().find(company_name)
 
 def build_extract_relevant():
+    """
+    Bygger extract_relevant.jsonl (och övriga träningsfiler) med den
+    gemensamma, inkrementella byggkedjan i build_pipeline.py.
+    """
     # Kontrollera att raw-mappen finns
     RAW_DIR.mkdir(parents=True, exist_ok=True)
-    if not RAW_DIR.exists():
-        raise RuntimeError(f"Råtexts-mappen saknas: {RAW_DIR}")
-
-    with open(DATASET_PATH, encoding="utf-8") as ds_f, \
-         open(OUTPUT_PATH, "w", encoding="utf-8") as out_f:
-
-        for line in ds_f:
-            line = line.strip()
-            if not line:
-                continue
-
-            entry = json.loads(line)
-            försäkring = entry.get("försäkring")
-            if not försäkring:
-                continue  # hoppa om ingen "försäkring" finns
-
-            # 2) Hitta och läs in hela råtexten för detta försäkringsbolag
-            raw_path = find_raw_file(försäkring)
-            raw_text = raw_path.read_text(encoding="utf-8")
-
-            # 3) Target är hela JSON‐objektet som sträng
-            target_str = json.dumps(entry, ensure_ascii=False)
-
-            # 4) Skriv ut i extract_relevant.jsonl
-            record = {
-                "raw":    raw_text,
-                "target": target_str
-            }
-            out_f.write(json.dumps(record, ensure_ascii=False) + "\n")
-
-    # Skriv ut hur många rader som skapades
-    n = sum(1 for _ in open(OUTPUT_PATH, encoding="utf-8"))
-    print(f"✅ Skapade {OUTPUT_PATH} med {n} rader.")
+    from build_pipeline import build, report
+    report(build())
 
 if __name__ == "__main__":
     build_extract_relevant()
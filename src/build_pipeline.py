@@ -0,0 +1,270 @@
+# src/build_pipeline.py
+
+import argparse
+import hashlib
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+from preprocess import BOOLEAN_KEYS, FAQ_TEMPLATES, render_answer
+
+# 1) Paths
+BASE_DIR      = Path(__file__).parent.parent
+RAW_DIR       = BASE_DIR / "data" / "raw"
+DATASET_PATH  = BASE_DIR / "data" / "dataset.jsonl"
+EXTRACT_PATH  = BASE_DIR / "data" / "extract_relevant.jsonl"
+FAQ_PATH      = BASE_DIR / "data" / "dataset_faq.jsonl"
+OUTPUT_PATH   = BASE_DIR / "data" / "all_tasks.jsonl"
+MANIFEST_PATH = BASE_DIR / "data" / "build_manifest.json"
+
+# Utfilerna och de delar (i ordning) som varje fil består av. En del är en
+# följd av segment, ett per rad i dataset.jsonl.
+OUTPUTS = {
+    "extract_relevant": (EXTRACT_PATH, ["extract_relevant"]),
+    "dataset_faq":      (FAQ_PATH,     ["faq_pairs"]),
+    "all_tasks":        (OUTPUT_PATH,  ["extract", "compare", "faq"]),
+}
+
+# Ändras byggkoden eller FAQ-mallarna byggs allt om
+_SOURCES = (Path(__file__), Path(__file__).parent / "preprocess.py")
+
+
+def sha256_bytes(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()
+
+
+def code_version() -> str:
+    return sha256_bytes(b"".join(p.read_bytes() for p in _SOURCES))
+
+
+def line(record: dict) -> str:
+    return json.dumps(record, ensure_ascii=False) + "\n"
+
+
+class RawIndex:
+    """
+    Index över data/raw/: katalogen listas en gång, varje fil läses (och
+    hashas) högst en gång. Hashen återanvänds från manifestet när filens
+    storlek och ändringstid är oförändrade, så att oförändrade filer inte
+    behöver läsas alls.
+    """
+
+    def __init__(self, raw_dir: Path = RAW_DIR, known: dict | None = None):
+        self.files = sorted(raw_dir.glob("*.txt")) if raw_dir.exists() else []
+        self.known = known or {}
+        self.stats: dict[str, dict] = {}
+        self._texts: dict[Path, str] = {}
+        self._lock = threading.Lock()
+
+    def find(self, company_name: str) -> Path:
+        """
+        Samma matchning som build_extract_relevant.find_raw_file: första
+        filen vars namn börjar med första ordet i försäkringens namn.
+        """
+        key = company_name.split()[0].lower()
+        for txt in self.files:
+            if txt.stem.lower().startswith(key):
+                return txt
+        raise FileNotFoundError(f"Ingen råtext hittades för '{company_name}' (letade efter prefix '{key}').")
+
+    def read(self, path: Path) -> str:
+        with self._lock:
+            if path not in self._texts:
+                data = path.read_bytes()
+                self._texts[path] = data.decode("utf-8")
+                self._remember(path, sha256_bytes(data))
+            return self._texts[path]
+
+    def digest(self, path: Path) -> str:
+        st = path.stat()
+        known = self.known.get(path.name)
+        if known and known["size"] == st.st_size and known["mtime_ns"] == st.st_mtime_ns:
+            self.stats[path.name] = known
+            return known["sha256"]
+        self.read(path)
+        return self.stats[path.name]["sha256"]
+
+    def _remember(self, path: Path, digest: str) -> None:
+        st = path.stat()
+        self.stats[path.name] = {"sha256": digest, "size": st.st_size, "mtime_ns": st.st_mtime_ns}
+
+
+def entry_segments(entry: dict, raw_text: str | None) -> dict[str, str]:
+    """
+    Raderna (som text) som en post i dataset.jsonl ger i varje del – samma
+    innehåll som build_extract_relevant.py, preprocess.py och
+    build_all_tasks.py skriver.
+    """
+    segments = {part: "" for _, parts in OUTPUTS.values() for part in parts}
+    entry_json = json.dumps(entry, ensure_ascii=False)
+
+    if raw_text is not None:
+        segments["extract_relevant"] = line({"raw": raw_text, "target": entry_json})
+        segments["extract"] = line({"input": f"extract: {raw_text.replace(chr(10), ' ')}", "target": entry_json})
+
+    if "input" in entry and "output" in entry:
+        segments["compare"] = line({"input": f"compare: {entry['input'].replace(chr(10), ' ')}", "target": entry["output"]})
+    else:
+        segments["compare"] = line({"input": f"compare: {entry_json}", "target": entry_json})
+
+    if "försäkring" in entry:
+        pairs = []
+        for bk in BOOLEAN_KEYS:
+            if bk["label"] not in FAQ_TEMPLATES:
+                continue
+            for question in FAQ_TEMPLATES[bk["label"]]:
+                answer = render_answer(question, bk["label"], entry.get(bk["key"], False), entry["försäkring"])
+                pairs.append((question, answer))
+        segments["faq_pairs"] = "".join(line({"input": q, "output": a}) for q, a in pairs)
+        segments["faq"] = "".join(line({"input": f"faq: {q}", "target": a}) for q, a in pairs)
+    return segments
+
+
+def load_manifest(path: Path) -> dict:
+    try:
+        return json.loads(path.read_text(encoding="utf-8"))
+    except (FileNotFoundError, json.JSONDecodeError):
+        return {}
+
+
+def reusable_outputs(manifest: dict, version: str) -> dict[str, bytes]:
+    """
+    Föregående byggs utfiler, om de är orörda sedan dess (samma storlek och
+    ändringstid, annars samma hash, som i manifestet) och byggda med samma
+    kod – deras segment kan då kopieras.
+    """
+    if manifest.get("version") != version:
+        return {}
+    previous = {}
+    for name, (path, _) in OUTPUTS.items():
+        info = manifest.get("outputs", {}).get(name)
+        if info is None or not path.exists():
+            continue
+        st = path.stat()
+        data = path.read_bytes()
+        if (st.st_size, st.st_mtime_ns) == (info["size"], info["mtime_ns"]) or sha256_bytes(data) == info["sha256"]:
+            previous[name] = data
+    return previous
+
+
+def build(workers: int | None = None, force: bool = False, manifest_path: Path = MANIFEST_PATH) -> dict:
+    """
+    Bygger extract_relevant.jsonl, dataset_faq.jsonl och all_tasks.jsonl i
+    ett svep över dataset.jsonl. Varje post nycklas på hash av posten (och
+    av råtexten för extract); poster vars nyckel finns i manifestet kopieras
+    som färdiga byte från förra bygget, övriga byggs parallellt. Utfilerna
+    skrivs strömmande till temporära filer som byter namn när de är klara.
+    """
+    started = time.perf_counter()
+    version = code_version()
+    manifest = {} if force else load_manifest(manifest_path)
+    previous = reusable_outputs(manifest, version)
+    raw_index = RawIndex(RAW_DIR, manifest.get("raw", {}))
+
+    # Poster i filordning, med nyckel per post
+    entries = []
+    for raw_line in DATASET_PATH.read_text(encoding="utf-8").splitlines():
+        if not raw_line.strip():
+            continue
+        entry = json.loads(raw_line)
+        raw_path = raw_index.find(entry["försäkring"]) if entry.get("försäkring") else None
+        raw_hash = raw_index.digest(raw_path) if raw_path else ""
+        key = sha256_bytes((raw_line.strip() + "\x00" + raw_hash).encode("utf-8"))
+        entries.append((key, entry, raw_path))
+
+    old_segments = manifest.get("segments", {})
+
+    def cached(key: str) -> dict[str, bytes] | None:
+        spans = old_segments.get(key)
+        if spans is None:
+            return None
+        out = {}
+        for name, (_, parts) in OUTPUTS.items():
+            if name not in previous:
+                return None
+            for part in parts:
+                offset, length = spans[part]
+                out[part] = previous[name][offset:offset + length]
+        return out
+
+    def make(item: tuple) -> dict[str, bytes]:
+        key, entry, raw_path = item
+        segments = cached(key)
+        if segments is not None:
+            return segments
+        raw_text = raw_index.read(raw_path) if raw_path else None
+        return {part: text.encode("utf-8") for part, text in entry_segments(entry, raw_text).items()}
+
+    reused = sum(1 for key, _, _ in entries if cached(key) is not None)
+    with ThreadPoolExecutor(max_workers=workers or min(8, os.cpu_count() or 1)) as pool:
+        built = list(pool.map(make, entries))
+
+    # Skriv varje utfil del för del; segmentens position sparas i manifestet
+    segments_manifest: dict[str, dict[str, list[int]]] = {key: {} for key, _, _ in entries}
+    outputs_manifest = {}
+    rows = {}
+    for name, (path, parts) in OUTPUTS.items():
+        tmp = path.with_name(path.name + ".tmp")
+        h = hashlib.sha256()
+        offset = 0
+        count = 0
+        with open(tmp, "wb") as out:
+            for part in parts:
+                for (key, _, _), segments in zip(entries, built):
+                    data = segments[part]
+                    out.write(data)
+                    h.update(data)
+                    segments_manifest[key][part] = [offset, len(data)]
+                    offset += len(data)
+                    count += data.count(b"\n")
+        os.replace(tmp, path)
+        st = path.stat()
+        outputs_manifest[name] = {
+            "sha256": h.hexdigest(), "rows": count, "size": st.st_size, "mtime_ns": st.st_mtime_ns
+        }
+        rows[name] = count
+
+    manifest = {
+        "version": version,
+        "raw": raw_index.stats,
+        "outputs": outputs_manifest,
+        "segments": segments_manifest,
+    }
+    tmp = manifest_path.with_name(manifest_path.name + ".tmp")
+    tmp.write_text(json.dumps(manifest, ensure_ascii=False, indent=1), encoding="utf-8")
+    os.replace(tmp, manifest_path)
+    return {
+        "entries": len(entries),
+        "reused": reused,
+        "rebuilt": len(entries) - reused,
+        "raw_files_read": len(raw_index._texts),
+        "rows": rows,
+        "seconds": time.perf_counter() - started,
+    }
+
+
+def report(stats: dict) -> None:
+    for name, (path, _) in OUTPUTS.items():
+        print(f"✅ Skapade {path} med {stats['rows'][name]} rader.")
+    print(
+        f">>> {stats['entries']} poster: {stats['reused']} oförändrade, {stats['rebuilt']} byggda, "
+        f"{stats['raw_files_read']} råtexter lästa, {stats['seconds'] * 1000:.0f} ms"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Bygg extract_relevant.jsonl, dataset_faq.jsonl och all_tasks.jsonl från dataset.jsonl och data/raw/."
+    )
+    parser.add_argument("--workers", type=int, default=None, help="Antal trådar för poster som byggs om")
+    parser.add_argument("--force", action="store_true", help="Ignorera manifestet och bygg om allt")
+    args = parser.parse_args()
+
+    report(build(args.workers, args.force))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,198 @@
+# src/cache.py
+
+import hashlib
+import json
+import queue
+import re
+import sqlite3
+import threading
+import time
+from collections import Counter, OrderedDict
+from pathlib import Path
+from typing import Any
+
+_WHITESPACE = re.compile(r"\s+")
+
+
+def normalize_text(text: str) -> str:
+    """
+    Normaliserar texten innan hashning så att skillnader i radbrytningar
+    och mellanslag inte ger olika nycklar.
+    """
+    return _WHITESPACE.sub(" ", text).strip()
+
+
+def make_key(namespace: str, text: str, model_revision: str, params: Any) -> str:
+    """
+    Innehållsadresserad nyckel: hash av normaliserad text + modellrevision
+    + genereringsparametrar.
+    """
+    h = hashlib.sha256()
+    for part in (
+        namespace,
+        model_revision,
+        json.dumps(params, sort_keys=True, ensure_ascii=False, default=str),
+        normalize_text(text),
+    ):
+        h.update(part.encode("utf-8"))
+        h.update(b"\x00")
+    return h.hexdigest()
+
+
+class ResultCache:
+    """
+    Tvånivåcache för modellsvar: en LRU i minnet (max max_entries poster) och
+    valfritt en SQLite-fil som överlever omstarter. Värden måste vara
+    JSON-serialiserbara.
+
+    get_memory gör ingen disk-I/O och kan anropas från event-loopen;
+    get_disk läser SQLite och ska köras i en tråd. put skriver till minnet
+    direkt och lämnar diskskrivningen till en bakgrundstråd som samlar
+    väntande poster i en commit.
+    """
+
+    def __init__(self, max_entries: int = 4096, sqlite_path: str | Path | None = None):
+        self.max_entries = max(0, max_entries)
+        self._memory: OrderedDict[str, Any] = OrderedDict()
+        self._lock = threading.Lock()
+        self._hits: Counter[str] = Counter()
+        self._misses: Counter[str] = Counter()
+        self._disk_hits: Counter[str] = Counter()
+
+        self._db: sqlite3.Connection | None = None
+        self._db_lock = threading.Lock()
+        self._writes: queue.Queue[tuple | None] = queue.Queue()
+        self._writer: threading.Thread | None = None
+        if sqlite_path:
+            Path(sqlite_path).parent.mkdir(parents=True, exist_ok=True)
+            self._db = sqlite3.connect(str(sqlite_path), check_same_thread=False)
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS results ("
+                " key TEXT PRIMARY KEY, namespace TEXT, value TEXT, created REAL)"
+            )
+            self._db.commit()
+            self._writer = threading.Thread(target=self._write_loop, name="result-cache-writer", daemon=True)
+            self._writer.start()
+
+    @property
+    def disk(self) -> bool:
+        return self._db is not None
+
+    def get(self, key: str, namespace: str = "default") -> Any | None:
+        value = self.get_memory(key, namespace)
+        if value is None and self._db is not None:
+            value = self.get_disk(key, namespace)
+        return value
+
+    def get_memory(self, key: str, namespace: str = "default") -> Any | None:
+        """
+        Bara minnesnivån. Med disk räknas en miss först av get_disk.
+        """
+        with self._lock:
+            if key in self._memory:
+                self._memory.move_to_end(key)
+                self._hits[namespace] += 1
+                return self._memory[key]
+            if self._db is None:
+                self._misses[namespace] += 1
+            return None
+
+    def get_disk(self, key: str, namespace: str = "default") -> Any | None:
+        """
+        Disknivån efter en miss i minnet (blockerar – kör i en tråd).
+        """
+        with self._db_lock:
+            row = self._db.execute("SELECT value FROM results WHERE key = ?", (key,)).fetchone()
+        with self._lock:
+            if row is None:
+                self._misses[namespace] += 1
+                return None
+            value = json.loads(row[0])
+            self._remember(key, value)
+            self._hits[namespace] += 1
+            self._disk_hits[namespace] += 1
+            return value
+
+    def put(self, key: str, value: Any, namespace: str = "default") -> None:
+        with self._lock:
+            self._remember(key, value)
+        if self._db is not None:
+            self._writes.put((key, namespace, json.dumps(value, ensure_ascii=False), time.time()))
+
+    def flush(self) -> None:
+        """
+        Väntar tills alla put hunnit skrivas till disk.
+        """
+        if self._db is not None:
+            self._writes.join()
+
+    def close(self) -> None:
+        if self._writer is not None:
+            self._writes.put(None)
+            self._writer.join()
+            self._writer = None
+
+    def clear(self) -> None:
+        self.flush()
+        with self._lock:
+            self._memory.clear()
+        if self._db is not None:
+            with self._db_lock:
+                self._db.execute("DELETE FROM results")
+                self._db.commit()
+
+    def _write_loop(self) -> None:
+        while True:
+            rows = [self._writes.get()]
+            # Samla allt som väntar i en commit
+            while True:
+                try:
+                    rows.append(self._writes.get_nowait())
+                except queue.Empty:
+                    break
+            batch = [r for r in rows if r is not None]
+            try:
+                if batch:
+                    with self._db_lock:
+                        self._db.executemany(
+                            "INSERT OR REPLACE INTO results (key, namespace, value, created) VALUES (?, ?, ?, ?)",
+                            batch,
+                        )
+                        self._db.commit()
+            except sqlite3.Error as exc:
+                # Cachen är bara en optimering: tappa posterna hellre än tråden
+                print(f"⚠️  Kunde inte skriva {len(batch)} poster till resultatcachen: {exc}")
+            finally:
+                for _ in rows:
+                    self._writes.task_done()
+            if len(batch) < len(rows):
+                return
+
+    def stats(self) -> dict:
+        with self._lock:
+            namespaces = sorted(set(self._hits) | set(self._misses))
+            hits, misses = sum(self._hits.values()), sum(self._misses.values())
+            return {
+                "entries": len(self._memory),
+                "max_entries": self.max_entries,
+                "disk": self._db is not None,
+                "hits": hits,
+                "misses": misses,
+                "hit_rate": hits / (hits + misses) if hits + misses else 0.0,
+                "namespaces": {
+                    ns: {
+                        "hits": self._hits[ns],
+                        "disk_hits": self._disk_hits[ns],
+                        "misses": self._misses[ns],
+                    }
+                    for ns in namespaces
+                },
+            }
+
+    def _remember(self, key: str, value: Any) -> None:
+        if self.max_entries == 0:
+            return
+        self._memory[key] = value
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_entries:
+            self._memory.popitem(last=False)
@@ -0,0 +1,142 @@
+# src/chunking.py
+
+from typing import TYPE_CHECKING, NamedTuple
+
+if TYPE_CHECKING:
+    # Bara för typerna: chunkningen fungerar med vilken tokenizer som helst
+    # med samma gränssnitt och kräver inte transformers
+    from transformers import PreTrainedTokenizerBase
+
+# Hur bra en chunkgräns är före en viss token: nytt stycke eller rubrik,
+# ny rad, ny mening respektive mitt i en mening
+BREAK_SECTION  = 3
+BREAK_LINE     = 2
+BREAK_SENTENCE = 1
+BREAK_NONE     = 0
+
+
+class Chunk(NamedTuple):
+    """
+    En chunk av dokumentet: texten, dess token (från tokeniseringen av hela
+    dokumentet, utan specialtoken) och tokenintervallet [token_start, token_end).
+    """
+    text: str
+    input_ids: list[int]
+    token_start: int
+    token_end: int
+
+
+def chunk_text_by_tokens(tokenizer: "PreTrainedTokenizerBase", text: str, max_tokens: int = 1000) -> list[str]:
+    """
+    Dela upp texten i mindre strängar, vardera max max_tokens token långa.
+    """
+    encoding = tokenizer(text, return_offsets_mapping=True, add_special_tokens=False)
+    offsets = encoding["offset_mapping"]
+    total_tokens = len(offsets)
+    chunks = []
+    start = 0
+    while start < total_tokens:
+        end = min(start + max_tokens, total_tokens)
+        char_start = offsets[start][0]
+        char_end   = offsets[end - 1][1]
+        chunks.append(text[char_start:char_end])
+        start = end
+    return chunks
+
+
+def is_heading(line: str, max_chars: int = 80) -> bool:
+    """
+    Ser raden ut som en rubrik (kort och slutar inte med punkt/komma)?
+    Råtexterna har tydliga avsnittsrubriker som "Vad ersätts?" eller "Tandvård".
+    """
+    line = line.strip()
+    return bool(line) and len(line) <= max_chars and not line.endswith((".", ",", ";"))
+
+
+def break_levels(text: str, offsets: list[tuple[int, int]]) -> list[int]:
+    """
+    Nivå (BREAK_*) för att låta en chunk börja vid respektive token, utifrån
+    blanktecknen mellan den och föregående token.
+    """
+    levels = [BREAK_SECTION] + [BREAK_NONE] * (len(offsets) - 1)
+    for i in range(1, len(offsets)):
+        start, end = offsets[i]
+        token_text = text[start:end]
+        gap = text[offsets[i - 1][1]:start] + token_text[:len(token_text) - len(token_text.lstrip())]
+        if "\n" in gap:
+            line_start = start + len(token_text) - len(token_text.lstrip())
+            line_end = text.find("\n", line_start)
+            line = text[line_start:line_end if line_end != -1 else len(text)]
+            levels[i] = BREAK_SECTION if gap.count("\n") >= 2 or is_heading(line) else BREAK_LINE
+        elif gap and text[offsets[i - 1][0]:offsets[i - 1][1]].rstrip()[-1:] in (".", "!", "?", ":"):
+            levels[i] = BREAK_SENTENCE
+    return levels
+
+
+def _best_break(levels: list[int], lo: int, hi: int, last: bool) -> int:
+    """
+    Token i [lo, hi] med högst brytnivå; vid lika den sista (last) eller första.
+    """
+    candidates = range(lo, hi + 1)
+    if last:
+        return max(candidates, key=lambda i: (levels[i], i))
+    return max(candidates, key=lambda i: (levels[i], -i))
+
+
+def _overlap_start(levels: list[int], lo: int, hi: int) -> int:
+    """
+    Var nästa chunk börjar när den ska överlappa: första token i [lo, hi]
+    med högsta förekommande brytnivån – tidigast möjligt, så att överlappet
+    blir så nära det begärda som brytpunkterna tillåter. Utan brytpunkt
+    (bara BREAK_NONE) blir det lo.
+    """
+    for level in (BREAK_SECTION, BREAK_LINE, BREAK_SENTENCE):
+        for i in range(lo, hi + 1):
+            if levels[i] >= level:
+                return i
+    return lo
+
+
+def chunk_document(
+    tokenizer: "PreTrainedTokenizerBase",
+    text: str,
+    max_tokens: int = 1000,
+    overlap: int = 0,
+    min_fill: float = 0.5,
+) -> list[Chunk]:
+    """
+    Tokeniserar hela dokumentet en gång och delar det i chunkar om max
+    max_tokens token. Varje gräns läggs vid den bästa brytpunkten (stycke/
+    rubrik före radbrytning före meningsslut) bland de sista (1 - min_fill)
+    av fönstret, så att en chunk aldrig är kortare än min_fill * max_tokens
+    om den inte är sist. Med overlap > 0 börjar nästa chunk upp till overlap
+    token före föregående chunks slut (aldrig vid slutet självt), vid den
+    tidigaste bästa brytpunkten där, så att en klausul som delas av gränsen
+    finns hel i någon chunk. Chunkarnas input_ids täcker tillsammans
+    hela dokumentet – inget trunkeras.
+    """
+    if overlap >= max_tokens:
+        raise ValueError(f"overlap ({overlap}) måste vara mindre än max_tokens ({max_tokens}).")
+    encoding = tokenizer(text, return_offsets_mapping=True, add_special_tokens=False)
+    input_ids, offsets = encoding["input_ids"], encoding["offset_mapping"]
+    total_tokens = len(input_ids)
+    levels = break_levels(text, offsets)
+    chunks: list[Chunk] = []
+    start = 0
+    while start < total_tokens:
+        end = min(start + max_tokens, total_tokens)
+        if end < total_tokens:
+            end = _best_break(levels, start + max(1, int(max_tokens * min_fill)), end, last=True)
+        chunks.append(Chunk(
+            text=text[offsets[start][0]:offsets[end - 1][1]],
+            input_ids=input_ids[start:end],
+            token_start=start,
+            token_end=end,
+        ))
+        if end >= total_tokens:
+            break
+        next_start = end
+        if overlap and end - 1 >= start + 1:
+            next_start = _overlap_start(levels, max(start + 1, end - overlap), end - 1)
+        start = next_start
+    return chunks
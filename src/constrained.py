@@ -0,0 +1,332 @@
+# src/constrained.py
+
+import functools
+import json
+import re
+import threading
+from pathlib import Path
+
+import torch
+import transformers
+from transformers import PreTrainedTokenizerBase
+
+from preprocess import BOOLEAN_KEYS
+
+DATASET_PATH = Path(__file__).parent.parent / "data" / "dataset.jsonl"
+
+# BOOLEAN_KEYS som aldrig förekommer i träningsdatans target – modellen har
+# inte lärt sig att skriva dem, så de ska inte tvingas in i svaret
+UNTRAINED_KEYS = {"karenstid"}
+
+
+def training_fields(path: Path = DATASET_PATH) -> list[tuple[str, str]]:
+    """
+    Fälten i träningsdatans target (dataset.jsonl, som extract- och
+    compare-target byggs av) i den ordning de förekommer, med typ efter
+    värdet: "text" (sträng), "bool" eller "json" (allt annat).
+    """
+    fields: dict[str, str] = {}
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            if not line.strip():
+                continue
+            for key, value in json.loads(line).items():
+                if key not in fields:
+                    fields[key] = "text" if isinstance(value, str) else "bool" if isinstance(value, bool) else "json"
+    return list(fields.items())
+
+
+# Fälten i extract-/compare-svaret i den ordning modellen tränats på (se
+# data/all_tasks.jsonl): "text" och "json" genereras fritt (girigt) tills
+# värdet är komplett, "bool" avgörs med ett enda framåtpass. Läses från
+# träningsdatan när den finns; DEFAULT_FIELDS (som testerna håller lika med
+# träningsdatan) används där data/ saknas, t.ex. i Docker-avbildningen.
+DEFAULT_FIELDS: list[tuple[str, str]] = [
+    ("försäkring", "text"),
+    ("pris_per_åldersintervall", "json"),
+    ("självrisk", "bool"),
+] + [(bk["key"], "bool") for bk in BOOLEAN_KEYS if bk["key"] not in UNTRAINED_KEYS]
+EXTRACT_FIELDS: list[tuple[str, str]] = training_fields() if DATASET_PATH.exists() else DEFAULT_FIELDS
+
+# Max antal token som genereras fritt för ett värde innan det ges upp (null)
+FREE_MAX_TOKENS = {"text": 48, "json": 320}
+
+_JSON = json.JSONDecoder()
+
+
+class JsonTemplate:
+    """
+    Ett JSON-objekt med fasta nycklar i fast ordning, förtokeniserat som en
+    följd av steg:
+      ("feed", ids)                       – kända token som bara matas in
+      ("bool", key, true_ids, false_ids)  – välj true/false på första token som skiljer
+      ("free", key, kind, sep)            – generera fritt tills värdet följs av sep
+
+    Texten delas bara vid mellanslag (som json.dumps sätter efter ":" och ","),
+    och sentencepiece delar aldrig en token över ett mellanslag – så att
+    tokenisera bitarna var för sig ger samma token som hela svaret.
+    """
+
+    def __init__(self, tokenizer: PreTrainedTokenizerBase, fields: list[tuple[str, str]] = EXTRACT_FIELDS):
+        self.fields = fields
+        self.steps: list[tuple] = []
+
+        def ids(text: str) -> list[int]:
+            return tokenizer(text, add_special_tokens=False)["input_ids"]
+
+        for n, (key, kind) in enumerate(fields):
+            sep = "}" if n == len(fields) - 1 else ","
+            self._feed(ids(("{" if n == 0 else "") + json.dumps(key, ensure_ascii=False) + ":"))
+            if kind == "bool":
+                true_ids, false_ids = ids(f"true{sep}"), ids(f"false{sep}")
+                common = 0
+                while common < min(len(true_ids), len(false_ids)) and true_ids[common] == false_ids[common]:
+                    common += 1
+                self._feed(true_ids[:common])
+                self.steps.append(("bool", key, true_ids[common:], false_ids[common:]))
+            else:
+                self.steps.append(("free", key, kind, sep))
+
+    def _feed(self, ids: list[int]) -> None:
+        if not ids:
+            return
+        if self.steps and self.steps[-1][0] == "feed":
+            self.steps[-1][1].extend(ids)
+        else:
+            self.steps.append(("feed", list(ids)))
+
+
+def complete_value(text: str, sep: str) -> tuple[bool, object]:
+    """
+    (True, värdet) när text börjar med ett komplett JSON-värde följt av sep,
+    annars (False, None).
+    """
+    text = text.lstrip()
+    try:
+        value, end = _JSON.raw_decode(text)
+    except ValueError:
+        return False, None
+    if not text[end:].lstrip().startswith(sep):
+        return False, None
+    return True, value
+
+
+# transformers-versioner (från och med, till men inte med) där T5Attention har
+# den layout _compute_bias bygger på: compute_bias/_relative_position_bucket/
+# relative_attention_bias, och forward som skivar biasen till de sista
+# seq_length frågorna. Höj gränsen först när test_constrained går igenom med
+# den nya versionen.
+SUPPORTED_TRANSFORMERS = ((4, 46), (4, 58))
+
+
+def check_transformers_support() -> None:
+    """
+    Kastar RuntimeError om den installerade transformers-versionen ligger
+    utanför SUPPORTED_TRANSFORMERS eller om T5Attention saknar det
+    _compute_bias använder. Anropas vid uppstart när constrained-avkodning
+    är vald, så att felet syns direkt och inte som fel svar.
+    """
+    from transformers.models.t5.modeling_t5 import T5Attention
+
+    version = tuple(int(n) for n in re.findall(r"\d+", transformers.__version__)[:2])
+    low, high = SUPPORTED_TRANSFORMERS
+    if not low <= version < high:
+        raise RuntimeError(
+            f"Constrained-avkodning stöder transformers {'.'.join(map(str, low))} till "
+            f"(men inte med) {'.'.join(map(str, high))}, installerad är {transformers.__version__}."
+        )
+    missing = [name for name in ("compute_bias", "_relative_position_bucket") if not hasattr(T5Attention, name)]
+    if missing:
+        raise RuntimeError(f"T5Attention saknar {', '.join(missing)}; constrained-avkodning stöds inte.")
+
+
+# Positioner per rad för det decoder-anrop som pågår i tråden (se _Decoder)
+_row_positions = threading.local()
+
+
+def _compute_bias(attn, *args, **kwargs):
+    positions = getattr(_row_positions, "value", None)
+    if positions is None or positions[0] is not attn:
+        return type(attn).compute_bias(attn, *args, **kwargs)
+    _, query_positions, key_positions = positions
+    relative = key_positions[:, None, :] - query_positions[:, :, None]
+    buckets = attn._relative_position_bucket(
+        relative,
+        bidirectional=not attn.is_decoder,
+        num_buckets=attn.relative_attention_num_buckets,
+        max_distance=attn.relative_attention_max_distance,
+    )
+    # (rader, q, k, huvuden) -> (rader, huvuden, q, k)
+    return attn.relative_attention_bias(buckets).permute(0, 3, 1, 2)
+
+
+def _install_row_positions(model):
+    """
+    T5:s relativa positionsbias räknas från cachens index, lika för alla
+    rader. Med paddning mitt i en rads cache blir avstånden mellan radens
+    token då fel. T5Stack tar varken position_bias eller cache_position per
+    rad, så här får decoderns första attention-lager (bara det har en bias)
+    en egen compute_bias på instansen – inte på klassen, så andra modeller
+    påverkas inte – som under _Decoder.feed i samma tråd räknar biasen från
+    varje rads egna positioner; paddningen (maskad) tar ingen plats. Alla
+    andra anrop går till klassens compute_bias. functools.partial av en
+    modulfunktion gör att modellen fortfarande kan skickas till
+    arbetsprocesser.
+    """
+    attn = model.get_decoder().block[0].layer[0].SelfAttention
+    installed = attn.__dict__.get("compute_bias")
+    if getattr(installed, "func", None) is not _compute_bias:
+        check_transformers_support()
+        attn.compute_bias = functools.partial(_compute_bias, attn)
+    return attn
+
+
+class _Decoder:
+    """
+    Inkrementell decoder för en batch: matar in (olika många) token per rad
+    med KV-cache. Rader som matar in färre token paddas och maskas bort, och
+    positionsbiasen räknas från radens egna positioner, så att en rad får
+    samma svar oavsett vilka rader den batchas med.
+    """
+
+    def __init__(self, model, encoder_outputs, encoder_mask: torch.Tensor, pad_token_id: int):
+        self.model = model
+        self.encoder_outputs = encoder_outputs
+        self.encoder_mask = encoder_mask
+        self.pad_token_id = pad_token_id
+        self.past = None
+        self.mask: torch.Tensor | None = None
+        self.attn = _install_row_positions(model)
+        # Position för varje cacheplats per rad, och antal riktiga token per rad
+        self.positions: torch.Tensor | None = None
+        self.lengths = torch.zeros(encoder_mask.size(0), dtype=torch.long, device=encoder_mask.device)
+
+    def feed(self, pending: list[list[int]]) -> torch.Tensor:
+        """
+        Matar in pending[r] för varje rad och returnerar logits för nästa
+        token efter radens sista inmatade token.
+        """
+        width = max(1, max(len(p) for p in pending))
+        ids = torch.full((len(pending), width), self.pad_token_id, dtype=torch.long)
+        mask = torch.zeros((len(pending), width), dtype=torch.long)
+        for r, p in enumerate(pending):
+            if p:
+                ids[r, :len(p)] = torch.tensor(p, dtype=torch.long)
+                mask[r, :len(p)] = 1
+        device = self.encoder_mask.device
+        mask = mask.to(device)
+        self.mask = mask if self.mask is None else torch.cat([self.mask, mask], dim=1)
+        # Radens nya token får positionerna efter dess tidigare riktiga token
+        query_positions = self.lengths[:, None] + torch.arange(width, device=device)[None, :]
+        self.positions = query_positions if self.positions is None else torch.cat([self.positions, query_positions], dim=1)
+        _row_positions.value = (self.attn, query_positions, self.positions)
+        try:
+            out = self.model(
+                encoder_outputs=self.encoder_outputs,
+                attention_mask=self.encoder_mask,
+                decoder_input_ids=ids.to(device),
+                decoder_attention_mask=self.mask,
+                past_key_values=self.past,
+                use_cache=True,
+                return_dict=True
+            )
+        finally:
+            _row_positions.value = None
+        self.past = out.past_key_values
+        self.lengths = self.lengths + mask.sum(dim=1)
+        last = torch.tensor([max(len(p), 1) - 1 for p in pending], device=device)
+        return out.logits[torch.arange(len(pending), device=device), last]
+
+    def token_counts(self) -> list[int]:
+        return self.mask.sum(dim=1).tolist() if self.mask is not None else []
+
+
+def _decode_batch(
+    model,
+    tokenizer: PreTrainedTokenizerBase,
+    device: torch.device,
+    template: JsonTemplate,
+    input_ids: list[list[int]],
+) -> tuple[list[str], list[int]]:
+    inputs = tokenizer.pad({"input_ids": input_ids}, return_tensors="pt")
+    inputs = {k: v.to(device) for k, v in inputs.items()}
+    rows = len(input_ids)
+    encoder_outputs = model.get_encoder()(
+        input_ids=inputs["input_ids"], attention_mask=inputs["attention_mask"], return_dict=True
+    )
+    decoder = _Decoder(model, encoder_outputs, inputs["attention_mask"], tokenizer.pad_token_id)
+    pending = [[model.config.decoder_start_token_id] for _ in range(rows)]
+    values: list[dict] = [{} for _ in range(rows)]
+
+    for step in template.steps:
+        if step[0] == "feed":
+            for p in pending:
+                p.extend(step[1])
+        elif step[0] == "bool":
+            _, key, true_ids, false_ids = step
+            logits = decoder.feed(pending)
+            is_true = (logits[:, true_ids[0]] > logits[:, false_ids[0]]).tolist()
+            for r in range(rows):
+                values[r][key] = bool(is_true[r])
+                pending[r] = list(true_ids if is_true[r] else false_ids)
+        else:
+            _, key, kind, sep = step
+            generated: list[list[int]] = [[] for _ in range(rows)]
+            active = set(range(rows))
+            for _ in range(FREE_MAX_TOKENS[kind]):
+                next_ids = decoder.feed(pending).argmax(dim=-1).tolist()
+                pending = [[] for _ in range(rows)]
+                for r in sorted(active):
+                    if next_ids[r] == tokenizer.eos_token_id:
+                        active.discard(r)
+                        continue
+                    generated[r].append(next_ids[r])
+                    pending[r] = [next_ids[r]]
+                    done, value = complete_value(tokenizer.decode(generated[r], skip_special_tokens=True), sep)
+                    if done:
+                        values[r][key] = value
+                        active.discard(r)
+                if not active:
+                    break
+            for r in range(rows):
+                values[r].setdefault(key, None)
+
+    return [json.dumps(v, ensure_ascii=False) for v in values], decoder.token_counts()
+
+
+def generate_constrained(
+    model,
+    tokenizer: PreTrainedTokenizerBase,
+    device: torch.device,
+    prompts: list[str | list[int]],
+    max_input_length: int,
+    template: JsonTemplate,
+    batch_size: int = 8,
+    token_counts: list[int] | None = None,
+) -> list[str]:
+    """
+    Fyller i template för varje prompt i stället för fri beam search: kända
+    nycklar och skiljetecken matas in, booleaner väljs med ett framåtpass per
+    fält (logit för "true" mot "false") och bara fritextvärdena genereras
+    girigt. Svaren är alltid giltig JSON med templatens nycklar, i samma
+    ordning som prompts. Kräver en PyTorch-modell (inte ONNX-backend).
+    """
+    if not prompts:
+        return []
+    encodings: list[list[int]] = [
+        tokenizer(p, truncation=True, max_length=max_input_length)["input_ids"] if isinstance(p, str) else p
+        for p in prompts
+    ]
+    order = sorted(range(len(prompts)), key=lambda i: len(encodings[i]), reverse=True)
+    results: list[str] = [""] * len(prompts)
+    if token_counts is not None:
+        token_counts[:] = [0] * len(prompts)
+    for start in range(0, len(order), max(1, batch_size)):
+        idx = order[start:start + batch_size]
+        with torch.no_grad():
+            outputs, counts = _decode_batch(model, tokenizer, device, template, [encodings[i] for i in idx])
+        for i, out_str, n in zip(idx, outputs, counts):
+            results[i] = out_str
+            if token_counts is not None:
+                token_counts[i] = int(n)
+    return results
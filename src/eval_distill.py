@@ -0,0 +1,170 @@
+# src/eval_distill.py
+
+import argparse
+import json
+from pathlib import Path
+from transformers import AutoTokenizer
+
+from eval_profiles import DATA_PATH, run
+from holdout import HELD_OUT_INSURERS, chunk_prompts, insurer_key, is_held_out_row, labelled_insurers, raw_documents
+from inference import BACKENDS, GENERATION_PROFILES, load_model, profile_generation_kwargs
+from parity_check import mean, parse_json
+from preprocess import BOOLEAN_KEYS
+
+# 1) Paths
+BASE_DIR    = Path(__file__).parent.parent
+TEACHER_DIR = BASE_DIR / "models" / "all-tasks-t5-swedish"
+STUDENT_DIR = BASE_DIR / "models" / "all-tasks-t5-student"
+DISTILL_MAX_INPUT_LENGTH = 512
+
+def per_field_accuracy(outputs: list[dict | None], targets: list[dict | None]) -> dict[str, float | None]:
+    """
+    Andel rader där respektive BOOLEAN_KEYS-fält stämmer med target (rader
+    där svaret eller target inte är giltig JSON räknas som fel respektive hoppas över).
+    """
+    return {
+        bk["key"]: mean([
+            (o or {}).get(bk["key"]) == t.get(bk["key"]) if t is not None else None
+            for o, t in zip(outputs, targets)
+        ])
+        for bk in BOOLEAN_KEYS
+    }
+
+def load_held_out_rows(path: Path, per_task: int) -> dict[str, list[dict]]:
+    """
+    Högst per_task rader per uppgift för de utelämnade bolagen (se holdout.py).
+    """
+    by_task: dict[str, list[dict]] = {}
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            if not line.strip():
+                continue
+            obj = json.loads(line)
+            if not is_held_out_row(obj):
+                continue
+            rows = by_task.setdefault(obj["input"].split(":", 1)[0], [])
+            if len(rows) < per_task:
+                rows.append(obj)
+    return by_task
+
+def eval_distill(
+    teacher_dir: Path,
+    student_dir: Path,
+    backend: str,
+    profile: str,
+    per_task: int,
+    max_chunks: int,
+    batch_size: int,
+) -> dict:
+    """
+    Jämför lärare och student på bolag som hållits utanför destillationen
+    (HELD_OUT_INSURERS): rader med facit ur all_tasks.jsonl (boolean-
+    träffsäkerhet per fält, JSON-giltighet, latens) och chunkar av råtexter
+    utan facit, som läraren aldrig sett (överensstämmelse student–lärare).
+    """
+    kwargs = profile_generation_kwargs(GENERATION_PROFILES[profile])
+    tokenizer = AutoTokenizer.from_pretrained(str(student_dir))
+    loaded = {"teacher": load_model(teacher_dir, backend), "student": load_model(student_dir, backend)}
+    labelled = labelled_insurers()
+    held_out_labelled = [i for i in HELD_OUT_INSURERS if i in labelled]
+    unseen_docs = [p for p in raw_documents(held_out=True) if insurer_key(p.name) not in labelled]
+    samples = load_held_out_rows(DATA_PATH, per_task)
+
+    report = {
+        "teacher": str(teacher_dir),
+        "student": str(student_dir),
+        "backend": backend,
+        "profile": profile,
+        "parameters": {
+            name: sum(p.numel() for p in model.parameters()) if hasattr(model, "parameters") else None
+            for name, model in loaded.items()
+        },
+        "held_out": {
+            "insurers_with_targets": held_out_labelled,
+            "documents_without_targets": [p.name for p in unseen_docs],
+        },
+        "limitations": [
+            "Läraren är tränad på alla rader i all_tasks.jsonl, även de utelämnade bolagens: "
+            "lärarens siffror under 'tasks' är träningsfel, inte generalisering, och studentens "
+            "jämförs mot en lärare som sett facit.",
+            "Råtexterna under 'unseen_documents' har läraren aldrig sett, men de saknar facit – "
+            "där mäts bara hur väl studenten följer läraren.",
+        ],
+        "tasks": {},
+    }
+    for task, rows in samples.items():
+        outputs, times = {}, {}
+        for name, model in loaded.items():
+            print(f">>> {task}: {len(rows)} rader med {name} …")
+            outputs[name], _, times[name] = run(model, tokenizer, task, rows, batch_size, kwargs)
+        stats = {
+            "samples": len(rows),
+            "exact_match_vs_target": {
+                name: mean([o == row["target"] for o, row in zip(outs, rows)]) for name, outs in outputs.items()
+            },
+            "exact_match_student_vs_teacher": mean(
+                [s == t for s, t in zip(outputs["student"], outputs["teacher"])]
+            ),
+            "latency_s_per_sample": {name: t / len(rows) for name, t in times.items()},
+            "speedup": times["teacher"] / times["student"] if times["student"] else None,
+        }
+        if task in ("extract", "compare"):
+            targets = [parse_json(row["target"]) for row in rows]
+            parsed = {name: [parse_json(o) for o in outs] for name, outs in outputs.items()}
+            fields = {name: per_field_accuracy(p, targets) for name, p in parsed.items()}
+            stats["json_valid"] = {name: mean([p is not None for p in ps]) for name, ps in parsed.items()}
+            stats["boolean_accuracy_per_field"] = fields
+            stats["boolean_accuracy"] = {name: mean(list(f.values())) for name, f in fields.items()}
+            stats["boolean_agreement_student_vs_teacher"] = mean(list(
+                per_field_accuracy(parsed["student"], parsed["teacher"]).values()
+            ))
+        report["tasks"][task] = stats
+
+    # Chunkade som lärarens svar i train_distill.py (MAX_IN_LEN)
+    prompts = chunk_prompts(tokenizer, unseen_docs, DISTILL_MAX_INPUT_LENGTH)[:max_chunks]
+    if prompts:
+        rows = [{"input": p} for p in prompts]
+        outputs, times = {}, {}
+        for name, model in loaded.items():
+            print(f">>> extract: {len(rows)} osedda chunkar med {name} …")
+            outputs[name], _, times[name] = run(model, tokenizer, "extract", rows, batch_size, kwargs)
+        parsed = {name: [parse_json(o) for o in outs] for name, outs in outputs.items()}
+        report["unseen_documents"] = {
+            "chunks": len(rows),
+            "json_valid": {name: mean([p is not None for p in ps]) for name, ps in parsed.items()},
+            "boolean_agreement_per_field_student_vs_teacher": per_field_accuracy(
+                parsed["student"], parsed["teacher"]
+            ),
+            "latency_s_per_sample": {name: t / len(rows) for name, t in times.items()},
+            "speedup": times["teacher"] / times["student"] if times["student"] else None,
+        }
+    return report
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Jämför destillerad student mot läraren på bolag som hållits utanför destillationen."
+    )
+    parser.add_argument("--teacher", type=Path, default=TEACHER_DIR)
+    parser.add_argument("--student", type=Path, default=STUDENT_DIR)
+    parser.add_argument("--backend", choices=BACKENDS, default="torch")
+    parser.add_argument("--profile", choices=list(GENERATION_PROFILES), default="accurate",
+                        help="Genereringsprofil för båda modellerna")
+    parser.add_argument("--samples", type=int, default=50, help="Max antal rader med facit per uppgift")
+    parser.add_argument("--chunks", type=int, default=50, help="Max antal chunkar av osedda råtexter")
+    parser.add_argument("--batch-size", type=int, default=4)
+    parser.add_argument("--output", type=Path, default=None, help="Spara rapporten som JSON")
+    args = parser.parse_args()
+    if "draft" in GENERATION_PROFILES[args.profile]:
+        parser.error("Profiler med utkastmodell jämförs med eval_profiles.py --draft.")
+
+    report = eval_distill(
+        args.teacher, args.student, args.backend, args.profile, args.samples, args.chunks, args.batch_size
+    )
+    text = json.dumps(report, ensure_ascii=False, indent=2)
+    print(text)
+    if args.output:
+        args.output.write_text(text, encoding="utf-8")
+        print(f"✅ Rapport sparad till {args.output}")
+
+if __name__ == "__main__":
+    main()
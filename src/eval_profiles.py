@@ -0,0 +1,174 @@
+# src/eval_profiles.py
+
+import argparse
+import json
+import time
+from pathlib import Path
+import torch
+from transformers import AutoTokenizer
+
+from inference import (
+    BACKENDS, GENERATION_PROFILES, TASK_MAX_INPUT_LENGTH, TASK_MAX_LENGTH,
+    generate_batch, load_model, profile_generation_kwargs,
+)
+from holdout import HOLDOUT_INFO, in_eval_sample
+from parity_check import boolean_agreement, mean, parse_json
+
+# 1) Paths
+BASE_DIR  = Path(__file__).parent.parent
+DATA_PATH = BASE_DIR / "data" / "all_tasks.jsonl"
+MODEL_DIR = BASE_DIR / "models" / "all-tasks-t5-swedish"
+
+def held_out_fraction(model_dir: Path) -> float:
+    """
+    Andelen rader som modellen tränats utan (train_all_tasks.py med
+    EVAL_HOLDOUT_FRACTION); fel om den tränats på alla rader.
+    """
+    info = Path(model_dir) / HOLDOUT_INFO
+    if not info.exists():
+        raise ValueError(
+            f"{model_dir} är tränad på alla rader i all_tasks.jsonl – träna om med "
+            "EVAL_HOLDOUT_FRACTION=0.1 python src/train_all_tasks.py för att mäta på utelämnade rader."
+        )
+    return json.loads(info.read_text(encoding="utf-8"))["fraction"]
+
+def load_held_out(path: Path, fraction: float, per_task: int) -> dict[str, list[dict]]:
+    """
+    Högst per_task utelämnade rader per uppgift (extract/compare/faq).
+    """
+    by_task: dict[str, list[dict]] = {}
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            if not line.strip():
+                continue
+            obj = json.loads(line)
+            if not in_eval_sample(obj["input"], fraction):
+                continue
+            task = obj["input"].split(":", 1)[0]
+            rows = by_task.setdefault(task, [])
+            if len(rows) < per_task:
+                rows.append(obj)
+    return by_task
+
+def run(model, tokenizer, task: str, rows: list[dict], batch_size: int, kwargs: dict) -> tuple[list[str], list[int], float]:
+    token_counts: list[int] = []
+    start = time.perf_counter()
+    outputs = generate_batch(
+        model, tokenizer, torch.device("cpu"), [r["input"] for r in rows],
+        max_input_length=TASK_MAX_INPUT_LENGTH[task],
+        max_length=TASK_MAX_LENGTH[task],
+        batch_size=batch_size,
+        token_counts=token_counts,
+        **kwargs
+    )
+    return outputs, token_counts, time.perf_counter() - start
+
+def eval_profiles(
+    model_dir: Path,
+    backend: str,
+    profiles: dict[str, dict],
+    reference: str,
+    draft_dir: Path | None,
+    per_task: int,
+    batch_size: int,
+) -> dict:
+    """
+    Kör raderna som modellen tränats utan med varje profil och mäter
+    träffsäkerhet mot target, överensstämmelse med referensprofilen och latens.
+    """
+    fraction = held_out_fraction(model_dir)
+    tokenizer = AutoTokenizer.from_pretrained(str(model_dir))
+    model = load_model(model_dir, backend)
+    draft = load_model(draft_dir, "torch") if draft_dir else None
+    samples = load_held_out(DATA_PATH, fraction, per_task)
+
+    runnable = {}
+    skipped = {}
+    for name, settings in profiles.items():
+        if "draft" in settings and draft is None:
+            skipped[name] = "kräver --draft"
+        else:
+            runnable[name] = profile_generation_kwargs(settings, draft)
+    if reference not in runnable:
+        raise ValueError(f"Referensprofilen '{reference}' kan inte köras.")
+
+    report = {
+        "model": str(model_dir),
+        "backend": backend,
+        "draft": str(draft_dir) if draft_dir else None,
+        "held_out_fraction": fraction,
+        "profiles": {name: profiles[name] for name in runnable},
+        "skipped": skipped,
+        "tasks": {},
+    }
+    for task, rows in samples.items():
+        outputs, times, tokens = {}, {}, {}
+        # Referensen först, så att övriga profiler kan jämföras mot den
+        for name in [reference] + [n for n in runnable if n != reference]:
+            print(f">>> {task}: {len(rows)} rader med profilen {name} …")
+            outputs[name], counts, times[name] = run(model, tokenizer, task, rows, batch_size, runnable[name])
+            tokens[name] = sum(counts)
+        stats = {"samples": len(rows), "profiles": {}}
+        targets = [parse_json(row["target"]) for row in rows]
+        for name, outs in outputs.items():
+            profile_stats = {
+                "exact_match_vs_target": mean([o == row["target"] for o, row in zip(outs, rows)]),
+                "exact_match_vs_reference": mean([o == r for o, r in zip(outs, outputs[reference])]),
+                "latency_s_per_sample": times[name] / len(rows),
+                "generated_tokens_per_s": tokens[name] / times[name] if times[name] else None,
+                "speedup_vs_reference": times[reference] / times[name] if times[name] else None,
+            }
+            if task in ("extract", "compare"):
+                parsed = [parse_json(o) for o in outs]
+                profile_stats["json_valid"] = mean([p is not None for p in parsed])
+                # Ogiltig JSON räknas som fel på alla fält (rader utan giltigt target hoppas över)
+                profile_stats["boolean_accuracy_vs_target"] = mean([
+                    (boolean_agreement(p, t) if p is not None else 0.0) if t is not None else None
+                    for p, t in zip(parsed, targets)
+                ])
+            stats["profiles"][name] = profile_stats
+        report["tasks"][task] = stats
+    return report
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Mät träffsäkerhet och latens per genereringsprofil på rader ur data/all_tasks.jsonl som "
+                    "modellen tränats utan (train_all_tasks.py med EVAL_HOLDOUT_FRACTION)."
+    )
+    parser.add_argument("--model", type=Path, default=MODEL_DIR)
+    parser.add_argument("--backend", choices=BACKENDS, default="torch")
+    parser.add_argument("--draft", type=Path, default=None,
+                        help="Utkastmodell för profiler med 'draft' (assisterad avkodning)")
+    parser.add_argument("--profiles", default=None,
+                        help="JSON (eller sökväg till JSON-fil) med profiler utöver/i stället för standardprofilerna")
+    parser.add_argument("--only", default=None, help="Kommaseparerade profiler att köra (standard: alla)")
+    parser.add_argument("--reference", default="accurate", help="Profilen övriga jämförs mot")
+    parser.add_argument("--samples", type=int, default=20, help="Max antal rader per uppgift")
+    parser.add_argument("--batch-size", type=int, default=4)
+    parser.add_argument("--output", type=Path, default=None, help="Spara rapporten som JSON")
+    args = parser.parse_args()
+
+    spec = args.profiles
+    if spec and Path(spec).is_file():
+        spec = Path(spec).read_text(encoding="utf-8")
+    profiles = {**GENERATION_PROFILES, **(json.loads(spec) if spec else {})}
+    if args.only:
+        wanted = {p.strip() for p in args.only.split(",")} | {args.reference}
+        profiles = {name: settings for name, settings in profiles.items() if name in wanted}
+
+    try:
+        held_out_fraction(args.model)
+    except ValueError as exc:
+        parser.error(str(exc))
+    report = eval_profiles(
+        args.model, args.backend, profiles, args.reference, args.draft,
+        args.samples, args.batch_size
+    )
+    text = json.dumps(report, ensure_ascii=False, indent=2)
+    print(text)
+    if args.output:
+        args.output.write_text(text, encoding="utf-8")
+        print(f"✅ Rapport sparad till {args.output}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,60 @@
+# src/export_onnx.py
+
+import argparse
+from pathlib import Path
+from transformers import AutoTokenizer
+
+from inference import default_onnx_path
+
+# 1) Paths
+BASE_DIR   = Path(__file__).parent.parent
+MODEL_DIR  = BASE_DIR / "models" / "all-tasks-t5-swedish"
+
+# Filerna som optimum skapar för en seq2seq-modell med past-key-values
+ONNX_FILES = ("encoder_model.onnx", "decoder_model.onnx", "decoder_with_past_model.onnx")
+
+def export_onnx(model_dir: Path, output_dir: Path, quantize: bool = False) -> Path:
+    """
+    Exporterar den finjusterade T5-modellen till ONNX (encoder + decoder med
+    och utan past-key-values) så att api.py kan köra den med
+    INFERENCE_BACKEND=onnx. Med quantize=True kvantiseras vikterna dynamiskt till int8.
+    """
+    try:
+        from optimum.onnxruntime import ORTModelForSeq2SeqLM
+    except ImportError as exc:
+        raise SystemExit("Export kräver optimum[onnxruntime] (pip install optimum[onnxruntime]).") from exc
+
+    print(f">>> Exporterar {model_dir} till ONNX …")
+    ort_model = ORTModelForSeq2SeqLM.from_pretrained(str(model_dir), export=True, use_cache=True)
+    ort_model.save_pretrained(str(output_dir))
+    AutoTokenizer.from_pretrained(str(model_dir)).save_pretrained(str(output_dir))
+
+    if quantize:
+        from optimum.onnxruntime import ORTQuantizer
+        from optimum.onnxruntime.configuration import AutoQuantizationConfig
+
+        qconfig = AutoQuantizationConfig.avx2(is_static=False, per_channel=False)
+        for file_name in ONNX_FILES:
+            if not (output_dir / file_name).exists():
+                continue
+            print(f">>> Kvantiserar {file_name} (dynamisk int8) …")
+            quantizer = ORTQuantizer.from_pretrained(str(output_dir), file_name=file_name)
+            quantizer.quantize(save_dir=str(output_dir), quantization_config=qconfig)
+            # Ersätt fp32-filen med den kvantiserade så att laddningen är densamma
+            quantized = output_dir / file_name.replace(".onnx", "_quantized.onnx")
+            quantized.replace(output_dir / file_name)
+
+    print(f"✅ ONNX-modell sparad till {output_dir}")
+    return output_dir
+
+def main():
+    parser = argparse.ArgumentParser(description="Exportera T5-modellen till ONNX Runtime.")
+    parser.add_argument("--model", type=Path, default=MODEL_DIR, help="Finjusterad checkpoint")
+    parser.add_argument("--output", type=Path, default=None, help="Standard: <model>-onnx")
+    parser.add_argument("--quantize", action="store_true", help="Dynamisk int8-kvantisering av ONNX-vikterna")
+    args = parser.parse_args()
+
+    export_onnx(args.model, args.output or default_onnx_path(args.model), quantize=args.quantize)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,87 @@
+# src/faq.py
+
+import re
+
+from preprocess import BOOLEAN_KEYS, FAQ_TEMPLATES, render_answer
+from relevance import RelevanceIndex
+
+# Fråga för etiketter som saknar mallar i FAQ_TEMPLATES
+DEFAULT_QUESTION = "Omfattar försäkringen {label}?"
+
+# Namnet i svaren när aggregatet saknar "försäkring"
+DEFAULT_NIVÅ = "försäkringen"
+
+_SPACE = re.compile(r"\s+")
+
+
+def normalize_question(question: str) -> str:
+    return _SPACE.sub(" ", question).strip().lower().rstrip("?").strip()
+
+
+def questions(label: str) -> list[str]:
+    return FAQ_TEMPLATES.get(label) or [DEFAULT_QUESTION.format(label=label)]
+
+
+class FaqEngine:
+    """
+    Renderar FAQ-svar direkt från extract-aggregatets booleaner med samma
+    mallar som träningsdatan (FAQ_TEMPLATES/ANSWER_TEMPLATES, se
+    preprocess.py) – ingen generering. Enskilda frågor slås upp exakt mot
+    mallfrågorna och annars via nyckelorden i RelevanceIndex.
+    """
+
+    def __init__(self, index: RelevanceIndex | None = None):
+        self.index = index or RelevanceIndex()
+        self.labels = {bk["key"]: bk["label"] for bk in BOOLEAN_KEYS}
+        self.by_question: dict[str, str] = {}
+        for bk in BOOLEAN_KEYS:
+            for question in questions(bk["label"]):
+                self.by_question.setdefault(normalize_question(question), bk["key"])
+
+    def render(self, extract_agg: dict) -> dict:
+        """
+        FAQ-blocket för en försäkring: alla mallfrågor för varje boolean-nyckel
+        med svar utifrån aggregatet (saknade nycklar räknas som False).
+        """
+        nivå = extract_agg.get("försäkring") or DEFAULT_NIVÅ
+        return {
+            "faq": [
+                {
+                    "fråga": question,
+                    "svar": render_answer(question, label, extract_agg.get(key) is True, nivå),
+                    "nyckel": key,
+                }
+                for key, label in self.labels.items()
+                for question in questions(label)
+            ]
+        }
+
+    def match(self, question: str) -> tuple[str, str] | None:
+        """
+        (boolean-nyckel, "template" eller "keywords") för frågan, None om
+        ingen nyckel känns igen.
+        """
+        key = self.by_question.get(normalize_question(question))
+        if key is not None:
+            return key, "template"
+        hits = self.index.matched_keys(question)
+        if not hits:
+            return None
+        # Flest matchade ord vinner; vid lika den längsta stammen
+        key = max(hits, key=lambda k: (len(hits[k]), max(len(s) for s in hits[k])))
+        return key, "keywords"
+
+    def answer(self, extract_agg: dict, question: str) -> dict | None:
+        matched = self.match(question)
+        if matched is None:
+            return None
+        key, how = matched
+        value = extract_agg.get(key) is True
+        nivå = extract_agg.get("försäkring") or DEFAULT_NIVÅ
+        return {
+            "fråga": question,
+            "svar": render_answer(question, self.labels[key], value, nivå),
+            "nyckel": key,
+            "värde": value,
+            "matchning": how,
+        }
@@ -0,0 +1,91 @@
+# src/holdout.py
+
+import hashlib
+import json
+import os
+from pathlib import Path
+
+import chunking
+
+# 1) Paths
+BASE_DIR     = Path(__file__).parent.parent
+RAW_DIR      = BASE_DIR / "data" / "raw"
+DATASET_PATH = BASE_DIR / "data" / "dataset.jsonl"
+
+# Försäkringsbolag som hålls utanför destillationen i sin helhet (råtext,
+# rader i all_tasks.jsonl och lärarens svar på chunkarna), angivna med första
+# ordet i namnet – samma prefix som build_extract_relevant.find_raw_file.
+# Bolag med poster i dataset.jsonl ger facit (men läraren har tränats på
+# dem); bolag med bara råtext har läraren aldrig sett.
+HELD_OUT_INSURERS = [
+    part.strip().lower() for part in os.environ.get("HELD_OUT_INSURERS", "dkv,if,sensor").split(",") if part.strip()
+]
+
+# Slumpmässigt urval av rader i all_tasks.jsonl som train_all_tasks.py lämnar
+# utanför med EVAL_HOLDOUT_FRACTION; andelen sparas i modellkatalogen
+# (HOLDOUT_INFO) så att eval_profiles.py mäter på just de raderna
+HOLDOUT_INFO = "holdout.json"
+
+
+def in_eval_sample(text: str, fraction: float) -> bool:
+    """
+    Deterministiskt urval på hash av input: samma rader hamnar alltid i
+    urvalet, oberoende av filens ordning.
+    """
+    bucket = int(hashlib.sha1(text.encode("utf-8")).hexdigest()[:8], 16) % 1000
+    return bucket < fraction * 1000
+
+
+def insurer_key(name: str) -> str:
+    """
+    "Folksam Bas" → "folksam", "DKV Hälsa.txt" → "dkv".
+    """
+    return name.removesuffix(".txt").split()[0].lower()
+
+
+def labelled_insurers(path: Path = DATASET_PATH) -> set[str]:
+    with open(path, encoding="utf-8") as f:
+        return {insurer_key(json.loads(line)["försäkring"]) for line in f if line.strip()}
+
+
+def row_insurer(row: dict) -> str | None:
+    """
+    Bolaget en rad i all_tasks.jsonl gäller: "försäkring" i extract-/compare-
+    target, eller namnet efter "Ja, "/"Nej, " i faq-svaret.
+    """
+    target = row["target"]
+    try:
+        data = json.loads(target)
+    except (json.JSONDecodeError, TypeError):
+        data = None
+    if isinstance(data, dict) and data.get("försäkring"):
+        return insurer_key(data["försäkring"])
+    for prefix in ("Ja, ", "Nej, "):
+        if target.startswith(prefix):
+            return insurer_key(target[len(prefix):])
+    return None
+
+
+def is_held_out_row(row: dict, insurers: list[str] = HELD_OUT_INSURERS) -> bool:
+    return row_insurer(row) in insurers
+
+
+def raw_documents(held_out: bool, insurers: list[str] = HELD_OUT_INSURERS) -> list[Path]:
+    """
+    Råtexterna som (inte) hålls utanför.
+    """
+    return [p for p in sorted(RAW_DIR.glob("*.txt")) if (insurer_key(p.name) in insurers) == held_out]
+
+
+def chunk_prompts(tokenizer, paths: list[Path], max_input_length: int) -> list[str]:
+    """
+    "extract: "-prompts för chunkarna av råtexterna (chunkade som i API:t,
+    så att varje prompt ryms i max_input_length token), utan dubbletter.
+    """
+    max_tokens = max_input_length - len(tokenizer("extract:", add_special_tokens=False)["input_ids"]) - 1
+    prompts = []
+    for path in paths:
+        text = path.read_text(encoding="utf-8")
+        for chunk in chunking.chunk_document(tokenizer, text, max_tokens):
+            prompts.append(f"extract: {chunk.text.replace(chr(10), ' ')}")
+    return list(dict.fromkeys(prompts))
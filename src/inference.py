@@ -0,0 +1,170 @@
+# src/inference.py
+
+from pathlib import Path
+import torch
+from transformers import AutoModelForSeq2SeqLM, PreTrainedTokenizerBase
+
+# Genereringsinställningar som delas av alla uppgifter
+GENERATION_KWARGS = {"num_beams": 4, "early_stopping": True}
+
+# Namngivna genereringsprofiler för fri generering, från snabbast till mest
+# noggrann. Alla använder KV-cache. "draft" anger en utkastmodell (namnet i
+# modellregistret) för assisterad/spekulativ avkodning: utkastmodellen
+# föreslår token som huvudmodellen verifierar i ett pass – samma svar som
+# girig avkodning, men färre pass genom den stora decodern. Utkastmodellen
+# måste ha samma tokenizer (t.ex. en destillerad T5-small).
+GENERATION_PROFILES = {
+    "fast":     {"num_beams": 1, "do_sample": False},
+    "balanced": {"num_beams": 2, "early_stopping": True},
+    "accurate": GENERATION_KWARGS,
+    "assisted": {"num_beams": 1, "do_sample": False, "draft": "draft"},
+}
+
+# Max token-längd för input respektive genererat svar per uppgift
+TASK_MAX_INPUT_LENGTH = {"extract": 1024, "compare": 512, "faq": 512}
+TASK_MAX_LENGTH       = {"extract": 512,  "compare": 512, "faq": 1024}
+
+# Valbara inferensbackends:
+#   torch      – PyTorch fp32 (som tidigare)
+#   torch-int8 – PyTorch med dynamisk int8-kvantisering av alla Linear-lager (CPU)
+#   onnx       – ONNX Runtime-export av encoder/decoder med past-key-values
+#                (skapas med src/export_onnx.py, kräver optimum[onnxruntime])
+BACKENDS = ("torch", "torch-int8", "onnx")
+
+
+def default_onnx_path(model_path: str | Path) -> Path:
+    """
+    Var export_onnx.py lägger ONNX-exporten av en checkpoint som standard.
+    """
+    model_path = Path(model_path)
+    return model_path.with_name(model_path.name + "-onnx")
+
+
+def load_model(
+    model_path: str | Path,
+    backend: str = "torch",
+    device: torch.device | None = None,
+    mmap: bool = False,
+):
+    """
+    Laddar seq2seq-modellen med vald backend. Alla backends stöder .generate().
+    Med mmap läses vikterna från model.safetensors via minnesmappning
+    (low_cpu_mem_usage) i stället för att först allokeras och sedan kopieras.
+    """
+    if backend not in BACKENDS:
+        raise ValueError(f"Okänd backend '{backend}', välj en av {', '.join(BACKENDS)}.")
+    device = device or torch.device("cpu")
+
+    if backend == "onnx":
+        try:
+            from optimum.onnxruntime import ORTModelForSeq2SeqLM
+        except ImportError as exc:
+            raise RuntimeError(
+                "Backend 'onnx' kräver optimum[onnxruntime] (pip install optimum[onnxruntime])."
+            ) from exc
+        onnx_path = Path(model_path)
+        if not (onnx_path / "encoder_model.onnx").exists():
+            onnx_path = default_onnx_path(model_path)
+        if not (onnx_path / "encoder_model.onnx").exists():
+            raise FileNotFoundError(
+                f"Hittade ingen ONNX-export i {model_path} eller {onnx_path} "
+                f"(kör python src/export_onnx.py --model {model_path} först)."
+            )
+        return ORTModelForSeq2SeqLM.from_pretrained(str(onnx_path), use_cache=True)
+
+    load_kwargs = {}
+    if mmap:
+        load_kwargs["low_cpu_mem_usage"] = True
+        if (Path(model_path) / "model.safetensors").exists():
+            load_kwargs["use_safetensors"] = True
+    model = AutoModelForSeq2SeqLM.from_pretrained(str(model_path), **load_kwargs)
+    model.eval()
+    if backend == "torch-int8":
+        if device.type != "cpu":
+            raise ValueError("Backend 'torch-int8' stöds bara på CPU.")
+        model = torch.ao.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+    return model.to(device)
+
+
+def profile_generation_kwargs(profile: dict, draft_model=None) -> dict:
+    """
+    Argument till model.generate för en profil: "draft" byts mot
+    assistant_model (utan utkastmodell blir det vanlig girig avkodning).
+    """
+    kwargs = {k: v for k, v in profile.items() if k != "draft"}
+    if "draft" in profile and draft_model is not None:
+        kwargs["assistant_model"] = draft_model
+    return kwargs
+
+
+def generate_batch(
+    model,
+    tokenizer: PreTrainedTokenizerBase,
+    device: torch.device,
+    prompts: list[str | list[int]],
+    max_input_length: int,
+    max_length: int | list[int],
+    batch_size: int = 8,
+    token_counts: list[int] | None = None,
+    **generation_kwargs,
+) -> list[str]:
+    """
+    Tokeniserar alla prompts på en gång, sorterar dem efter längd och kör
+    model.generate i mikrobatchar om batch_size. Svaren returneras i samma
+    ordning som prompts.
+
+    En prompt kan vara text eller redan tokeniserade input_ids. max_length kan
+    anges per prompt; bara prompts med samma max_length hamnar i samma
+    mikrobatch (med beam search är ett längre max_length som kortas av
+    efteråt inte samma sak – strålarna väljs då över en annan längd).
+    Om token_counts skickas med fylls den med antal genererade token per prompt.
+    Assisterad avkodning (assistant_model) stöder bara en prompt per anrop,
+    så då körs mikrobatchar om 1.
+    """
+    if not prompts:
+        return []
+    generation_kwargs = generation_kwargs or GENERATION_KWARGS
+    if "assistant_model" in generation_kwargs:
+        batch_size = 1
+    if isinstance(max_length, int):
+        max_length = [max_length] * len(prompts)
+    texts = [i for i, p in enumerate(prompts) if isinstance(p, str)]
+    encodings: list[list[int]] = [p if not isinstance(p, str) else [] for p in prompts]
+    if texts:
+        tokenized = tokenizer(
+            [prompts[i] for i in texts],
+            truncation=True,
+            max_length=max_input_length
+        )["input_ids"]
+        for i, ids in zip(texts, tokenized):
+            encodings[i] = ids
+    # Gruppera på max_length och sortera efter längd inom gruppen, så att
+    # varje mikrobatch paddas så lite som möjligt
+    order = sorted(range(len(prompts)), key=lambda i: (max_length[i], -len(encodings[i])))
+    batches: list[list[int]] = []
+    for i in order:
+        if batches and len(batches[-1]) < max(1, batch_size) and max_length[batches[-1][0]] == max_length[i]:
+            batches[-1].append(i)
+        else:
+            batches.append([i])
+    results: list[str] = [""] * len(prompts)
+    if token_counts is not None:
+        token_counts[:] = [0] * len(prompts)
+    for idx in batches:
+        inputs = tokenizer.pad(
+            {"input_ids": [encodings[i] for i in idx]},
+            return_tensors="pt"
+        )
+        inputs = {k: v.to(device) for k, v in inputs.items()}
+        with torch.no_grad():
+            outputs = model.generate(
+                **inputs,
+                max_length=max_length[idx[0]],
+                **generation_kwargs
+            )
+        decoded = tokenizer.batch_decode(outputs, skip_special_tokens=True)
+        for i, row, out_str in zip(idx, outputs, decoded):
+            results[i] = out_str
+            if token_counts is not None:
+                token_counts[i] = int((row != tokenizer.pad_token_id).sum())
+    return results
@@ -0,0 +1,391 @@
+# src/jobs.py
+
+import asyncio
+import json
+import sqlite3
+import threading
+import time
+import uuid
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from dataclasses import asdict, dataclass, field, replace
+from pathlib import Path
+from typing import AsyncIterator, Callable
+
+# Jobbstatus
+QUEUED    = "queued"
+RUNNING   = "running"
+CANCELLING = "cancelling"  # avbrott begärt, jobbet har inte hunnit stanna
+SUCCEEDED = "succeeded"
+FAILED    = "failed"
+CANCELLED = "cancelled"
+FINISHED  = (SUCCEEDED, FAILED, CANCELLED)
+
+
+@dataclass
+class Job:
+    """
+    Ett analysjobb. options skickas som nyckelordsargument till pipelinen,
+    partial innehåller senaste händelsen per typ från pipelinen, timings
+    pipelinens egna sekunder per steg (ur result-händelsen).
+    """
+    id: str
+    text: str
+    options: dict = field(default_factory=dict)
+    status: str = QUEUED
+    created: float = field(default_factory=time.time)
+    started: float | None = None
+    finished: float | None = None
+    partial: dict = field(default_factory=dict)
+    timings: dict = field(default_factory=dict)
+    result: dict | None = None
+    error: dict | None = None
+
+    def public(self) -> dict:
+        """
+        Jobbet som det visas för klienten (utan den fullständiga texten).
+        """
+        data = asdict(self)
+        data.pop("text")
+        data["text_length"] = len(self.text)
+        return data
+
+
+class QueueFullError(Exception):
+    """
+    Kön är full – klienten ska försöka igen senare (HTTP 429).
+    """
+
+
+class JobBackend(ABC):
+    """
+    Lagring och kö för jobb. Väntande jobb hämtas i den ordning de skapades.
+    """
+
+    @abstractmethod
+    def add(self, job: Job) -> None: ...
+
+    @abstractmethod
+    def get(self, job_id: str) -> Job | None: ...
+
+    @abstractmethod
+    def save(self, job: Job) -> None:
+        """
+        Sparar jobbets status, delresultat och tider (texten ändras aldrig efter add).
+        """
+
+    @abstractmethod
+    def pop_queued(self) -> Job | None:
+        """
+        Plockar äldsta köade jobbet och markerar det som RUNNING.
+        """
+
+    @abstractmethod
+    def cancel_queued(self, job_id: str) -> bool:
+        """
+        Markerar jobbet som CANCELLED om det fortfarande är köat.
+        """
+
+    @abstractmethod
+    def count_queued(self) -> int: ...
+
+
+class InMemoryJobBackend(JobBackend):
+    """
+    Jobb i processens minne. Avslutade jobb glöms efter ttl sekunder, och
+    högst max_finished av dem behålls (äldst avslutade glöms först).
+    """
+
+    def __init__(self, ttl: float = 86400.0, max_finished: int = 1000):
+        self.ttl = ttl
+        self.max_finished = max_finished
+        self._jobs: dict[str, Job] = {}
+        self._queue: list[str] = []
+        self._finished: OrderedDict[str, float] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _evict(self) -> None:
+        cutoff = time.time() - self.ttl
+        while self._finished and (
+            len(self._finished) > self.max_finished or next(iter(self._finished.values())) < cutoff
+        ):
+            job_id, _ = self._finished.popitem(last=False)
+            self._jobs.pop(job_id, None)
+
+    def _mark_finished(self, job: Job) -> None:
+        if job.status in FINISHED and job.id not in self._finished:
+            self._finished[job.id] = job.finished or time.time()
+        self._evict()
+
+    def add(self, job: Job) -> None:
+        with self._lock:
+            self._jobs[job.id] = job
+            self._queue.append(job.id)
+            self._evict()
+
+    def get(self, job_id: str) -> Job | None:
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def save(self, job: Job) -> None:
+        with self._lock:
+            self._jobs[job.id] = job
+            self._mark_finished(job)
+
+    def pop_queued(self) -> Job | None:
+        with self._lock:
+            while self._queue:
+                job = self._jobs.get(self._queue.pop(0))
+                if job is not None and job.status == QUEUED:
+                    job.status = RUNNING
+                    return job
+            return None
+
+    def cancel_queued(self, job_id: str) -> bool:
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None or job.status != QUEUED:
+                return False
+            job.status = CANCELLED
+            job.finished = time.time()
+            self._mark_finished(job)
+            return True
+
+    def count_queued(self) -> int:
+        with self._lock:
+            return sum(
+                1 for job_id in self._queue if job_id in self._jobs and self._jobs[job_id].status == QUEUED
+            )
+
+
+class SqliteJobBackend(JobBackend):
+    """
+    Jobb i en lokal SQLite-fil. Jobb som var igång när processen dog köas om
+    vid start. Avslutade jobb tas bort efter ttl sekunder.
+    """
+
+    _COLUMNS = (
+        "id", "text", "options", "status", "created", "started", "finished", "partial", "timings", "result", "error"
+    )
+    _JSON_COLUMNS = ("options", "partial", "timings", "result", "error")
+    # Det som ändras medan jobbet körs (texten skrivs bara i add)
+    _STATE_COLUMNS = ("status", "started", "finished", "partial", "timings", "result", "error")
+
+    def __init__(self, path: str | Path, ttl: float = 86400.0):
+        self.ttl = ttl
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        self._db = sqlite3.connect(str(path), check_same_thread=False)
+        self._lock = threading.Lock()
+        with self._lock:
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS jobs ("
+                " id TEXT PRIMARY KEY, text TEXT, options TEXT, status TEXT, created REAL, started REAL,"
+                " finished REAL, partial TEXT, timings TEXT, result TEXT, error TEXT)"
+            )
+            # Filer från före options-kolumnen
+            if "options" not in {row[1] for row in self._db.execute("PRAGMA table_info(jobs)")}:
+                self._db.execute("ALTER TABLE jobs ADD COLUMN options TEXT")
+            self._db.execute("CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, created)")
+            self._db.execute("UPDATE jobs SET status = ? WHERE status = ?", (QUEUED, RUNNING))
+            self._db.commit()
+
+    def _row(self, job: Job, columns: tuple[str, ...]) -> tuple:
+        data = asdict(job)
+        return tuple(
+            json.dumps(data[c], ensure_ascii=False) if c in self._JSON_COLUMNS else data[c]
+            for c in columns
+        )
+
+    def _job(self, row: tuple) -> Job:
+        data = dict(zip(self._COLUMNS, row))
+        for c in self._JSON_COLUMNS:
+            data[c] = json.loads(data[c]) if data[c] is not None else None
+        data["options"] = data["options"] or {}
+        return Job(**data)
+
+    def add(self, job: Job) -> None:
+        with self._lock:
+            self._db.execute(
+                f"INSERT INTO jobs ({', '.join(self._COLUMNS)}) VALUES ({', '.join('?' * len(self._COLUMNS))})",
+                self._row(job, self._COLUMNS),
+            )
+            self._db.commit()
+
+    def get(self, job_id: str) -> Job | None:
+        with self._lock:
+            row = self._db.execute(
+                f"SELECT {', '.join(self._COLUMNS)} FROM jobs WHERE id = ?", (job_id,)
+            ).fetchone()
+        return self._job(row) if row else None
+
+    def save(self, job: Job) -> None:
+        with self._lock:
+            self._db.execute(
+                f"UPDATE jobs SET {', '.join(f'{c} = ?' for c in self._STATE_COLUMNS)} WHERE id = ?",
+                (*self._row(job, self._STATE_COLUMNS), job.id),
+            )
+            if job.status in FINISHED:
+                self._db.execute("DELETE FROM jobs WHERE finished < ?", (time.time() - self.ttl,))
+            self._db.commit()
+
+    def pop_queued(self) -> Job | None:
+        with self._lock:
+            row = self._db.execute(
+                f"SELECT {', '.join(self._COLUMNS)} FROM jobs WHERE status = ? ORDER BY created LIMIT 1",
+                (QUEUED,),
+            ).fetchone()
+            if row is None:
+                return None
+            job = self._job(row)
+            job.status = RUNNING
+            self._db.execute("UPDATE jobs SET status = ? WHERE id = ?", (RUNNING, job.id))
+            self._db.commit()
+            return job
+
+    def cancel_queued(self, job_id: str) -> bool:
+        with self._lock:
+            cursor = self._db.execute(
+                "UPDATE jobs SET status = ?, finished = ? WHERE id = ? AND status = ?",
+                (CANCELLED, time.time(), job_id, QUEUED),
+            )
+            self._db.commit()
+            return cursor.rowcount > 0
+
+    def count_queued(self) -> int:
+        with self._lock:
+            return self._db.execute("SELECT COUNT(*) FROM jobs WHERE status = ?", (QUEUED,)).fetchone()[0]
+
+
+class JobManager:
+    """
+    Kör jobb med en begränsad pool av arbetare (asyncio-tasks). Varje jobb kör
+    pipeline(text, **options), som yieldar händelser {"event": ..., ...}; en händelse av
+    typen "result" ger jobbets slutresultat och tider. Själva inferensen sker
+    på schemaläggarens tråd och backend-anropen i trådpoolen, så arbetarna
+    blockerar inte event-loopen.
+    """
+
+    def __init__(
+        self,
+        backend: JobBackend,
+        pipeline: Callable[..., AsyncIterator[dict]],
+        workers: int = 2,
+        max_queued: int = 100,
+    ):
+        self.backend = backend
+        self.pipeline = pipeline
+        self.workers = max(1, workers)
+        self.max_queued = max_queued
+        self._wakeup: asyncio.Event | None = None
+        self._tasks: list[asyncio.Task] = []
+        self._running: dict[str, asyncio.Task] = {}
+        # Avbrutna jobb som plockats ur kön men ännu inte startat
+        self._cancelled: set[str] = set()
+
+    async def start(self) -> None:
+        self._wakeup = asyncio.Event()
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+        self._wakeup.set()  # plocka upp jobb som finns kvar i backend sedan förra körningen
+
+    async def stop(self) -> None:
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    async def submit(self, text: str, options: dict | None = None) -> Job:
+        if await asyncio.to_thread(self.backend.count_queued) >= self.max_queued:
+            raise QueueFullError(f"Jobbkön är full ({self.max_queued} köade jobb).")
+        job = Job(id=uuid.uuid4().hex, text=text, options=dict(options or {}))
+        await asyncio.to_thread(self.backend.add, job)
+        if self._wakeup is not None:
+            self._wakeup.set()
+        return job
+
+    async def get(self, job_id: str) -> Job | None:
+        return await asyncio.to_thread(self.backend.get, job_id)
+
+    async def cancel(self, job_id: str) -> Job | None:
+        """
+        Köade jobb avbryts direkt (CANCELLED); för jobb som körs begärs avbrott
+        och svaret har status CANCELLING tills jobbet stannat.
+        """
+        job = await self.get(job_id)
+        if job is None or job.status in FINISHED:
+            return job
+        if await asyncio.to_thread(self.backend.cancel_queued, job_id):
+            return await self.get(job_id)
+        task = self._running.get(job_id)
+        if task is not None:
+            if task.done():
+                return await self.get(job_id)
+            task.cancel()  # _run markerar jobbet som avbrutet
+        else:
+            self._cancelled.add(job_id)  # plockat ur kön, _worker startar det inte
+        return replace(job, status=CANCELLING)
+
+    def stats(self) -> dict:
+        """
+        Jobbköns läge. Räknar köade jobb i backend (SQLite med
+        SqliteJobBackend) och blockerar därför – anropa inte från event-loopen.
+        """
+        return {
+            "workers": self.workers,
+            "running": len(self._running),
+            "queued": self.backend.count_queued(),
+            "max_queued": self.max_queued,
+        }
+
+    async def _worker(self) -> None:
+        while True:
+            job = await asyncio.to_thread(self.backend.pop_queued)
+            if job is None:
+                self._wakeup.clear()
+                await self._wakeup.wait()
+                continue
+            if job.id in self._cancelled:
+                self._cancelled.discard(job.id)
+                job.status = CANCELLED
+                job.finished = time.time()
+                await asyncio.to_thread(self.backend.save, job)
+                continue
+            task = asyncio.create_task(self._run(job))
+            self._running[job.id] = task
+            try:
+                # asyncio.wait kastar inte när själva jobbet avbryts via cancel()
+                await asyncio.wait({task})
+            except asyncio.CancelledError:
+                task.cancel()  # arbetaren stoppas
+                raise
+            finally:
+                self._running.pop(job.id, None)
+
+    async def _run(self, job: Job) -> None:
+        job.started = time.time()
+        # Sparandet skyddas mot cancel() så att jobbet inte ändras medan det skrivs
+        saving = asyncio.ensure_future(asyncio.to_thread(self.backend.save, job))
+        status, error = FAILED, None
+        try:
+            await asyncio.shield(saving)
+            async for event in self.pipeline(job.text, **job.options):
+                kind = event.get("event", "event")
+                if kind == "result":
+                    job.result = event["result"]
+                    job.timings = event.get("timings", {})
+                else:
+                    job.partial[kind] = {k: v for k, v in event.items() if k != "event"}
+                saving = asyncio.ensure_future(asyncio.to_thread(self.backend.save, job))
+                await asyncio.shield(saving)
+            status, error = SUCCEEDED, None
+        except asyncio.CancelledError:
+            status, error = CANCELLED, None
+            raise
+        except Exception as exc:  # noqa: BLE001 – felet sparas på jobbet
+            status, error = FAILED, {
+                "status_code": getattr(exc, "status_code", 500),
+                "detail": getattr(exc, "detail", str(exc)),
+            }
+        finally:
+            await asyncio.wait({saving})
+            job.status, job.error, job.finished = status, error, time.time()
+            await asyncio.to_thread(self.backend.save, job)
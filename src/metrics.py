@@ -0,0 +1,148 @@
+# src/metrics.py
+
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Iterable
+
+# Standardhinkar (sekunder) – från en snabb tokenisering till en lång beam search
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0)
+
+# En insamlad serie: (namn, typ, hjälptext, [(etiketter, värde), ...])
+Sample = tuple[str, str, str, list[tuple[dict, float]]]
+
+
+def _format_labels(labels: dict) -> str:
+    if not labels:
+        return ""
+    parts = []
+    for k, v in sorted(labels.items()):
+        v = str(v).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+        parts.append(f'{k}="{v}"')
+    return "{" + ",".join(parts) + "}"
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+
+class Counter:
+    """
+    Monotont växande räknare med valfria etiketter.
+    """
+
+    def __init__(self, name: str, help: str):
+        self.name = name
+        self.help = help
+        self._values: dict[tuple, float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1.0, **labels) -> None:
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_format_labels(dict(key))} {_format_value(value)}")
+        return lines
+
+
+class Histogram:
+    """
+    Histogram med fasta hinkar, t.ex. för latenser per steg.
+    """
+
+    def __init__(self, name: str, help: str, buckets: Iterable[float] = DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help
+        self.buckets = tuple(sorted(buckets)) + (float("inf"),)
+        self._series: dict[tuple, list] = {}  # etiketter -> [hinkräknare, summa, antal]
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels) -> None:
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            series = self._series.setdefault(key, [[0] * len(self.buckets), 0.0, 0])
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[0][i] += 1
+            series[1] += value
+            series[2] += 1
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for key, (counts, total, n) in sorted(self._series.items()):
+                labels = dict(key)
+                for bound, count in zip(self.buckets, counts):
+                    le = _format_labels({**labels, "le": _format_value(bound)})
+                    lines.append(f"{self.name}_bucket{le} {count}")
+                lines.append(f"{self.name}_sum{_format_labels(labels)} {_format_value(total)}")
+                lines.append(f"{self.name}_count{_format_labels(labels)} {n}")
+        return lines
+
+
+class Registry:
+    """
+    Samling av mätvärden som renderas i Prometheus textformat. Collectors är
+    funktioner som vid varje skrapning returnerar färdiga serier (t.ex. från
+    schemaläggarens eller cachens stats()).
+    """
+
+    def __init__(self):
+        self._metrics: list[Counter | Histogram] = []
+        self._collectors: list[Callable[[], list[Sample]]] = []
+
+    def counter(self, name: str, help: str) -> Counter:
+        metric = Counter(name, help)
+        self._metrics.append(metric)
+        return metric
+
+    def histogram(self, name: str, help: str, buckets: Iterable[float] = DEFAULT_BUCKETS) -> Histogram:
+        metric = Histogram(name, help, buckets)
+        self._metrics.append(metric)
+        return metric
+
+    def add_collector(self, collector: Callable[[], list[Sample]]) -> None:
+        self._collectors.append(collector)
+
+    def render(self) -> str:
+        lines: list[str] = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        for collector in self._collectors:
+            for name, kind, help, samples in collector():
+                lines.append(f"# HELP {name} {help}")
+                lines.append(f"# TYPE {name} {kind}")
+                for labels, value in samples:
+                    lines.append(f"{name}{_format_labels(labels)} {_format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+# Latens per steg i analysflödet
+STAGE_SECONDS = REGISTRY.histogram(
+    "analyze_stage_seconds", "Tid per steg i analysflödet (chunking, extract, compare, faq)."
+)
+
+
+@contextmanager
+def span(stage: str, timings: dict | None = None, histogram: Histogram = STAGE_SECONDS):
+    """
+    Mäter tiden för ett block: observeras i histogrammet med etiketten stage
+    och summeras (sekunder) i timings[stage] om ett dict skickas med.
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        histogram.observe(elapsed, stage=stage)
+        if timings is not None:
+            timings[stage] = timings.get(stage, 0.0) + elapsed
@@ -0,0 +1,439 @@
+# src/model_registry.py
+
+import gc
+import itertools
+import json
+import os
+import resource
+import sys
+import threading
+import time
+from pathlib import Path
+from typing import Any, Callable
+
+import torch
+from transformers import AutoTokenizer, PreTrainedTokenizerBase
+
+import inference
+from workers import ProcessWorkerPool
+
+# Livscykel för en modell i registret
+UNLOADED = "unloaded"
+LOADING  = "loading"
+WARMING  = "warming"
+READY    = "ready"
+FAILED   = "failed"
+
+DEFAULT_MODEL = "default"
+# Namnet på utkastmodellen för assisterad avkodning (se inference.GENERATION_PROFILES)
+DRAFT_MODEL   = "draft"
+_generation = itertools.count(1)
+
+
+def model_revision(path: str, backend: str) -> str:
+    """
+    Identifierar checkpointen (config + vikternas storlek/mtime) och backend,
+    så att cachade svar från en annan modell aldrig återanvänds. Kräver inte
+    att modellen är laddad. MODEL_REVISION läggs till som extra komponent
+    (t.ex. en version för att ogiltigförklara cachen), ersätter aldrig resten.
+    """
+    parts = [path, backend]
+    if os.environ.get("MODEL_REVISION"):
+        parts.insert(0, os.environ["MODEL_REVISION"])
+    if os.path.isdir(path):
+        for name in sorted(os.listdir(path)):
+            stat = os.stat(os.path.join(path, name))
+            parts.append(f"{name}:{stat.st_size}:{int(stat.st_mtime)}")
+    return "|".join(parts)
+
+
+def process_rss_bytes() -> int:
+    """
+    Processens nuvarande RSS (Linux), annars högsta RSS hittills.
+    """
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return rss if sys.platform == "darwin" else rss * 1024
+
+
+def system_memory_bytes() -> int | None:
+    try:
+        return os.sysconf("SC_PHYS_PAGES") * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError):
+        return None
+
+
+def model_bytes(model, path: str) -> int:
+    """
+    Minnet som vikterna tar: alla tensorer i state_dict (även int8-packade
+    vikter), eller ONNX-filernas storlek för ORT-modeller.
+    """
+    if hasattr(model, "state_dict"):
+        total = 0
+        for value in model.state_dict().values():
+            for tensor in value if isinstance(value, tuple) else (value,):
+                if isinstance(tensor, torch.Tensor):
+                    total += tensor.numel() * tensor.element_size()
+        return total
+    onnx_dir = Path(path) if (Path(path) / "encoder_model.onnx").exists() else inference.default_onnx_path(path)
+    return sum(f.stat().st_size for f in onnx_dir.glob("*.onnx"))
+
+
+class ModelEntry:
+    """
+    En checkpoint: tokenizer och modell som laddas först när de behövs –
+    vid första åtkomsten av .tokenizer/.model eller när load() anropas –
+    i stället för när modulen importeras. Laddningen är trådsäker och sker en
+    gång. Status blir READY först när warmup() kört klart. uid skiljer två
+    laddningar av samma namn åt (före och efter ett byte). Med workers > 0
+    körs inferensen i så många arbetsprocesser som delar vikterna (se
+    workers.py) och .pool är satt.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        path: str,
+        backend: str = "torch",
+        mmap: bool = False,
+        task_prefix: bool = True,
+        workers: int = 0,
+        threads_per_worker: int | None = None,
+    ):
+        if workers and backend != "torch":
+            # Fånga felkonfigurationen vid start i stället för vid första laddningen
+            raise ValueError(
+                f"'{name}': arbetsprocesser (workers={workers}) stöds bara med backend 'torch', inte '{backend}'."
+            )
+        self.name = name
+        self.path = path
+        self.backend = backend
+        self.mmap = mmap
+        # Modeller tränade med "extract: "-prefix (all-tasks) respektive utan (extract-relevant-mt5)
+        self.task_prefix = task_prefix
+        self.workers = workers
+        self.threads_per_worker = threads_per_worker
+        self.pool: ProcessWorkerPool | None = None
+        self.uid = f"{name}#{next(_generation)}"
+        self.device = torch.device(
+            "cuda" if torch.cuda.is_available() and backend == "torch" and not workers else "cpu"
+        )
+        self.revision = model_revision(path, backend)
+        self.state = UNLOADED
+        self.error: str | None = None
+        self.timings: dict[str, float] = {}
+        self.memory: dict[str, int] = {}
+        self._tokenizer: PreTrainedTokenizerBase | None = None
+        self._model = None
+        self._derived: dict[str, Any] = {}
+        self._lock = threading.RLock()
+        self._inflight = 0
+        self._idle = threading.Condition()
+
+    @property
+    def loaded(self) -> bool:
+        return self._model is not None
+
+    @property
+    def ready(self) -> bool:
+        return self.state == READY
+
+    @property
+    def tokenizer(self) -> PreTrainedTokenizerBase:
+        if self._tokenizer is None:
+            self.load()
+        return self._tokenizer
+
+    @property
+    def model(self):
+        if self._model is None:
+            self.load()
+        return self._model
+
+    def load(self) -> None:
+        """
+        Laddar tokenizer och modell om det inte redan är gjort. Samtidiga
+        anrop väntar in samma laddning.
+        """
+        with self._lock:
+            if self._model is not None:
+                return
+            self.state = LOADING
+            start, rss_before = time.perf_counter(), process_rss_bytes()
+            try:
+                self._tokenizer = AutoTokenizer.from_pretrained(self.path)
+                if self.workers:
+                    # fp32-vikterna delas med arbetarna (bara backend "torch", se workers.py)
+                    self._model = inference.load_model(self.path, "torch", self.device, mmap=self.mmap)
+                    self.pool = ProcessWorkerPool(
+                        self._model, self.path, self.backend, self.workers, self.threads_per_worker
+                    )
+                else:
+                    self._model = inference.load_model(self.path, self.backend, self.device, mmap=self.mmap)
+            except Exception as exc:
+                self.state = FAILED
+                self.error = f"{type(exc).__name__}: {exc}"
+                raise
+            self.timings["load"] = time.perf_counter() - start
+            self.memory = {
+                "weights_bytes": model_bytes(self._model, self.path),
+                "rss_delta_bytes": max(0, process_rss_bytes() - rss_before),
+            }
+            self.state = WARMING
+
+    def warmup(self, run: Callable[["ModelEntry"], Any] | None = None) -> None:
+        """
+        Laddar modellen och kör run(self) (t.ex. en kort generering) så att
+        första riktiga anropet inte betalar för lat initiering; därefter READY.
+        """
+        self.load()
+        start = time.perf_counter()
+        try:
+            if run is not None:
+                run(self)
+        except Exception as exc:
+            self.state = FAILED
+            self.error = f"{type(exc).__name__}: {exc}"
+            raise
+        self.timings["warmup"] = time.perf_counter() - start
+        self.state = READY
+
+    def unload(self) -> None:
+        with self._lock:
+            if self.pool is not None:
+                self.pool.stop()
+                self.pool = None
+            self._model = None
+            self._tokenizer = None
+            self._derived.clear()
+            self.memory = {}
+            self.state = UNLOADED
+        gc.collect()
+        if self.device.type == "cuda":
+            torch.cuda.empty_cache()
+
+    def derived(self, name: str, factory: Callable[[], Any]) -> Any:
+        """
+        Värde som beräknas från tokenizer/modell (t.ex. förtokeniserade
+        prefix) en gång per laddad modell.
+        """
+        with self._lock:
+            if name not in self._derived:
+                self._derived[name] = factory()
+            return self._derived[name]
+
+    def acquire(self, n: int = 1) -> None:
+        """
+        Räknar anrop som köats eller körs mot modellen (för dränering vid byte).
+        """
+        with self._idle:
+            self._inflight += n
+
+    def release(self, n: int = 1) -> None:
+        with self._idle:
+            self._inflight = max(0, self._inflight - n)
+            if self._inflight == 0:
+                self._idle.notify_all()
+
+    def wait_idle(self, timeout: float | None = None) -> bool:
+        with self._idle:
+            return self._idle.wait_for(lambda: self._inflight == 0, timeout)
+
+    def status(self) -> dict:
+        return {
+            "uid": self.uid,
+            "path": self.path,
+            "backend": self.backend,
+            "device": str(self.device),
+            "task_prefix": self.task_prefix,
+            "state": self.state,
+            "error": self.error,
+            "inflight": self._inflight,
+            "timings": self.timings,
+            "memory": self.memory,
+            "workers": self.pool.stats() if self.pool is not None else None,
+        }
+
+
+class ModelRegistry:
+    """
+    Flera namngivna checkpoints samtidigt med routning per uppgift (task ->
+    namn). swap() byter checkpoint för ett namn utan omstart: den nya laddas
+    och värms upp medan den gamla fortsätter svara, sedan byts de atomiskt
+    och den gamla laddas ur när alla anrop som redan köats mot den är klara.
+    """
+
+    def __init__(self, entries: dict[str, ModelEntry], routes: dict[str, str] | None = None):
+        if not entries:
+            raise ValueError("Registret behöver minst en modell.")
+        self.default = DEFAULT_MODEL if DEFAULT_MODEL in entries else next(iter(entries))
+        self.routes = dict(routes or {})
+        for task, name in self.routes.items():
+            if name not in entries:
+                raise ValueError(f"Uppgiften '{task}' routas till okänd modell '{name}'.")
+        self._entries = dict(entries)
+        self._retired: dict[str, ModelEntry] = {}
+        self._swapping: dict[str, ModelEntry] = {}
+        # Senaste bytet per namn: {"status": "loading"|"draining"|"done"|"failed",
+        # "path": ..., "error": ...}, och bakgrundsuppgiften som kör det
+        self._swaps: dict[str, dict] = {}
+        self.swap_tasks: dict[str, Any] = {}
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_config(
+        cls,
+        models_spec: str | None,
+        routes_spec: str | None,
+        default_path: str,
+        default_backend: str = "torch",
+        mmap: bool = False,
+        workers: int = 0,
+        threads_per_worker: int | None = None,
+        draft_path: str | None = None,
+    ) -> "ModelRegistry":
+        """
+        models_spec: JSON (eller sökväg till en JSON-fil) {namn: {"path": ...,
+        "backend": ..., "mmap": ..., "task_prefix": ..., "workers": ...}}; utan spec en enda
+        modell "default" = default_path. routes_spec: "extract=extractor,compare=default".
+        draft_path registrerar dessutom en modell "draft" (om den inte redan finns).
+        """
+        if models_spec and os.path.isfile(models_spec):
+            models_spec = Path(models_spec).read_text(encoding="utf-8")
+        config = json.loads(models_spec) if models_spec else {DEFAULT_MODEL: {"path": default_path}}
+        if draft_path:
+            config.setdefault(DRAFT_MODEL, {"path": draft_path})
+        entries = {
+            name: ModelEntry(
+                name,
+                spec["path"],
+                backend=spec.get("backend", default_backend),
+                mmap=spec.get("mmap", mmap),
+                task_prefix=spec.get("task_prefix", True),
+                workers=spec.get("workers", workers),
+                threads_per_worker=spec.get("threads_per_worker", threads_per_worker),
+            )
+            for name, spec in config.items()
+        }
+        routes = {}
+        for part in (routes_spec or "").split(","):
+            if part.strip():
+                task, name = part.split("=", 1)
+                routes[task.strip()] = name.strip()
+        return cls(entries, routes)
+
+    def names(self) -> list[str]:
+        with self._lock:
+            return list(self._entries)
+
+    def get(self, name: str) -> ModelEntry:
+        with self._lock:
+            return self._entries[name]
+
+    def for_task(self, task: str) -> ModelEntry:
+        return self.get(self.routes.get(task, self.default))
+
+    def lookup(self, uid: str) -> ModelEntry:
+        """
+        Modellen med uid – även en utbytt modell som fortfarande dräneras.
+        """
+        name = uid.split("#", 1)[0]
+        with self._lock:
+            current = self._entries[name]
+            return current if current.uid == uid else self._retired.get(uid, current)
+
+    @property
+    def ready(self) -> bool:
+        with self._lock:
+            return all(entry.ready for entry in self._entries.values())
+
+    def warmup_all(self, run: Callable[[ModelEntry], Any] | None = None) -> None:
+        for name in self.names():
+            self.get(name).warmup(run)
+
+    def swap(
+        self,
+        name: str,
+        path: str,
+        backend: str | None = None,
+        run: Callable[[ModelEntry], Any] | None = None,
+        drain_timeout: float | None = 600.0,
+    ) -> ModelEntry:
+        """
+        Laddar och värmer upp path som ny version av name, byter atomiskt och
+        väntar in (högst drain_timeout s) anrop mot den gamla innan den laddas ur.
+        Blockerar – kör i en bakgrundstråd.
+        """
+        with self._lock:
+            old = self._entries[name]
+            if name in self._swapping:
+                raise RuntimeError(f"Ett byte av '{name}' pågår redan.")
+            try:
+                new = ModelEntry(
+                    name, path, backend=backend or old.backend, mmap=old.mmap, task_prefix=old.task_prefix,
+                    workers=old.workers, threads_per_worker=old.threads_per_worker
+                )
+            except ValueError as e:
+                self._swaps[name] = {"status": "failed", "path": path, "error": f"{type(e).__name__}: {e}"}
+                raise
+            self._swapping[name] = new
+            self._swaps[name] = {"status": "loading", "path": path, "error": None}
+        try:
+            new.warmup(run)
+        except Exception as e:
+            new.unload()
+            with self._lock:
+                self._swaps[name] = {"status": "failed", "path": path, "error": f"{type(e).__name__}: {e}"}
+            raise
+        finally:
+            with self._lock:
+                self._swapping.pop(name, None)
+        with self._lock:
+            self._entries[name] = new
+            self._retired[old.uid] = old
+            self._swaps[name]["status"] = "draining"
+        old.wait_idle(drain_timeout)
+        with self._lock:
+            self._retired.pop(old.uid, None)
+        old.unload()
+        with self._lock:
+            self._swaps[name]["status"] = "done"
+        return new
+
+    def swapping(self, name: str) -> bool:
+        with self._lock:
+            return name in self._swapping
+
+    def memory(self) -> dict:
+        with self._lock:
+            entries = list(self._entries.values()) + list(self._retired.values()) + list(self._swapping.values())
+        return {
+            "process_rss_bytes": process_rss_bytes(),
+            "system_bytes": system_memory_bytes(),
+            "weights_bytes": sum(e.memory.get("weights_bytes", 0) for e in entries),
+            "models": {e.uid: e.memory for e in entries},
+        }
+
+    def status(self) -> dict:
+        with self._lock:
+            models = {
+                name: {
+                    **entry.status(),
+                    "swap_status": self._swaps.get(name, {}).get("status"),
+                    "swap_error": self._swaps.get(name, {}).get("error"),
+                }
+                for name, entry in self._entries.items()
+            }
+            retired = {uid: entry.status() for uid, entry in self._retired.items()}
+            swapping = {name: entry.status() for name, entry in self._swapping.items()}
+        return {
+            "ready": self.ready,
+            "default": self.default,
+            "routes": self.routes,
+            "models": models,
+            "draining": retired,
+            "swapping": swapping,
+        }
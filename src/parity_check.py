@@ -0,0 +1,131 @@
+# src/parity_check.py
+
+import argparse
+import json
+import time
+from pathlib import Path
+import torch
+from transformers import AutoTokenizer
+
+from inference import BACKENDS, TASK_MAX_INPUT_LENGTH, TASK_MAX_LENGTH, generate_batch, load_model
+from preprocess import BOOLEAN_KEYS
+
+# 1) Paths
+BASE_DIR  = Path(__file__).parent.parent
+DATA_PATH = BASE_DIR / "data" / "all_tasks.jsonl"
+MODEL_DIR = BASE_DIR / "models" / "all-tasks-t5-swedish"
+
+def load_samples(path: Path, per_task: int) -> dict[str, list[dict]]:
+    """
+    Väljer per_task rader per uppgift (extract/compare/faq), jämnt utspridda
+    över filen så att urvalet blir detsamma mellan körningar.
+    """
+    by_task: dict[str, list[dict]] = {}
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            if not line.strip():
+                continue
+            obj = json.loads(line)
+            task = obj["input"].split(":", 1)[0]
+            by_task.setdefault(task, []).append(obj)
+    samples = {}
+    for task, rows in by_task.items():
+        step = max(1, len(rows) // per_task)
+        samples[task] = rows[::step][:per_task]
+    return samples
+
+def parse_json(s: str) -> dict | None:
+    try:
+        data = json.loads(s)
+    except (json.JSONDecodeError, TypeError):
+        return None
+    return data if isinstance(data, dict) else None
+
+def boolean_agreement(a: dict | None, b: dict | None) -> float | None:
+    """
+    Andel BOOLEAN_KEYS där två JSON-svar har samma värde (None om något saknas).
+    """
+    if a is None or b is None:
+        return None
+    keys = [bk["key"] for bk in BOOLEAN_KEYS]
+    return sum(a.get(k) == b.get(k) for k in keys) / len(keys)
+
+def run(model, tokenizer, task: str, rows: list[dict], batch_size: int) -> tuple[list[str], float]:
+    start = time.perf_counter()
+    outputs = generate_batch(
+        model, tokenizer, torch.device("cpu"), [r["input"] for r in rows],
+        max_input_length=TASK_MAX_INPUT_LENGTH[task],
+        max_length=TASK_MAX_LENGTH[task],
+        batch_size=batch_size
+    )
+    return outputs, time.perf_counter() - start
+
+def mean(values: list) -> float | None:
+    values = [v for v in values if v is not None]
+    return sum(values) / len(values) if values else None
+
+def parity_check(model_dir: Path, backend: str, per_task: int, batch_size: int) -> dict:
+    """
+    Kör samma prompts genom fp32-referensen och vald backend och jämför svaren.
+    """
+    tokenizer = AutoTokenizer.from_pretrained(str(model_dir))
+    reference = load_model(model_dir, "torch")
+    candidate = load_model(model_dir, backend)
+    samples = load_samples(DATA_PATH, per_task)
+
+    report = {"model": str(model_dir), "backend": backend, "tasks": {}}
+    for task, rows in samples.items():
+        print(f">>> {task}: {len(rows)} rader …")
+        ref_out, ref_time = run(reference, tokenizer, task, rows, batch_size)
+        cand_out, cand_time = run(candidate, tokenizer, task, rows, batch_size)
+        stats = {
+            "samples": len(rows),
+            "exact_match_vs_fp32": mean([r == c for r, c in zip(ref_out, cand_out)]),
+            "exact_match_vs_target": {
+                "fp32": mean([r == row["target"] for r, row in zip(ref_out, rows)]),
+                backend: mean([c == row["target"] for c, row in zip(cand_out, rows)]),
+            },
+            "latency_s_per_sample": {
+                "fp32": ref_time / len(rows),
+                backend: cand_time / len(rows),
+            },
+            "speedup": ref_time / cand_time if cand_time else None,
+        }
+        if task in ("extract", "compare"):
+            ref_json = [parse_json(r) for r in ref_out]
+            cand_json = [parse_json(c) for c in cand_out]
+            targets = [parse_json(row["target"]) for row in rows]
+            stats["json_valid"] = {
+                "fp32": mean([j is not None for j in ref_json]),
+                backend: mean([j is not None for j in cand_json]),
+            }
+            stats["boolean_agreement_vs_fp32"] = mean(
+                [boolean_agreement(r, c) for r, c in zip(ref_json, cand_json)]
+            )
+            stats["boolean_accuracy_vs_target"] = {
+                "fp32": mean([boolean_agreement(r, t) for r, t in zip(ref_json, targets)]),
+                backend: mean([boolean_agreement(c, t) for c, t in zip(cand_json, targets)]),
+            }
+        report["tasks"][task] = stats
+    return report
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Jämför en inferensbackend mot fp32 på rader ur data/all_tasks.jsonl."
+    )
+    parser.add_argument("--model", type=Path, default=MODEL_DIR)
+    parser.add_argument("--backend", choices=[b for b in BACKENDS if b != "torch"], default="torch-int8")
+    parser.add_argument("--samples", type=int, default=10, help="Antal rader per uppgift")
+    parser.add_argument("--batch-size", type=int, default=4)
+    parser.add_argument("--output", type=Path, default=None, help="Spara rapporten som JSON")
+    args = parser.parse_args()
+
+    report = parity_check(args.model, args.backend, args.samples, args.batch_size)
+    text = json.dumps(report, ensure_ascii=False, indent=2)
+    print(text)
+    if args.output:
+        args.output.write_text(text, encoding="utf-8")
+        print(f"✅ Rapport sparad till {args.output}")
+
+if __name__ == "__main__":
+    main()
@@ -267,6 +267,13 @@ def detect_pattern(question: str) -> str:
     # Fallback
     return "erbjuder"
 
+def render_answer(question: str, label: str, value: bool, nivå: str) -> str:
+    """
+    Svaret på question enligt ANSWER_TEMPLATES för frågans mönster.
+    """
+    pat = detect_pattern(question)
+    return ANSWER_TEMPLATES[pat]["yes" if value else "no"].format(nivå=nivå, label=label)
+
 def preprocess():
     """
     Läser in data/dataset.jsonl och skriver ut data/dataset_faq.jsonl
@@ -293,9 +300,7 @@ def preprocess():
                     continue
 
                 for question in FAQ_TEMPLATES[label]:
-                    pat = detect_pattern(question)
-                    ans = ANSWER_TEMPLATES[pat]["yes" if value else "no"]
-                    answer = ans.format(nivå=nivå, label=label)
+                    answer = render_answer(question, label, value, nivå)
 
                     faq_entry = {
                         "input":  question,
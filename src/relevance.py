@@ -0,0 +1,279 @@
+# src/relevance.py
+
+import argparse
+import json
+import math
+import re
+from pathlib import Path
+
+from chunking import is_heading
+from preprocess import BOOLEAN_KEYS, FAQ_TEMPLATES
+
+# 1) Paths
+BASE_DIR     = Path(__file__).parent.parent
+DATASET_PATH = BASE_DIR / "data" / "dataset.jsonl"
+MODEL_DIR    = BASE_DIR / "models" / "all-tasks-t5-swedish"
+
+# Ord i frågemallarna som inte säger något om vilken förmån det gäller
+STOPWORDS = {
+    "och", "eller", "att", "det", "den", "en", "ett", "för", "från", "har", "inom", "inte",
+    "kan", "med", "mot", "mindre", "när", "om", "på", "som", "till", "under", "utan",
+    "vid", "även", "än", "är", "av", "du", "får", "finns", "efter", "kort",
+    "försäkringen", "ersätter", "omfattar", "erbjuder", "kostnaderna", "kostnader",
+    "ersättning", "möjlighet", "möjligheten", "tillgång", "direkt", "behandling",
+    "alternativ", "krav", "inkluderad", "infrias", "överstiger", "väntetiden", "väntetid",
+    "vård", "vården", "dagar", "timmar",
+}
+
+_WORD = re.compile(r"\w+", re.UNICODE)
+
+
+def stem(word: str) -> str:
+    """
+    Grov svensk stamning: behåll början av ordet (minst 4 tecken, annars ca 60 %)
+    så att böjningar och sammansättningar ("operationer" → "operati") matchar.
+    """
+    if word.isdigit() or len(word) <= 4:
+        return word
+    return word[:max(4, math.ceil(len(word) * 0.6))]
+
+
+def words(text: str, min_length: int = 4) -> list[str]:
+    return [w for w in _WORD.findall(text.lower()) if w.isdigit() or len(w) >= min_length]
+
+
+class RelevanceIndex:
+    """
+    Nyckelordsindex byggt från BOOLEAN_KEYS-etiketterna och ordförrådet i
+    FAQ_TEMPLATES. En chunk får poäng för varje boolean-nyckel vars ord
+    förekommer i den, viktat med hur ovanligt ordet är bland dokumentets
+    chunkar (IDF) – ord som står i varje chunk säger lite.
+    """
+
+    def __init__(self):
+        self.key_stems: dict[str, set[str]] = {}
+        for bk in BOOLEAN_KEYS:
+            # Nyckelnamnen innehåller korta men viktiga ord ("eu", "ees", "usa")
+            vocab = words(bk["label"]) + words(bk["key"].replace("_", " "), min_length=2)
+            for question in FAQ_TEMPLATES.get(bk["label"], []):
+                vocab += words(question)
+            self.key_stems[bk["key"]] = {stem(w) for w in vocab if w not in STOPWORDS}
+        self.stem_lengths = sorted({len(s) for stems in self.key_stems.values() for s in stems})
+
+    def _prefixes(self, text: str) -> set[str]:
+        """
+        Alla ordprefix med samma längder som stammarna, så att "förekommer
+        stammen i chunken" blir en mängdslagning i stället för en strängsökning.
+        """
+        prefixes = set()
+        for w in set(words(text, min_length=2)):
+            if w.isdigit():
+                prefixes.add(w)
+                continue
+            for n in self.stem_lengths:
+                if n > len(w):
+                    break
+                prefixes.add(w[:n])
+        return prefixes
+
+    def matched_keys(self, text: str) -> dict[str, set[str]]:
+        """
+        Boolean-nycklar vars ord förekommer i texten, med de stammar som matchade.
+        """
+        prefixes = self._prefixes(text)
+        hits = {}
+        for key, stems in self.key_stems.items():
+            found = stems & prefixes
+            if found:
+                hits[key] = found
+        return hits
+
+    def score_chunks(self, chunks: list[str]) -> list[float]:
+        """
+        Poäng per chunk: summan över nycklar av den högsta IDF-vikten bland
+        nyckelns matchade stammar.
+        """
+        matches = [self.matched_keys(c) for c in chunks]
+        df: dict[str, int] = {}
+        for m in matches:
+            for stem_ in set().union(*m.values()) if m else ():
+                df[stem_] = df.get(stem_, 0) + 1
+        n = len(chunks)
+        idf = {s: math.log((n + 1) / (d + 0.5)) for s, d in df.items()}
+        return [sum(max(idf[s] for s in found) for found in m.values()) for m in matches]
+
+
+def headings(text: str, max_chars: int = 80) -> str:
+    """
+    Rader som ser ut som rubriker (se chunking.is_heading).
+    """
+    return "\n".join(line.strip() for line in text.splitlines() if is_heading(line, max_chars))
+
+
+def priority_order(chunks: list[str], index: "RelevanceIndex", by: str = "relevance") -> list[int]:
+    """
+    Ordning (chunk-index) som chunkarna ska köras i så att de avgörande kommer
+    först: by="relevance" sorterar på chunkens poäng, by="heading" på
+    rubrikernas poäng (med chunkens poäng som skiljepoäng). Första chunken
+    körs alltid först eftersom den bär försäkringens namn.
+    """
+    body = index.score_chunks(chunks)
+    if by == "heading":
+        heads = index.score_chunks([headings(c) for c in chunks])
+        key = lambda i: (heads[i], body[i])
+    else:
+        key = lambda i: body[i]
+    rest = sorted(range(1, len(chunks)), key=lambda i: (key(i), -i), reverse=True)
+    return ([0] if chunks else []) + rest
+
+
+def select_chunks(
+    scores: list[float],
+    min_score: float = 0.0,
+    top_k: int | None = None,
+    keep_first: bool = True,
+) -> list[int]:
+    """
+    Index (i dokumentordning) för de chunkar som ska köras genom modellen:
+    alla med poäng ≥ min_score, högst top_k av dem (de med högst poäng).
+    Första chunken behålls alltid om keep_first – där står oftast
+    försäkringens namn, som aggregatet tar från första giltiga chunk.
+    """
+    candidates = [i for i, s in enumerate(scores) if s >= min_score and s > 0]
+    if top_k:
+        candidates = sorted(candidates, key=lambda i: scores[i], reverse=True)[:top_k]
+    selected = set(candidates)
+    if keep_first and scores:
+        selected.add(0)
+    return sorted(selected)
+
+
+# ----------------------------------------------------------------------------------
+# Utvärdering mot data/dataset.jsonl
+# ----------------------------------------------------------------------------------
+def recall(predicted: dict, truth: dict) -> tuple[int, int]:
+    """
+    (antal sanna boolean-fält i truth som också är sanna i predicted, antal sanna i truth)
+    """
+    keys = [bk["key"] for bk in BOOLEAN_KEYS if truth.get(bk["key"]) is True]
+    return sum(1 for k in keys if predicted.get(k) is True), len(keys)
+
+
+def aggregate(api, results: list[dict]) -> dict:
+    aggregated = {}
+    for data in results:
+        aggregated = api.merge_extract(aggregated, data)
+    return aggregated
+
+
+def evaluate(min_score: float, top_k: int | None, max_tokens: int, tokenizer_path: Path, with_model: bool) -> dict:
+    """
+    Mäter hur mycket förfiltret sparar och vad det kostar i recall.
+
+    Utan modell: för varje sant boolean-fält i dataset.jsonl, behåller filtret
+    någon chunk där fältets nyckelord förekommer (om någon chunk alls har dem)?
+    Med modell (with_model): kör extract på alla respektive utvalda chunkar och
+    jämför de aggregerade booleanerna mot dataset.jsonl.
+    """
+    from build_extract_relevant import find_raw_file
+    from chunking import chunk_document
+
+    if with_model:
+        import os
+        os.environ.setdefault("MODEL_PATH", str(tokenizer_path))
+        import api
+        tokenizer = api.models.for_task("extract").tokenizer
+    else:
+        from transformers import AutoTokenizer
+        tokenizer = AutoTokenizer.from_pretrained(str(tokenizer_path))
+
+    index = RelevanceIndex()
+    entries = [json.loads(l) for l in open(DATASET_PATH, encoding="utf-8") if l.strip()]
+    per_file: dict[Path, dict] = {}
+    totals = {"chunks": 0, "kept": 0, "evidence_hits": 0, "evidence_total": 0,
+              "model_hits_all": 0, "model_hits_kept": 0, "model_total": 0}
+    report_entries = []
+
+    for entry in entries:
+        name = entry.get("försäkring")
+        if not name:
+            continue
+        raw_path = find_raw_file(name)
+        if raw_path not in per_file:
+            chunks = [c.text for c in chunk_document(tokenizer, raw_path.read_text(encoding="utf-8"), max_tokens)]
+            scores = index.score_chunks(chunks)
+            kept = select_chunks(scores, min_score=min_score, top_k=top_k)
+            info = {"chunks": chunks, "kept": kept, "matches": [index.matched_keys(c) for c in chunks]}
+            if with_model:
+                outputs = api.extract_chunks(chunks)
+                info["agg_all"] = aggregate(api, outputs)
+                info["agg_kept"] = aggregate(api, [outputs[i] for i in kept])
+            per_file[raw_path] = info
+            totals["chunks"] += len(chunks)
+            totals["kept"] += len(kept)
+        info = per_file[raw_path]
+
+        true_keys = [bk["key"] for bk in BOOLEAN_KEYS if entry.get(bk["key"]) is True]
+        has_evidence = [k for k in true_keys if any(k in m for m in info["matches"])]
+        kept_evidence = [k for k in has_evidence if any(k in info["matches"][i] for i in info["kept"])]
+        totals["evidence_hits"] += len(kept_evidence)
+        totals["evidence_total"] += len(has_evidence)
+        row = {
+            "försäkring": name,
+            "raw": raw_path.name,
+            "chunks": len(info["chunks"]),
+            "kept": len(info["kept"]),
+            "evidence_recall": len(kept_evidence) / len(has_evidence) if has_evidence else None,
+            "missed_evidence": sorted(set(has_evidence) - set(kept_evidence)),
+        }
+        if with_model:
+            hits_all, total = recall(info["agg_all"], entry)
+            hits_kept, _ = recall(info["agg_kept"], entry)
+            totals["model_hits_all"] += hits_all
+            totals["model_hits_kept"] += hits_kept
+            totals["model_total"] += total
+            row["model_recall_all"] = hits_all / total if total else None
+            row["model_recall_kept"] = hits_kept / total if total else None
+        report_entries.append(row)
+
+    summary = {
+        "min_score": min_score,
+        "top_k": top_k,
+        "documents": len(per_file),
+        "chunks": totals["chunks"],
+        "chunks_kept": totals["kept"],
+        "chunks_skipped_ratio": 1 - totals["kept"] / totals["chunks"] if totals["chunks"] else 0.0,
+        "evidence_recall": totals["evidence_hits"] / totals["evidence_total"] if totals["evidence_total"] else None,
+    }
+    if with_model:
+        summary["model_recall_all_chunks"] = (
+            totals["model_hits_all"] / totals["model_total"] if totals["model_total"] else None
+        )
+        summary["model_recall_kept_chunks"] = (
+            totals["model_hits_kept"] / totals["model_total"] if totals["model_total"] else None
+        )
+    return {"summary": summary, "entries": report_entries}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Utvärdera relevansförfiltret mot data/dataset.jsonl.")
+    parser.add_argument("--min-score", type=float, default=5.0)
+    parser.add_argument("--top-k", type=int, default=None)
+    parser.add_argument("--max-tokens", type=int, default=1000, help="Chunkstorlek i token")
+    parser.add_argument("--model", type=Path, default=MODEL_DIR,
+                        help="Checkpoint (eller tokenizer) att chunka med")
+    parser.add_argument("--with-model", action="store_true",
+                        help="Kör även extract och mät recall för de aggregerade booleanerna")
+    parser.add_argument("--output", type=Path, default=None)
+    args = parser.parse_args()
+
+    report = evaluate(args.min_score, args.top_k, args.max_tokens, args.model, args.with_model)
+    text = json.dumps(report, ensure_ascii=False, indent=2)
+    print(json.dumps(report["summary"], ensure_ascii=False, indent=2))
+    if args.output:
+        args.output.write_text(text, encoding="utf-8")
+        print(f"✅ Rapport sparad till {args.output}")
+
+
+if __name__ == "__main__":
+    main()
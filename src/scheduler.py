@@ -0,0 +1,246 @@
+# src/scheduler.py
+
+import asyncio
+import math
+import threading
+import time
+from collections import Counter, deque
+from typing import Any, Callable, Hashable
+
+
+class _Pending:
+    """
+    Ett köat anrop: nyckel (vilken sorts generering), indata och callerns future.
+    """
+    __slots__ = ("key", "payload", "future", "loop", "enqueued_at")
+
+    def __init__(self, key: Hashable, payload: Any, future: asyncio.Future, loop: asyncio.AbstractEventLoop):
+        self.key = key
+        self.payload = payload
+        self.future = future
+        self.loop = loop
+        self.enqueued_at = time.perf_counter()
+
+
+class InferenceScheduler:
+    """
+    Samlar inferensanrop från samtidiga requests i en gemensam kö och kör dem
+    i batchar på en egen arbetstråd, så att event-loopen inte blockeras.
+
+    Anrop med samma nyckel kan dela batch. En batch skickas iväg när den når
+    max_batch_size eller när det äldsta anropet har väntat max_wait_ms.
+    runner(key, payloads) ska returnera ett resultat per payload, i samma ordning.
+
+    Med concurrency > 1 kör lika många arbetstrådar batchar parallellt (t.ex.
+    mot separata inferensprocesser). Kön fördelas då jämnt över de lediga
+    trådarna i stället för att den första tar en full batch.
+    """
+
+    def __init__(
+        self,
+        runner: Callable[[Hashable, list], list],
+        max_batch_size: int = 8,
+        max_wait_ms: float = 10.0,
+        name: str = "inference-scheduler",
+        concurrency: int = 1,
+    ):
+        self.runner = runner
+        self.max_batch_size = max(1, max_batch_size)
+        self.max_wait = max(0.0, max_wait_ms) / 1000.0
+        self.name = name
+        self.concurrency = max(1, concurrency)
+
+        self._queue: deque[_Pending] = deque()
+        self._cond = threading.Condition()
+        self._threads: list[threading.Thread] = []
+        self._idle_threads = 0
+        self._stopping = False
+
+        # Mätvärden
+        self._batch_sizes: Counter[int] = Counter()
+        self._items_total = 0
+        self._batches_total = 0
+        self._errors_total = 0
+        self._max_queue_depth = 0
+        self._wait_seconds_total = 0.0
+        self._run_seconds_total = 0.0
+
+    # ------------------------------------------------------------------
+    # Livscykel
+    # ------------------------------------------------------------------
+    def start(self) -> None:
+        with self._cond:
+            if any(t.is_alive() for t in self._threads):
+                return
+            self._stopping = False
+            self._threads = [
+                threading.Thread(target=self._worker, name=f"{self.name}-{i}", daemon=True)
+                for i in range(self.concurrency)
+            ]
+            for thread in self._threads:
+                thread.start()
+
+    def stop(self, timeout: float | None = 5.0) -> None:
+        with self._cond:
+            self._stopping = True
+            self._cond.notify_all()
+        for thread in self._threads:
+            thread.join(timeout)
+        self._threads = []
+
+    # ------------------------------------------------------------------
+    # Publikt API
+    # ------------------------------------------------------------------
+    async def submit(self, key: Hashable, payload: Any) -> Any:
+        """
+        Köar ett anrop och väntar på resultatet.
+        """
+        return (await self.submit_many(key, [payload]))[0]
+
+    async def submit_many(self, key: Hashable, payloads: list) -> list:
+        """
+        Köar flera anrop atomiskt (de hamnar intill varandra i kön) och väntar
+        på alla resultat. Resultaten returneras i samma ordning som payloads.
+        """
+        return await asyncio.gather(*self.enqueue(key, payloads))
+
+    def enqueue(self, key: Hashable, payloads: list) -> list[asyncio.Future]:
+        """
+        Köar anrop och returnerar en future per payload utan att vänta.
+        """
+        if not self._threads:
+            self.start()
+        loop = asyncio.get_running_loop()
+        pending = [_Pending(key, p, loop.create_future(), loop) for p in payloads]
+        with self._cond:
+            if self._stopping:
+                raise RuntimeError(f"{self.name} är stoppad.")
+            self._queue.extend(pending)
+            self._max_queue_depth = max(self._max_queue_depth, len(self._queue))
+            self._cond.notify_all()
+        return [p.future for p in pending]
+
+    def stats(self) -> dict:
+        with self._cond:
+            batches = self._batches_total
+            items = self._items_total
+            return {
+                "queue_depth": len(self._queue),
+                "max_queue_depth": self._max_queue_depth,
+                "max_batch_size": self.max_batch_size,
+                "max_wait_ms": self.max_wait * 1000.0,
+                "concurrency": self.concurrency,
+                "batches_total": batches,
+                "items_total": items,
+                "errors_total": self._errors_total,
+                "avg_batch_size": items / batches if batches else 0.0,
+                "avg_queue_wait_ms": 1000.0 * self._wait_seconds_total / items if items else 0.0,
+                "avg_batch_run_ms": 1000.0 * self._run_seconds_total / batches if batches else 0.0,
+                "batch_size_histogram": {str(k): v for k, v in sorted(self._batch_sizes.items())},
+            }
+
+    # ------------------------------------------------------------------
+    # Arbetstråd
+    # ------------------------------------------------------------------
+    def _take_batch(self) -> list[_Pending] | None:
+        """
+        Väntar tills en batch är redo och plockar ut den ur kön.
+        Returnerar None när schemaläggaren stoppas.
+        """
+        with self._cond:
+            self._idle_threads += 1
+            try:
+                return self._take_batch_locked()
+            finally:
+                self._idle_threads -= 1
+
+    def _take_batch_locked(self) -> list[_Pending] | None:
+        while True:
+            # Släng anrop vars caller redan gett upp (t.ex. avbruten request)
+            if any(p.future.cancelled() for p in self._queue):
+                self._queue = deque(p for p in self._queue if not p.future.cancelled())
+            if self._stopping:
+                return None
+            if not self._queue:
+                self._cond.wait()
+                continue
+
+            # Antal köade och äldsta anrop per nyckel, i köordning. Vilken
+            # nyckel som helst som är full eller har nått max_wait skickas –
+            # en ofull nyckel först i kön får inte blockera de andra.
+            counts: dict[Hashable, int] = {}
+            oldest: dict[Hashable, float] = {}
+            for p in self._queue:
+                counts[p.key] = counts.get(p.key, 0) + 1
+                oldest.setdefault(p.key, p.enqueued_at)
+            now = time.perf_counter()
+            ready = next(
+                (k for k in counts if counts[k] >= self.max_batch_size or oldest[k] + self.max_wait <= now),
+                None,
+            )
+            if ready is None:
+                self._cond.wait(min(oldest.values()) + self.max_wait - now)
+                continue
+
+            # Fördela anropen över alla lediga arbetstrådar (concurrency > 1)
+            same_key = counts[ready]
+            limit = min(self.max_batch_size, max(1, math.ceil(same_key / max(1, self._idle_threads))))
+            batch, rest = [], deque()
+            for p in self._queue:
+                if p.key == ready and len(batch) < limit:
+                    batch.append(p)
+                else:
+                    rest.append(p)
+            self._queue = rest
+            return batch
+
+    def _worker(self) -> None:
+        while True:
+            batch = self._take_batch()
+            if batch is None:
+                break
+            started = time.perf_counter()
+            try:
+                results = self.runner(batch[0].key, [p.payload for p in batch])
+                if len(results) != len(batch):
+                    raise RuntimeError(
+                        f"runner returnerade {len(results)} resultat för {len(batch)} anrop."
+                    )
+                error = None
+            except Exception as exc:  # noqa: BLE001 – felet förs vidare till callern
+                results, error = None, exc
+            finished = time.perf_counter()
+
+            with self._cond:
+                self._batches_total += 1
+                self._items_total += len(batch)
+                self._batch_sizes[len(batch)] += 1
+                self._run_seconds_total += finished - started
+                self._wait_seconds_total += sum(started - p.enqueued_at for p in batch)
+                if error is not None:
+                    self._errors_total += 1
+
+            for i, p in enumerate(batch):
+                _deliver(p, None if error is not None else results[i], error)
+
+        # Avbryt det som fortfarande ligger i kön vid stopp
+        with self._cond:
+            leftover, self._queue = list(self._queue), deque()
+        for p in leftover:
+            _deliver(p, None, RuntimeError(f"{self.name} stoppades."))
+
+
+def _deliver(p: _Pending, result: Any, error: BaseException | None) -> None:
+    try:
+        p.loop.call_soon_threadsafe(_resolve, p.future, result, error)
+    except RuntimeError:
+        pass  # callerns event-loop är redan stängd
+
+
+def _resolve(future: asyncio.Future, result: Any, error: BaseException | None) -> None:
+    if future.done():
+        return
+    if error is not None:
+        future.set_exception(error)
+    else:
+        future.set_result(result)
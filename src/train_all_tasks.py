@@ -1,6 +1,7 @@
 # src/train_all_tasks.py
 
 import json
+import os
 from pathlib import Path
 from datasets import Dataset
 from transformers import (
@@ -11,6 +12,12 @@ from transformers import (
     Seq2SeqTrainer,
 )
 
+from holdout import HOLDOUT_INFO, in_eval_sample
+from training_utils import (
+    PADDING_MODES, LengthAwareSeq2SeqTrainer, ResourceCallback, ThroughputCallback, TokenCountingCollator,
+    load_or_tokenize, resource_profile,
+)
+
 # 1) Paths och inställningar
 BASE_DIR      = Path(__file__).parent.parent
 DATA_PATH     = BASE_DIR / "data" / "all_tasks.jsonl"
@@ -23,10 +30,25 @@ MAX_TGT_LEN   = 256    # Max token-längd för target
 BATCH_SIZE    = 2      # Justera till 1 eller 2 om du får OOM
 NUM_EPOCHS    = 10
 LEARNING_RATE = 5e-5
+# Andel rader (hash av input) som lämnas utanför träningen för eval_profiles.py
+EVAL_HOLDOUT_FRACTION = float(os.environ.get("EVAL_HOLDOUT_FRACTION", "0"))
+
+# Paddning: "dynamic" paddar per batch och packar längdhinkar till max
+# MAX_BATCH_TOKENS paddade token per batch (standard: samma minnestopp som
+# BATCH_SIZE rader i full längd), "max_length" är det tidigare beteendet
+PADDING          = os.environ.get("TRAIN_PADDING", "dynamic")
+MAX_BATCH_TOKENS = int(os.environ.get("MAX_BATCH_TOKENS", str(BATCH_SIZE * (MAX_IN_LEN + MAX_TGT_LEN))))
+# Max rader per batch (standard: BATCH_SIZE, så att antalet steg per epok och
+# därmed LEARNING_RATE/NUM_EPOCHS gäller som förut – bara paddningen minskar).
+# Fler rader per steg ger färre optimeringssteg per epok; justera då LR/epoker.
+MAX_BATCH_ROWS   = int(os.environ.get("MAX_BATCH_ROWS", str(BATCH_SIZE)))
+if PADDING not in PADDING_MODES:
+    raise ValueError(f"Okänd TRAIN_PADDING '{PADDING}', välj en av {', '.join(PADDING_MODES)}.")
 
 def load_dataset_from_jsonl(path: Path) -> Dataset:
     """
-    Läser in all_tasks.jsonl som ett HuggingFace Dataset.
+    Läser in all_tasks.jsonl som ett HuggingFace Dataset, utan raderna som
+    hålls utanför (EVAL_HOLDOUT_FRACTION).
     """
     records = []
     with open(path, encoding="utf-8") as f:
@@ -35,27 +57,28 @@ def load_dataset_from_jsonl(path: Path) -> Dataset:
             if not line:
                 continue
             obj = json.loads(line)
+            if in_eval_sample(obj["input"], EVAL_HOLDOUT_FRACTION):
+                continue
             records.append({"input": obj["input"], "target": obj["target"]})
     return Dataset.from_list(records)
 
 def load_and_prepare():
     """
-    Laddar data, tokenizer och modell, och tokeniserar datasetet.
+    Laddar tokenizer och modell, och det tokeniserade datasetet (från
+    cachen om all_tasks.jsonl och inställningarna är oförändrade).
     """
-    # Läs in dataset
-    ds = load_dataset_from_jsonl(DATA_PATH)
-
     # Hämta svensk T5-tokenizer + modell
     tokenizer = AutoTokenizer.from_pretrained(MODEL_NAME)
     model     = AutoModelForSeq2SeqLM.from_pretrained(MODEL_NAME)
 
     def preprocess_fn(batch):
-        # Tokenisera input (prefix + text)
+        # Tokenisera input (prefix + text); vid dynamisk paddning paddar collatorn
+        padding = "max_length" if PADDING == "max_length" else False
         enc = tokenizer(
             batch["input"],
             max_length=MAX_IN_LEN,
             truncation=True,
-            padding="max_length"
+            padding=padding
         )
         # Tokenisera target
         with tokenizer.as_target_tokenizer():
@@ -63,14 +86,24 @@ def load_and_prepare():
                 batch["target"],
                 max_length=MAX_TGT_LEN,
                 truncation=True,
-                padding="max_length"
+                padding=padding
             )
         enc["labels"] = dec["input_ids"]
         return enc
 
-    # Kör tokenisering över hela datasetet
-    tokenized = ds.map(preprocess_fn, batched=True, remove_columns=ds.column_names)
-    data_collator = DataCollatorForSeq2Seq(tokenizer, model=model)
+    # Kör tokenisering över hela datasetet (eller läs från cachen)
+    tokenized = load_or_tokenize(
+        DATA_PATH,
+        lambda: load_dataset_from_jsonl(DATA_PATH),
+        preprocess_fn,
+        MODEL_NAME,
+        {
+            "max_input_length": MAX_IN_LEN, "max_target_length": MAX_TGT_LEN, "padding": PADDING,
+            "eval_holdout_fraction": EVAL_HOLDOUT_FRACTION,
+        },
+    )
+    # Paddar per batch (labels med -100, så att paddningen inte ger loss)
+    data_collator = TokenCountingCollator(DataCollatorForSeq2Seq(tokenizer, model=model), tokenizer.pad_token_id)
 
     return tokenized, tokenizer, model, data_collator
 
@@ -80,35 +113,62 @@ def main():
 
     tokenized_ds, tokenizer, model, data_collator = load_and_prepare()
 
+    # Enhet och resursprofil (se training_utils.TRAIN_PROFILES)
+    resources = resource_profile(model, BATCH_SIZE, MAX_IN_LEN + MAX_TGT_LEN)
+
     # Träningsargument för Seq2SeqTrainer
     training_args = Seq2SeqTrainingArguments(
         output_dir=str(OUTPUT_DIR),
-        per_device_train_batch_size=BATCH_SIZE,
         per_device_eval_batch_size=BATCH_SIZE,
         num_train_epochs=NUM_EPOCHS,
         learning_rate=LEARNING_RATE,
         weight_decay=0.01,
         save_total_limit=2,
         predict_with_generate=True,
-        fp16=True,             # fp16=True om du kör GPU i Colab
         logging_strategy="steps",
         logging_steps=100,     # Logga varje 100:e steg
         save_steps=500,        # Spara checkpoint var 500:e steg
         report_to="none",
+        # Batchstorlek, precision, optimerare m.m. enligt TRAIN_PROFILE
+        **resources.training_args,
     )
 
-    trainer = Seq2SeqTrainer(
+    throughput = ThroughputCallback(
+        data_collator,
+        OUTPUT_DIR / "throughput.json",
+        {
+            "padding": PADDING, "profile": resources.name, "batch_size": BATCH_SIZE,
+            "max_batch_tokens": MAX_BATCH_TOKENS, "rows": len(tokenized_ds),
+        },
+    )
+    trainer_kwargs = dict(
         model=model,
         args=training_args,
         train_dataset=tokenized_ds,
         tokenizer=tokenizer,
         data_collator=data_collator,
+        callbacks=[throughput, ResourceCallback(OUTPUT_DIR / "resources.json", resources)],
     )
+    if PADDING == "dynamic":
+        trainer = LengthAwareSeq2SeqTrainer(
+            **trainer_kwargs,
+            # Vid gradientackumulering är tokenbudgeten per mikrobatch
+            max_batch_tokens=MAX_BATCH_TOKENS // resources.accumulation,
+            max_batch_size=max(1, MAX_BATCH_ROWS // resources.accumulation),
+        )
+    else:
+        trainer = Seq2SeqTrainer(**trainer_kwargs)
 
     print(">>> Träningen påbörjas …")
     trainer.train()
     print(">>> Träningen avslutad. Sparar modellen …")
     trainer.save_model(OUTPUT_DIR)
+    if EVAL_HOLDOUT_FRACTION:
+        (OUTPUT_DIR / HOLDOUT_INFO).write_text(
+            json.dumps({"fraction": EVAL_HOLDOUT_FRACTION}, indent=2), encoding="utf-8"
+        )
+    else:
+        (OUTPUT_DIR / HOLDOUT_INFO).unlink(missing_ok=True)
     print(f"✅ Multitask‐modell sparad till {OUTPUT_DIR}")
 
 if __name__ == "__main__":
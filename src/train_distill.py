@@ -0,0 +1,220 @@
+# src/train_distill.py
+
+import json
+import os
+from pathlib import Path
+import torch
+from datasets import Dataset
+from transformers import (
+    AutoTokenizer,
+    DataCollatorForSeq2Seq,
+    Seq2SeqTrainingArguments,
+)
+
+from holdout import HELD_OUT_INSURERS, chunk_prompts, is_held_out_row, raw_documents
+from inference import GENERATION_KWARGS, generate_batch, load_model
+from model_registry import model_revision
+from training_utils import (
+    DistillationTrainer, ResourceCallback, ThroughputCallback, TokenCountingCollator, load_or_tokenize,
+    resource_profile,
+)
+
+# 1) Paths och inställningar
+BASE_DIR      = Path(__file__).parent.parent
+DATA_PATH     = BASE_DIR / "data" / "all_tasks.jsonl"
+# Lärarens svar på chunkade råtexter (återanvänds så länge läraren är densamma)
+TEACHER_PATH  = BASE_DIR / "data" / "distill_teacher.jsonl"
+# Träningsdatan för studenten: all_tasks.jsonl + lärarens svar
+DISTILL_PATH  = BASE_DIR / "data" / "distill_train.jsonl"
+TEACHER_DIR   = Path(os.environ.get("TEACHER_DIR", BASE_DIR / "models" / "all-tasks-t5-swedish"))
+OUTPUT_DIR    = Path(os.environ.get("STUDENT_DIR", BASE_DIR / "models" / "all-tasks-t5-student"))
+
+# 2) Hyperparametrar
+MAX_IN_LEN    = 512    # Som train_all_tasks.py
+MAX_TGT_LEN   = 256
+BATCH_SIZE    = 8
+NUM_EPOCHS    = int(os.environ.get("DISTILL_EPOCHS", "20"))
+LEARNING_RATE = float(os.environ.get("DISTILL_LR", "5e-4"))
+# Vikt för target (cross-entropy) mot lärarens fördelning, och temperaturen
+DISTILL_ALPHA       = float(os.environ.get("DISTILL_ALPHA", "0.5"))
+DISTILL_TEMPERATURE = float(os.environ.get("DISTILL_TEMPERATURE", "2.0"))
+MAX_BATCH_TOKENS    = int(os.environ.get("MAX_BATCH_TOKENS", str(BATCH_SIZE * (MAX_IN_LEN + MAX_TGT_LEN))))
+# Max rader per batch (standard: BATCH_SIZE, se train_all_tasks.py)
+MAX_BATCH_ROWS      = int(os.environ.get("MAX_BATCH_ROWS", str(BATCH_SIZE)))
+
+# Studentens storlek: T5-small-dimensioner med färre decoderlager (decodern
+# körs en gång per genererad token och dominerar latensen). "small" startar
+# slumpinitierad med dessa dimensioner; "copy" behåller lärarens bredd och
+# kopierar jämnt utspridda lager från läraren – bättre start med lite data,
+# men större modell.
+STUDENT_INIT = os.environ.get("STUDENT_INIT", "small")
+STUDENT_SIZE = {
+    "d_model": int(os.environ.get("STUDENT_D_MODEL", "512")),
+    "d_ff": int(os.environ.get("STUDENT_D_FF", "2048")),
+    "num_heads": int(os.environ.get("STUDENT_HEADS", "8")),
+    "d_kv": 64,
+    "num_layers": int(os.environ.get("STUDENT_ENCODER_LAYERS", "6")),
+    "num_decoder_layers": int(os.environ.get("STUDENT_DECODER_LAYERS", "2")),
+}
+if STUDENT_INIT not in ("small", "copy"):
+    raise ValueError(f"Okänd STUDENT_INIT '{STUDENT_INIT}', välj 'small' eller 'copy'.")
+
+def spread(n_teacher: int, n_student: int) -> list[int]:
+    """
+    n_student jämnt utspridda lagerindex ur n_teacher (första och sista med).
+    Första lagret är alltid med – bara det har T5:s relativa positionsbias.
+    """
+    if n_student == 1:
+        return [0]
+    return [round(i * (n_teacher - 1) / (n_student - 1)) for i in range(n_student)]
+
+def make_student(teacher):
+    """
+    Bygger studenten från lärarens config (samma vokabulär och tokenizer).
+    """
+    config = teacher.config.to_dict()
+    if STUDENT_INIT == "small":
+        config.update(STUDENT_SIZE)
+        return type(teacher)(type(teacher.config).from_dict(config))
+
+    config.update({k: STUDENT_SIZE[k] for k in ("num_layers", "num_decoder_layers")})
+    student = type(teacher)(type(teacher.config).from_dict(config))
+    state = teacher.state_dict()
+    layers = {
+        "encoder": spread(teacher.config.num_layers, STUDENT_SIZE["num_layers"]),
+        "decoder": spread(teacher.config.num_decoder_layers, STUDENT_SIZE["num_decoder_layers"]),
+    }
+    copied = {}
+    for name in student.state_dict():
+        source = name
+        for stack, picks in layers.items():
+            prefix = f"{stack}.block."
+            if name.startswith(prefix):
+                i, rest = name[len(prefix):].split(".", 1)
+                source = f"{prefix}{picks[int(i)]}.{rest}"
+        copied[name] = state[source]
+    student.load_state_dict(copied)
+    return student
+
+def load_jsonl(path: Path) -> list[dict]:
+    with open(path, encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+def teacher_targets(teacher, tokenizer, revision: str) -> list[dict]:
+    """
+    Lärarens extract-svar på varje chunk av råtexterna utom de utelämnade
+    bolagens (se holdout.HELD_OUT_INSURERS). Tidigare svar från samma lärare
+    läses från TEACHER_PATH; bara nya chunkar genereras.
+    """
+    prompts = chunk_prompts(tokenizer, raw_documents(held_out=False), MAX_IN_LEN)
+
+    known = {}
+    if TEACHER_PATH.exists():
+        known = {r["input"]: r["target"] for r in load_jsonl(TEACHER_PATH) if r.get("teacher") == revision}
+    missing = [p for p in prompts if p not in known]
+    if missing:
+        print(f">>> Läraren genererar svar för {len(missing)} chunkar ({len(known)} från cachen) …")
+        device = next(teacher.parameters()).device
+        outputs = generate_batch(
+            teacher, tokenizer, device, missing,
+            max_input_length=MAX_IN_LEN, max_length=MAX_TGT_LEN, batch_size=BATCH_SIZE, **GENERATION_KWARGS
+        )
+        known.update(zip(missing, outputs))
+    rows = [{"input": p, "target": known[p], "teacher": revision} for p in prompts]
+    TEACHER_PATH.write_text("".join(json.dumps(r, ensure_ascii=False) + "\n" for r in rows), encoding="utf-8")
+    return rows
+
+def build_distill_data(teacher, tokenizer) -> int:
+    """
+    Skriver DISTILL_PATH: all_tasks.jsonl utom de utelämnade bolagens rader,
+    plus lärarens svar på chunkade råtexter. Returnerar antal rader.
+    """
+    rows = [
+        {"input": r["input"], "target": r["target"]}
+        for r in load_jsonl(DATA_PATH) if not is_held_out_row(r)
+    ]
+    rows += [{"input": r["input"], "target": r["target"]}
+             for r in teacher_targets(teacher, tokenizer, model_revision(str(TEACHER_DIR), "torch"))]
+    DISTILL_PATH.write_text("".join(json.dumps(r, ensure_ascii=False) + "\n" for r in rows), encoding="utf-8")
+    return len(rows)
+
+def main():
+    print(">>> Kör train_distill.py – destillerar lärarmodellen …")
+    device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
+    tokenizer = AutoTokenizer.from_pretrained(str(TEACHER_DIR))
+    teacher = load_model(TEACHER_DIR, "torch", device)
+    n = build_distill_data(teacher, tokenizer)
+    print(f">>> {n} träningsrader i {DISTILL_PATH}")
+
+    student = make_student(teacher)
+    params = {
+        "teacher": sum(p.numel() for p in teacher.parameters()),
+        "student": sum(p.numel() for p in student.parameters()),
+    }
+    print(f">>> Student: {params['student'] / 1e6:.0f} M parametrar (läraren {params['teacher'] / 1e6:.0f} M)")
+
+    def preprocess_fn(batch):
+        enc = tokenizer(batch["input"], max_length=MAX_IN_LEN, truncation=True)
+        with tokenizer.as_target_tokenizer():
+            dec = tokenizer(batch["target"], max_length=MAX_TGT_LEN, truncation=True)
+        enc["labels"] = dec["input_ids"]
+        return enc
+
+    tokenized = load_or_tokenize(
+        DISTILL_PATH,
+        lambda: Dataset.from_list(load_jsonl(DISTILL_PATH)),
+        preprocess_fn,
+        str(TEACHER_DIR),
+        {"max_input_length": MAX_IN_LEN, "max_target_length": MAX_TGT_LEN, "padding": "dynamic"},
+    )
+    data_collator = TokenCountingCollator(DataCollatorForSeq2Seq(tokenizer, model=student), tokenizer.pad_token_id)
+
+    resources = resource_profile(student, BATCH_SIZE, MAX_IN_LEN + MAX_TGT_LEN)
+    training_args = Seq2SeqTrainingArguments(
+        output_dir=str(OUTPUT_DIR),
+        num_train_epochs=NUM_EPOCHS,
+        learning_rate=LEARNING_RATE,
+        weight_decay=0.01,
+        save_total_limit=2,
+        logging_strategy="steps",
+        logging_steps=100,
+        save_steps=500,
+        report_to="none",
+        **resources.training_args,
+    )
+    config = {
+        "teacher": str(TEACHER_DIR),
+        "init": STUDENT_INIT,
+        "student_size": STUDENT_SIZE,
+        "parameters": params,
+        "alpha": DISTILL_ALPHA,
+        "temperature": DISTILL_TEMPERATURE,
+        "held_out_insurers": HELD_OUT_INSURERS,
+        "rows": len(tokenized),
+    }
+    trainer = DistillationTrainer(
+        model=student,
+        args=training_args,
+        train_dataset=tokenized,
+        tokenizer=tokenizer,
+        data_collator=data_collator,
+        callbacks=[
+            ThroughputCallback(data_collator, OUTPUT_DIR / "throughput.json", config),
+            ResourceCallback(OUTPUT_DIR / "resources.json", resources),
+        ],
+        max_batch_tokens=MAX_BATCH_TOKENS // resources.accumulation,
+        max_batch_size=max(1, MAX_BATCH_ROWS // resources.accumulation),
+        teacher=teacher,
+        alpha=DISTILL_ALPHA,
+        temperature=DISTILL_TEMPERATURE,
+    )
+
+    print(">>> Träningen påbörjas …")
+    trainer.train()
+    trainer.save_model(OUTPUT_DIR)
+    tokenizer.save_pretrained(OUTPUT_DIR)
+    (OUTPUT_DIR / "distill_info.json").write_text(json.dumps(config, ensure_ascii=False, indent=2), encoding="utf-8")
+    print(f"✅ Student sparad till {OUTPUT_DIR} (MODEL_PATH={OUTPUT_DIR} i API:t)")
+
+if __name__ == "__main__":
+    main()
@@ -10,6 +10,11 @@ from transformers import (
     Seq2SeqTrainer,
 )
 
+from training_utils import (
+    PADDING_MODES, LengthAwareSeq2SeqTrainer, ResourceCallback, ThroughputCallback, TokenCountingCollator,
+    load_or_tokenize, resource_profile,
+)
+
 # 1) Paths
 DATA_PATH = Path("data/extract_relevant.jsonl")
 MODEL_NAME = "google/mt5-large"
@@ -22,7 +27,16 @@ BATCH_SIZE = 4
 NUM_EPOCHS = 3
 LEARNING_RATE = 5e-5
 
-def load_and_prepare():
+# Paddning: "dynamic" paddar per batch och packar längdhinkar till max
+# MAX_BATCH_TOKENS paddade token per batch, "max_length" är det tidigare beteendet
+PADDING          = os.environ.get("TRAIN_PADDING", "dynamic")
+MAX_BATCH_TOKENS = int(os.environ.get("MAX_BATCH_TOKENS", str(BATCH_SIZE * (MAX_INPUT_LENGTH + MAX_TARGET_LENGTH))))
+# Max rader per batch (standard: BATCH_SIZE, se train_all_tasks.py)
+MAX_BATCH_ROWS   = int(os.environ.get("MAX_BATCH_ROWS", str(BATCH_SIZE)))
+if PADDING not in PADDING_MODES:
+    raise ValueError(f"Okänd TRAIN_PADDING '{PADDING}', välj en av {', '.join(PADDING_MODES)}.")
+
+def load_records() -> Dataset:
     # Load JSONL into HuggingFace Dataset
     records = []
     with open(DATA_PATH, encoding="utf-8") as f:
@@ -30,37 +44,42 @@ def load_and_prepare():
             obj = json.loads(line)
             # Expect each line to have 'raw' (the text) and 'target' (the JSON output as string)
             records.append({"raw": obj["raw"], "target": obj["target"]})
-    ds = Dataset.from_list(records)
+    return Dataset.from_list(records)
 
+def load_and_prepare():
     # Tokenizer & model
     tokenizer = MT5TokenizerFast.from_pretrained(MODEL_NAME)
     model = MT5ForConditionalGeneration.from_pretrained(MODEL_NAME)
 
     # Preprocessing function
     def preprocess_fn(batch):
+        padding = "max_length" if PADDING == "max_length" else False
         inputs = tokenizer(
             batch["raw"],
             max_length=MAX_INPUT_LENGTH,
             truncation=True,
-            padding="max_length",
+            padding=padding,
         )
         with tokenizer.as_target_tokenizer():
             targets = tokenizer(
                 batch["target"],
                 max_length=MAX_TARGET_LENGTH,
                 truncation=True,
-                padding="max_length",
+                padding=padding,
             )
         inputs["labels"] = targets["input_ids"]
         return inputs
 
-    tokenized = ds.map(
+    # Tokeniserat dataset från cachen om extract_relevant.jsonl och inställningarna är oförändrade
+    tokenized = load_or_tokenize(
+        DATA_PATH,
+        load_records,
         preprocess_fn,
-        batched=True,
-        remove_columns=ds.column_names,
+        MODEL_NAME,
+        {"max_input_length": MAX_INPUT_LENGTH, "max_target_length": MAX_TARGET_LENGTH, "padding": PADDING},
     )
 
-    data_collator = DataCollatorForSeq2Seq(tokenizer, model=model)
+    data_collator = TokenCountingCollator(DataCollatorForSeq2Seq(tokenizer, model=model), tokenizer.pad_token_id)
 
     return tokenized, tokenizer, model, data_collator
 
@@ -68,29 +87,49 @@ def load_and_prepare():
 def main():
     tokenized_ds, tokenizer, model, data_collator = load_and_prepare()
 
+    # Enhet och resursprofil (se training_utils.TRAIN_PROFILES)
+    resources = resource_profile(model, BATCH_SIZE, MAX_INPUT_LENGTH + MAX_TARGET_LENGTH)
     training_args = Seq2SeqTrainingArguments(
         output_dir=OUTPUT_DIR,
-        per_device_train_batch_size=BATCH_SIZE,
         per_device_eval_batch_size=BATCH_SIZE,
         num_train_epochs=NUM_EPOCHS,
         learning_rate=LEARNING_RATE,
         weight_decay=0.01,
         save_total_limit=2,
         predict_with_generate=True,
-        fp16=False,                    # CPU -> kör med fp32
         logging_strategy="steps",      # logga per batch
         logging_steps=1,
         save_steps=100,                # hur ofta modellen sparas
         report_to="none",
+        # Batchstorlek, precision, optimerare m.m. enligt TRAIN_PROFILE
+        **resources.training_args,
     )
 
-    trainer = Seq2SeqTrainer(
+    throughput = ThroughputCallback(
+        data_collator,
+        Path(OUTPUT_DIR) / "throughput.json",
+        {
+            "padding": PADDING, "profile": resources.name, "batch_size": BATCH_SIZE,
+            "max_batch_tokens": MAX_BATCH_TOKENS, "rows": len(tokenized_ds),
+        },
+    )
+    trainer_kwargs = dict(
         model=model,
         args=training_args,
         train_dataset=tokenized_ds,
         tokenizer=tokenizer,
         data_collator=data_collator,
+        callbacks=[throughput, ResourceCallback(Path(OUTPUT_DIR) / "resources.json", resources)],
     )
+    if PADDING == "dynamic":
+        trainer = LengthAwareSeq2SeqTrainer(
+            **trainer_kwargs,
+            # Vid gradientackumulering är tokenbudgeten per mikrobatch
+            max_batch_tokens=MAX_BATCH_TOKENS // resources.accumulation,
+            max_batch_size=max(1, MAX_BATCH_ROWS // resources.accumulation),
+        )
+    else:
+        trainer = Seq2SeqTrainer(**trainer_kwargs)
 
     print(">>> Börjar träna modellen …")         # ← här
     trainer.train()
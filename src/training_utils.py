@@ -0,0 +1,479 @@
+# src/training_utils.py
+
+import hashlib
+import inspect
+import json
+import os
+import random
+import resource
+import shutil
+import sys
+import time
+from pathlib import Path
+from typing import Callable, NamedTuple
+
+import torch
+import torch.nn.functional as F
+from datasets import Dataset, load_from_disk
+from torch.utils.data import DataLoader, Sampler
+from transformers import Seq2SeqTrainer, TrainerCallback
+
+# Tokeniserade dataset sparas (Arrow, minnesmappade vid läsning) här, en
+# katalog per cachenyckel
+TOKENIZED_CACHE_DIR = Path(os.environ.get(
+    "TOKENIZED_CACHE_DIR", Path(__file__).parent.parent / "data" / "tokenized"
+))
+
+# Paddningslägen i träningsskripten: "dynamic" paddar per batch (i collatorn)
+# och batchar efter längd med en tokenbudget, "max_length" paddar varje rad
+# till max längd med fast batchstorlek (tidigare beteende, för jämförelse)
+PADDING_MODES = ("dynamic", "max_length")
+
+# Resursprofiler för träningen (TRAIN_PROFILE):
+#   standard   – hela batchen per steg, AdamW; fp16/bf16 på GPU, fp32 på CPU
+#   low-memory – en rad per mikrobatch med gradientackumulering upp till samma
+#                effektiva batch, gradient checkpointing, Adafactor och bf16-
+#                autocast på CPU när processorn stöder det
+#   auto       – low-memory om standard (vikter, optimerare och aktiveringar)
+#                inte beräknas rymmas i minnesbudgeten
+TRAIN_PROFILES = ("auto", "standard", "low-memory")
+TRAIN_PROFILE  = os.environ.get("TRAIN_PROFILE", "auto")
+# Minnesbudget för träningen i MB (standard: 80 % av maskinens minne)
+TRAIN_MEMORY_BUDGET_MB = int(os.environ.get("TRAIN_MEMORY_BUDGET_MB", "0"))
+if TRAIN_PROFILE not in TRAIN_PROFILES:
+    raise ValueError(f"Okänd TRAIN_PROFILE '{TRAIN_PROFILE}', välj en av {', '.join(TRAIN_PROFILES)}.")
+
+# Ungefärligt minne per parameter: vikter + gradienter + optimerartillstånd
+# (AdamW: två fp32-moment; Adafactor: faktoriserade, nästan inget)
+_BYTES_PER_PARAM = {"adamw_torch": 16, "adafactor": 9}
+# Ungefärligt minne för sparade aktiveringar per token, d_model-dimension och
+# lager i fp32 (Korthikanti m.fl. räknar ~34 byte i 16 bitar, utan
+# attention-matriserna). Med gradient checkpointing sparas bara varje lagers
+# indata (4 byte) och ett lager i taget räknas om.
+_ACTIVATION_BYTES = 68
+_CHECKPOINT_BYTES = 4
+
+
+def detect_device() -> str:
+    if torch.cuda.is_available():
+        return "cuda"
+    if getattr(torch.backends, "mps", None) is not None and torch.backends.mps.is_available():
+        return "mps"
+    return "cpu"
+
+
+def cpu_supports_bf16() -> bool:
+    """
+    Har processorn bf16-instruktioner (AVX512-BF16 eller AMX)? Utan dem är
+    bf16-autocast på CPU långsammare än fp32.
+    """
+    for check in ("_is_avx512_bf16_supported", "_is_amx_tile_supported"):
+        fn = getattr(getattr(torch, "cpu", None), check, None)
+        if fn is not None and fn():
+            return True
+    try:
+        flags = Path("/proc/cpuinfo").read_text()
+    except OSError:
+        return False
+    return "avx512_bf16" in flags or "amx_bf16" in flags
+
+
+def peak_rss_bytes() -> int:
+    # ru_maxrss är i kB på Linux och i byte på macOS
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss if sys.platform == "darwin" else rss * 1024
+
+
+def memory_budget_bytes() -> int | None:
+    if TRAIN_MEMORY_BUDGET_MB:
+        return TRAIN_MEMORY_BUDGET_MB * 1024 * 1024
+    try:
+        return int(os.sysconf("SC_PHYS_PAGES") * os.sysconf("SC_PAGE_SIZE") * 0.8)
+    except (OSError, ValueError):
+        return None
+
+
+class ResourceProfile(NamedTuple):
+    """
+    Vald resursprofil: argument till Seq2SeqTrainingArguments och hur många
+    mikrobatchar varje optimeringssteg ackumuleras över (för att skala ned
+    tokenbudgeten vid dynamisk paddning).
+    """
+    name: str
+    device: str
+    precision: str
+    accumulation: int
+    estimated_bytes: int
+    training_args: dict
+
+
+def activation_bytes(model, rows: int, seq_len: int, checkpointing: bool = False) -> int:
+    """
+    Uppskattade aktiveringar för rows rader à seq_len token (input + target)
+    genom encoder och decoder.
+    """
+    config = model.config
+    d_model = getattr(config, "d_model", None) or getattr(config, "hidden_size", 0)
+    layers = getattr(config, "num_layers", 0) + (getattr(config, "num_decoder_layers", None) or 0)
+    per_layer = rows * seq_len * d_model
+    if checkpointing:
+        return per_layer * (layers * _CHECKPOINT_BYTES + _ACTIVATION_BYTES)
+    return per_layer * layers * _ACTIVATION_BYTES
+
+
+def resource_profile(model, batch_size: int, seq_len: int, profile: str = TRAIN_PROFILE) -> ResourceProfile:
+    """
+    Väljer profil (se TRAIN_PROFILES) utifrån enhet, modellens storlek,
+    aktiveringarna för batch_size rader à seq_len token och minnesbudgeten.
+    Effektiv batchstorlek är batch_size i båda profilerna.
+    """
+    device = detect_device()
+    params = sum(p.numel() for p in model.parameters())
+    budget = memory_budget_bytes()
+    if profile == "auto":
+        needed = params * _BYTES_PER_PARAM["adamw_torch"] + activation_bytes(model, batch_size, seq_len)
+        profile = "low-memory" if device != "cuda" and budget is not None and needed > budget else "standard"
+
+    args: dict = {"use_cpu": device == "cpu"}
+    if device == "cuda":
+        precision = "bf16" if torch.cuda.is_bf16_supported() else "fp16"
+    elif device == "cpu" and profile == "low-memory" and cpu_supports_bf16():
+        precision = "bf16"
+    else:
+        precision = "fp32"
+    if precision != "fp32":
+        args[precision] = True
+
+    if profile == "low-memory":
+        accumulation = batch_size
+        optim = "adafactor"
+        args.update({
+            "per_device_train_batch_size": 1,
+            "gradient_accumulation_steps": accumulation,
+            "gradient_checkpointing": True,
+            "optim": optim,
+        })
+    else:
+        accumulation = 1
+        optim = "adamw_torch"
+        args["per_device_train_batch_size"] = batch_size
+    estimated = params * _BYTES_PER_PARAM[optim] + activation_bytes(
+        model, args["per_device_train_batch_size"], seq_len, checkpointing=profile == "low-memory"
+    )
+    print(
+        f">>> Träningsprofil {profile} på {device} ({precision}, {params / 1e6:.0f} M parametrar, "
+        f"uppskattat {estimated / 2**20:.0f} MB"
+        + (f" av budgeten {budget / 2**20:.0f} MB)" if budget else ")")
+    )
+    if budget is not None and estimated > budget:
+        print("⚠️  Uppskattat minne överstiger budgeten (TRAIN_MEMORY_BUDGET_MB).")
+    return ResourceProfile(profile, device, precision, accumulation, estimated, args)
+
+
+class TokenBudgetBatchSampler(Sampler[list[int]]):
+    """
+    Grupperar raderna i längdhinkar: raderna sorteras efter längd och packas
+    i batchar så att paddade token (antal rader × (längsta input + längsta
+    target)) håller sig under max_tokens. Batcharna är desamma varje epok –
+    bara ordningen slumpas – så att antalet steg per epok är fast.
+    """
+
+    def __init__(
+        self,
+        input_lengths: list[int],
+        target_lengths: list[int],
+        max_tokens: int,
+        max_batch_size: int = 64,
+        shuffle: bool = True,
+        seed: int = 42,
+    ):
+        self.shuffle = shuffle
+        self.seed = seed
+        self.epoch = 0
+        order = sorted(range(len(input_lengths)), key=lambda i: (input_lengths[i], target_lengths[i]))
+        self.batches: list[list[int]] = []
+        batch: list[int] = []
+        longest_in = longest_tgt = 0
+        for i in order:
+            new_in = max(longest_in, input_lengths[i])
+            new_tgt = max(longest_tgt, target_lengths[i])
+            if batch and ((len(batch) + 1) * (new_in + new_tgt) > max_tokens or len(batch) >= max_batch_size):
+                self.batches.append(batch)
+                batch = []
+                new_in, new_tgt = input_lengths[i], target_lengths[i]
+            batch.append(i)
+            longest_in, longest_tgt = new_in, new_tgt
+        if batch:
+            self.batches.append(batch)
+
+    def __iter__(self):
+        batches = list(self.batches)
+        if self.shuffle:
+            random.Random(self.seed + self.epoch).shuffle(batches)
+        self.epoch += 1
+        return iter(batches)
+
+    def __len__(self) -> int:
+        return len(self.batches)
+
+
+class LengthAwareSeq2SeqTrainer(Seq2SeqTrainer):
+    """
+    Seq2SeqTrainer som tränar på TokenBudgetBatchSampler-batchar i stället
+    för en fast per_device_train_batch_size. Datasetet ska vara tokeniserat
+    utan paddning; collatorn paddar per batch.
+    """
+
+    def __init__(self, *args, max_batch_tokens: int, max_batch_size: int = 64, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.max_batch_tokens = max_batch_tokens
+        self.max_batch_size = max_batch_size
+
+    def get_train_dataloader(self) -> DataLoader:
+        dataset = self.train_dataset
+        sampler = TokenBudgetBatchSampler(
+            [len(ids) for ids in dataset["input_ids"]],
+            [len(ids) for ids in dataset["labels"]],
+            max_tokens=self.max_batch_tokens,
+            max_batch_size=self.max_batch_size,
+            seed=self.args.seed,
+        )
+        dataloader = DataLoader(
+            dataset,
+            batch_sampler=sampler,
+            collate_fn=self.data_collator,
+            num_workers=self.args.dataloader_num_workers,
+            pin_memory=self.args.dataloader_pin_memory,
+        )
+        return self.accelerator.prepare(dataloader) if hasattr(self, "accelerator") else dataloader
+
+
+class DistillationTrainer(LengthAwareSeq2SeqTrainer):
+    """
+    Tränar en student mot både target (cross-entropy) och lärarens
+    fördelning per token: loss = alpha * CE + (1 - alpha) * T² * KL(lärare ‖
+    student) med temperatur T, över token som inte är paddning. Läraren körs
+    med samma labels (teacher forcing) utan gradienter. Student och lärare
+    måste dela tokenizer (samma vokabulär).
+    """
+
+    def __init__(self, *args, teacher, alpha: float = 0.5, temperature: float = 2.0, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.teacher = teacher.to(self.args.device).eval()
+        for p in self.teacher.parameters():
+            p.requires_grad_(False)
+        self.alpha = alpha
+        self.temperature = temperature
+
+    def compute_loss(self, model, inputs, return_outputs=False, **kwargs):
+        outputs = model(**inputs)
+        with torch.no_grad():
+            teacher_logits = self.teacher(**inputs).logits
+        mask = inputs["labels"] != -100
+        # T5-tokenizerns vokabulär är mindre än embeddingen; jämför gemensam del
+        vocab = min(outputs.logits.size(-1), teacher_logits.size(-1))
+        t = self.temperature
+        student_log_probs = F.log_softmax(outputs.logits[..., :vocab][mask] / t, dim=-1)
+        teacher_probs = F.softmax(teacher_logits[..., :vocab][mask] / t, dim=-1)
+        kd = F.kl_div(student_log_probs, teacher_probs, reduction="batchmean") * t * t
+        loss = self.alpha * outputs.loss + (1 - self.alpha) * kd
+        return (loss, outputs) if return_outputs else loss
+
+
+class TokenCountingCollator:
+    """
+    Omsluter en collator och räknar riktiga respektive paddade token (input +
+    labels) i varje batch den bygger. Räknas bara i huvudprocessen
+    (dataloader_num_workers=0).
+    """
+
+    def __init__(self, collator, pad_token_id: int):
+        self.collator = collator
+        self.pad_token_id = pad_token_id
+        self.real_tokens = 0
+        self.padded_tokens = 0
+        self.samples = 0
+
+    def __call__(self, features):
+        batch = self.collator(features)
+        labels = batch["labels"]
+        self.real_tokens += int(batch["attention_mask"].sum())
+        self.real_tokens += int(((labels != -100) & (labels != self.pad_token_id)).sum())
+        self.padded_tokens += batch["input_ids"].numel() + labels.numel()
+        self.samples += len(features)
+        return batch
+
+
+class ThroughputCallback(TrainerCallback):
+    """
+    Mäter tid, riktiga token/s och andel paddning per epok och skriver en
+    rapport (JSON) när träningen är klar – för att jämföra paddningslägena.
+    """
+
+    def __init__(self, counter: TokenCountingCollator, output_path: str | Path, config: dict):
+        self.counter = counter
+        self.output_path = Path(output_path)
+        self.config = config
+        self.epochs: list[dict] = []
+        self._start = 0.0
+        self._tokens = (0, 0, 0)
+
+    def on_epoch_begin(self, args, state, control, **kwargs):
+        self._start = time.perf_counter()
+        self._tokens = (self.counter.real_tokens, self.counter.padded_tokens, self.counter.samples)
+
+    def on_epoch_end(self, args, state, control, **kwargs):
+        seconds = time.perf_counter() - self._start
+        real = self.counter.real_tokens - self._tokens[0]
+        padded = self.counter.padded_tokens - self._tokens[1]
+        stats = {
+            "epoch": len(self.epochs) + 1,
+            "seconds": seconds,
+            "samples": self.counter.samples - self._tokens[2],
+            "real_tokens": real,
+            "padded_tokens": padded,
+            "pad_ratio": 1 - real / padded if padded else 0.0,
+            "real_tokens_per_s": real / seconds if seconds else None,
+            "padded_tokens_per_s": padded / seconds if seconds else None,
+            "steps": state.global_step,
+        }
+        self.epochs.append(stats)
+        print(
+            f">>> Epok {stats['epoch']}: {seconds:.1f} s, {stats['real_tokens_per_s'] or 0:.0f} riktiga token/s, "
+            f"{stats['pad_ratio']:.0%} paddning"
+        )
+
+    def on_train_end(self, args, state, control, **kwargs):
+        report = {"config": self.config, "epochs": self.epochs}
+        if self.epochs:
+            report["mean_epoch_seconds"] = sum(e["seconds"] for e in self.epochs) / len(self.epochs)
+            report["mean_real_tokens_per_s"] = (
+                sum(e["real_tokens"] for e in self.epochs) / sum(e["seconds"] for e in self.epochs)
+            )
+        self.output_path.parent.mkdir(parents=True, exist_ok=True)
+        self.output_path.write_text(json.dumps(report, ensure_ascii=False, indent=2), encoding="utf-8")
+        print(f"✅ Genomströmning sparad till {self.output_path}")
+
+
+class ResourceCallback(TrainerCallback):
+    """
+    Loggar stegtid och RSS (nuvarande och topp) vid varje loggningssteg och
+    skriver en sammanfattning (JSON) när träningen är klar. Varnar när
+    toppen passerar minnesbudgeten.
+    """
+
+    def __init__(self, output_path: str | Path, profile: ResourceProfile):
+        self.output_path = Path(output_path)
+        self.profile = profile
+        self.budget = memory_budget_bytes()
+        self.step_seconds: list[float] = []
+        self._start: float | None = None
+        self._warned = False
+
+    def on_step_begin(self, args, state, control, **kwargs):
+        # Med gradientackumulering räknas tiden från första mikrobatchen
+        if self._start is None:
+            self._start = time.perf_counter()
+
+    def on_step_end(self, args, state, control, **kwargs):
+        if self._start is None:
+            return
+        self.step_seconds.append(time.perf_counter() - self._start)
+        self._start = None
+        if args.logging_steps and state.global_step % args.logging_steps == 0:
+            recent = self.step_seconds[-int(args.logging_steps):]
+            peak = peak_rss_bytes()
+            print(
+                f">>> Steg {state.global_step}: {sum(recent) / len(recent):.2f} s/steg, "
+                f"topp-RSS {peak / 2**20:.0f} MB"
+            )
+            if self.budget is not None and peak > self.budget and not self._warned:
+                print(f"⚠️  Topp-RSS över minnesbudgeten ({self.budget / 2**20:.0f} MB).")
+                self._warned = True
+
+    def on_train_end(self, args, state, control, **kwargs):
+        steps = self.step_seconds
+        report = {
+            "profile": self.profile._asdict(),
+            "steps": len(steps),
+            "mean_step_seconds": sum(steps) / len(steps) if steps else None,
+            "max_step_seconds": max(steps) if steps else None,
+            "peak_rss_mb": peak_rss_bytes() / 2**20,
+            "budget_mb": self.budget / 2**20 if self.budget else None,
+        }
+        self.output_path.parent.mkdir(parents=True, exist_ok=True)
+        self.output_path.write_text(json.dumps(report, ensure_ascii=False, indent=2), encoding="utf-8")
+        print(f"✅ Resursrapport sparad till {self.output_path}")
+
+
+def file_sha256(path: str | Path) -> str:
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            h.update(block)
+    return h.hexdigest()
+
+
+def tokenized_cache_key(data_path: str | Path, tokenizer_name: str, settings: dict, preprocess_fn: Callable) -> str:
+    """
+    Nyckel för ett tokeniserat dataset: hash av källfilens innehåll,
+    tokenizern, inställningarna (maxlängder, paddning) och källkoden för
+    preprocess_fn – ändras något av dem byggs cachen om.
+    """
+    try:
+        source = inspect.getsource(preprocess_fn)
+    except (OSError, TypeError):
+        source = preprocess_fn.__qualname__
+    parts = {
+        "data": file_sha256(data_path),
+        "tokenizer": tokenizer_name,
+        "settings": settings,
+        "preprocess": source,
+    }
+    return hashlib.sha256(json.dumps(parts, sort_keys=True, ensure_ascii=False).encode("utf-8")).hexdigest()[:16]
+
+
+def load_or_tokenize(
+    data_path: str | Path,
+    load_dataset: Callable[[], Dataset],
+    preprocess_fn: Callable,
+    tokenizer_name: str,
+    settings: dict,
+    cache_dir: str | Path = TOKENIZED_CACHE_DIR,
+    num_proc: int | None = None,
+) -> Dataset:
+    """
+    Det tokeniserade datasetet från cachen om det finns, annars läses
+    källan (load_dataset), tokeniseras parallellt med num_proc processer
+    (standard: TOKENIZE_NUM_PROC eller en per 1000 rader, max antal kärnor)
+    och sparas med save_to_disk. Delas av träningsskripten och mellan körningar.
+    """
+    key = tokenized_cache_key(data_path, tokenizer_name, settings, preprocess_fn)
+    path = Path(cache_dir) / f"{Path(data_path).stem}-{key}"
+    if (path / "cache_info.json").exists():
+        print(f">>> Tokeniserat dataset från cachen: {path}")
+        return load_from_disk(str(path))
+
+    ds = load_dataset()
+    if num_proc is None:
+        num_proc = int(os.environ.get("TOKENIZE_NUM_PROC", "0")) or min(os.cpu_count() or 1, max(1, len(ds) // 1000))
+    print(f">>> Tokeniserar {len(ds)} rader med {num_proc} processer …")
+    tokenized = ds.map(
+        preprocess_fn, batched=True, remove_columns=ds.column_names, num_proc=num_proc if num_proc > 1 else None
+    )
+    # Skriv till en temporär katalog och byt namn när allt är klart, så att en
+    # avbruten körning aldrig lämnar en halv cache
+    tmp = path.with_name(path.name + ".tmp")
+    shutil.rmtree(tmp, ignore_errors=True)
+    tokenized.save_to_disk(str(tmp))
+    (tmp / "cache_info.json").write_text(json.dumps({
+        "source": str(data_path),
+        "tokenizer": tokenizer_name,
+        "settings": settings,
+        "rows": len(tokenized),
+        "created": time.time(),
+    }, ensure_ascii=False, indent=2), encoding="utf-8")
+    shutil.rmtree(path, ignore_errors=True)
+    tmp.rename(path)
+    print(f"✅ Tokeniserat dataset sparat till {path}")
+    return load_from_disk(str(path))
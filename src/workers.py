@@ -0,0 +1,208 @@
+# src/workers.py
+
+import os
+import queue
+import threading
+import time
+
+import torch
+import torch.multiprocessing as mp
+
+
+def default_threads_per_worker(workers: int) -> int:
+    """
+    Fördela kärnorna jämnt så att N arbetare × trådar inte översubskriberar CPU:n.
+    """
+    return max(1, (os.cpu_count() or 1) // max(1, workers))
+
+
+def _worker_main(conn, model, tokenizer_path: str, threads: int) -> None:
+    """
+    Arbetsprocessens loop: tar emot en generate-förfrågan i taget och skickar
+    tillbaka ("ok", svar, token_counts) eller ("error", meddelande, None).
+    """
+    torch.set_num_threads(threads)
+    try:
+        torch.set_num_interop_threads(1)
+    except RuntimeError:
+        pass  # redan satt i den här processen
+
+    from transformers import AutoTokenizer
+
+    import inference
+    from constrained import JsonTemplate, generate_constrained
+
+    tokenizer = AutoTokenizer.from_pretrained(tokenizer_path)
+    device = torch.device("cpu")
+    template = None
+
+    while True:
+        request = conn.recv()
+        if request is None:
+            break
+        try:
+            token_counts: list[int] = []
+            if request["decoding"] == "constrained":
+                template = template or JsonTemplate(tokenizer)
+                outputs = generate_constrained(
+                    model, tokenizer, device, request["prompts"],
+                    max_input_length=request["max_input_length"],
+                    template=template,
+                    batch_size=request["batch_size"],
+                    token_counts=token_counts
+                )
+            else:
+                outputs = inference.generate_batch(
+                    model, tokenizer, device, request["prompts"],
+                    max_input_length=request["max_input_length"],
+                    max_length=request["max_length"],
+                    batch_size=request["batch_size"],
+                    token_counts=token_counts,
+                    **request["generation_kwargs"]
+                )
+            conn.send(("ok", outputs, token_counts))
+        except Exception as exc:  # noqa: BLE001 – felet skickas till frontend-processen
+            conn.send(("error", f"{type(exc).__name__}: {exc}", None))
+
+
+class ProcessWorkerPool:
+    """
+    N inferensprocesser (spawn) som delar modellens vikter: fp32-vikterna
+    läggs i delat minne (model.share_memory()) i frontend-processen och
+    skickas till arbetarna som handtag, inte kopior. Varje arbetare kör
+    threads_per_worker intra-op-trådar. generate() är blockerande och
+    trådsäker – varje anropande tråd lånar en ledig arbetare. En arbetare
+    som dött (t.ex. OOM-dödad) startas om med samma delade vikter innan den
+    lånas ut igen.
+
+    Bara backend "torch": dynamiskt int8-kvantiserade vikter (packade
+    parametrar) kan inte läggas i delat minne utan skulle kopieras till
+    varje arbetare, vilket motverkar syftet.
+    """
+
+    def __init__(self, model, tokenizer_path: str, backend: str = "torch", workers: int = 2,
+                 threads_per_worker: int | None = None):
+        if backend != "torch":
+            raise ValueError(
+                f"Arbetsprocesser stöds bara med backend 'torch' (inte '{backend}'); "
+                "kör torch-int8 med INFERENCE_WORKERS=0."
+            )
+        self.workers = max(1, workers)
+        self.threads_per_worker = threads_per_worker or default_threads_per_worker(self.workers)
+        self.backend = backend
+        self.tokenizer_path = tokenizer_path
+        self._model = model
+        self._idle: queue.Queue[int] = queue.Queue()
+        self._conns: list = [None] * self.workers
+        self._processes: list = [None] * self.workers
+        self._lock = threading.Lock()
+        self._requests_total = 0
+        self._respawns = 0
+        self._busy_seconds = [0.0] * self.workers
+        self._ctx = mp.get_context("spawn")
+
+        model.share_memory()
+        for i in range(self.workers):
+            self._spawn(i)
+            self._idle.put(i)
+
+    def _spawn(self, i: int) -> None:
+        parent_conn, child_conn = self._ctx.Pipe()
+        process = self._ctx.Process(
+            target=_worker_main,
+            args=(child_conn, self._model, self.tokenizer_path, self.threads_per_worker),
+            name=f"inference-worker-{i}",
+            daemon=True,
+        )
+        process.start()
+        child_conn.close()
+        self._conns[i], self._processes[i] = parent_conn, process
+
+    def _respawn(self, i: int) -> None:
+        """
+        Ersätter arbetare i (död eller med trasig pipe) med en ny process.
+        """
+        old_conn, old_process = self._conns[i], self._processes[i]
+        try:
+            old_conn.close()
+        except OSError:
+            pass
+        if old_process.is_alive():
+            old_process.terminate()
+        old_process.join(1.0)
+        self._spawn(i)
+        with self._lock:
+            self._respawns += 1
+
+    def generate(
+        self,
+        prompts: list[str | list[int]],
+        max_input_length: int,
+        max_length: int | list[int],
+        batch_size: int,
+        token_counts: list[int] | None = None,
+        decoding: str = "beam",
+        generation_kwargs: dict | None = None,
+    ) -> list[str]:
+        """
+        Kör en batch på första lediga arbetsprocess (samma semantik som
+        inference.generate_batch respektive constrained.generate_constrained).
+        """
+        i = self._idle.get()
+        started = time.perf_counter()
+        try:
+            if not self._processes[i].is_alive():
+                self._respawn(i)
+            try:
+                self._conns[i].send({
+                    "prompts": prompts,
+                    "max_input_length": max_input_length,
+                    "max_length": max_length,
+                    "batch_size": batch_size,
+                    "decoding": decoding,
+                    "generation_kwargs": generation_kwargs or {},
+                })
+                status, outputs, counts = self._conns[i].recv()
+            except (EOFError, OSError) as exc:
+                # Arbetaren dog mitt i anropet: starta om den så att nästa
+                # batch fungerar, och låt den här batchen misslyckas
+                self._respawn(i)
+                raise RuntimeError(f"inference-worker-{i} avslutades oväntat ({type(exc).__name__}).") from exc
+        finally:
+            with self._lock:
+                self._requests_total += 1
+                self._busy_seconds[i] += time.perf_counter() - started
+            self._idle.put(i)
+        if status != "ok":
+            raise RuntimeError(f"inference-worker-{i}: {outputs}")
+        if token_counts is not None:
+            token_counts[:] = counts
+        return outputs
+
+    def stop(self, timeout: float = 5.0) -> None:
+        for conn in self._conns:
+            if conn is None:
+                continue
+            try:
+                conn.send(None)
+            except (BrokenPipeError, OSError):
+                pass
+        for process in self._processes:
+            if process is None:
+                continue
+            process.join(timeout)
+            if process.is_alive():
+                process.terminate()
+        self._conns, self._processes = [None] * self.workers, [None] * self.workers
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "workers": self.workers,
+                "threads_per_worker": self.threads_per_worker,
+                "idle": self._idle.qsize(),
+                "alive": sum(1 for p in self._processes if p is not None and p.is_alive()),
+                "respawns": self._respawns,
+                "requests_total": self._requests_total,
+                "busy_seconds": list(self._busy_seconds),
+            }
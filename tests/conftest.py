@@ -0,0 +1,63 @@
+# tests/conftest.py
+
+import sys
+from pathlib import Path
+
+import pytest
+
+BASE_DIR = Path(__file__).parent.parent
+sys.path.insert(0, str(BASE_DIR / "src"))
+
+
+def _corpus() -> list[str]:
+    lines = (BASE_DIR / "data" / "dataset.jsonl").read_text(encoding="utf-8").splitlines()
+    for raw in sorted((BASE_DIR / "data" / "raw").glob("*.txt")):
+        lines += raw.read_text(encoding="utf-8").splitlines()
+    return [line for line in lines if line.strip()]
+
+
+@pytest.fixture(scope="session")
+def tiny_model_dir(tmp_path_factory) -> Path:
+    """
+    En liten slumpinitierad T5 med en sentencepiece-lik BPE-tokenizer tränad
+    på repots data – ingen nedladdning. Svaren är nonsens men deterministiska,
+    vilket räcker för att jämföra kodvägar med varandra.
+    """
+    torch = pytest.importorskip("torch")
+    transformers = pytest.importorskip("transformers")
+    tokenizers = pytest.importorskip("tokenizers")
+
+    tok = tokenizers.Tokenizer(tokenizers.models.BPE(unk_token="<unk>"))
+    tok.pre_tokenizer = tokenizers.pre_tokenizers.Metaspace()
+    tok.decoder = tokenizers.decoders.Metaspace()
+    tok.train_from_iterator(
+        _corpus(), tokenizers.trainers.BpeTrainer(vocab_size=600, special_tokens=["<pad>", "</s>", "<unk>"])
+    )
+    tok.post_processor = tokenizers.processors.TemplateProcessing(
+        single="$A </s>", special_tokens=[("</s>", tok.token_to_id("</s>"))]
+    )
+    tokenizer = transformers.PreTrainedTokenizerFast(
+        tokenizer_object=tok, pad_token="<pad>", eos_token="</s>", unk_token="<unk>"
+    )
+
+    torch.manual_seed(0)
+    config = transformers.T5Config(
+        vocab_size=len(tokenizer), d_model=32, d_ff=64, d_kv=16, num_heads=2,
+        num_layers=2, num_decoder_layers=2,
+        pad_token_id=tokenizer.pad_token_id, eos_token_id=tokenizer.eos_token_id,
+        decoder_start_token_id=tokenizer.pad_token_id,
+    )
+    model = transformers.T5ForConditionalGeneration(config).eval()
+    path = tmp_path_factory.mktemp("tiny-t5")
+    model.save_pretrained(path)
+    tokenizer.save_pretrained(path)
+    return path
+
+
+@pytest.fixture(scope="session")
+def tiny_model(tiny_model_dir):
+    from transformers import AutoTokenizer
+
+    import inference
+
+    return inference.load_model(tiny_model_dir), AutoTokenizer.from_pretrained(str(tiny_model_dir))
@@ -0,0 +1,37 @@
+# tests/test_cache.py
+
+import pytest
+
+from cache import ResultCache
+
+
+def test_disk_tier_survives_restart(tmp_path):
+    path = tmp_path / "cache.sqlite"
+    cache = ResultCache(max_entries=8, sqlite_path=path)
+    for i in range(20):
+        cache.put(f"k{i}", {"i": i}, namespace="extract")
+    cache.flush()
+    cache.close()
+
+    reopened = ResultCache(max_entries=8, sqlite_path=path)
+    assert reopened.get_memory("k3", namespace="extract") is None
+    assert reopened.get_disk("k3", namespace="extract") == {"i": 3}
+    # Nu i minnet: ingen disk-I/O behövs
+    assert reopened.get_memory("k3", namespace="extract") == {"i": 3}
+    assert reopened.get("saknas", namespace="extract") is None
+    stats = reopened.stats()["namespaces"]["extract"]
+    assert stats == {"hits": 2, "disk_hits": 1, "misses": 1}
+    reopened.close()
+
+
+def test_model_revision_keeps_checkpoint_with_override(tmp_path, monkeypatch):
+    pytest.importorskip("torch")
+    from model_registry import model_revision
+
+    a, b = tmp_path / "a", tmp_path / "b"
+    for d in (a, b):
+        d.mkdir()
+        (d / "config.json").write_text("{}", encoding="utf-8")
+    monkeypatch.setenv("MODEL_REVISION", "v1")
+    assert model_revision(str(a), "torch") != model_revision(str(b), "torch")
+    assert model_revision(str(a), "torch").startswith("v1|")
@@ -0,0 +1,40 @@
+# tests/test_chunking.py
+
+import re
+from pathlib import Path
+
+import pytest
+
+import chunking
+
+RAW_DIR = Path(__file__).parent.parent / "data" / "raw"
+
+
+class WhitespaceTokenizer:
+    """
+    Ett ord = en token; räcker för chunk_document (input_ids + offset_mapping).
+    """
+
+    def __call__(self, text, return_offsets_mapping=False, add_special_tokens=True):
+        spans = [m.span() for m in re.finditer(r"\S+", text)]
+        return {"input_ids": list(range(len(spans))), "offset_mapping": spans}
+
+
+@pytest.mark.parametrize("overlap", [20, 50])
+def test_consecutive_chunks_share_overlap_tokens(overlap):
+    text = (RAW_DIR / "Folksam.txt").read_text(encoding="utf-8")
+    chunks = chunking.chunk_document(WhitespaceTokenizer(), text, max_tokens=200, overlap=overlap)
+    assert len(chunks) > 3
+
+    shared = [prev.token_end - nxt.token_start for prev, nxt in zip(chunks, chunks[1:])]
+    assert all(0 < s <= overlap for s in shared)
+    # Överlappet ska i snitt ligga nära det begärda, inte bara en token
+    assert sum(shared) / len(shared) >= overlap / 2
+
+
+def test_chunks_cover_document_without_overlap():
+    text = (RAW_DIR / "Folksam.txt").read_text(encoding="utf-8")
+    tokenizer = WhitespaceTokenizer()
+    chunks = chunking.chunk_document(tokenizer, text, max_tokens=200)
+    assert [c.token_start for c in chunks[1:]] == [c.token_end for c in chunks[:-1]]
+    assert chunks[-1].token_end == len(tokenizer(text)["input_ids"])
@@ -0,0 +1,110 @@
+# tests/test_constrained.py
+
+import json
+
+import pytest
+
+pytest.importorskip("torch")
+
+from constrained import DEFAULT_FIELDS, EXTRACT_FIELDS, JsonTemplate, generate_constrained, training_fields
+from preprocess import BOOLEAN_KEYS
+
+PROMPTS = [
+    "extract: Folksam Bas ersätter specialistvård och sjukhusvård.",
+    "extract: Tandvård ingår inte.",
+    "extract: Försäkringen gäller i hela Norden och inom EU/EES, men inte i USA eller Asien. "
+    "Psykologbesök ersätts med upp till tio besök per år.",
+    "extract: SEB",
+]
+
+
+def test_batched_matches_single(tiny_model):
+    import torch
+
+    model, tokenizer = tiny_model
+    template = JsonTemplate(tokenizer)
+    single = [
+        generate_constrained(model, tokenizer, torch.device("cpu"), [p], 64, template, batch_size=1)[0]
+        for p in PROMPTS
+    ]
+    batched = generate_constrained(model, tokenizer, torch.device("cpu"), PROMPTS, 64, template, batch_size=len(PROMPTS))
+    assert batched == single
+    for out in batched:
+        assert list(json.loads(out)) == [key for key, _ in template.fields]
+
+
+def test_fields_come_from_training_targets():
+    assert EXTRACT_FIELDS == training_fields() == DEFAULT_FIELDS
+    keys = [key for key, _ in EXTRACT_FIELDS]
+    assert "karenstid" not in keys
+    assert set(keys) <= {"försäkring", "pris_per_åldersintervall", "självrisk"} | {bk["key"] for bk in BOOLEAN_KEYS}
+
+
+def test_decoder_rows_are_independent_of_padding(tiny_model):
+    """
+    Rader som matar in olika många token (t.ex. "true," mot "false,", eller
+    fritext som tar slut vid olika steg) ska få samma logits som om de
+    avkodats ensamma.
+    """
+    import torch
+
+    from constrained import _Decoder
+
+    model, tokenizer = tiny_model
+    start = model.config.decoder_start_token_id
+    feeds = [
+        [[start, 5, 6, 7], [8], [], [9, 10]],
+        [[start], [11, 12, 13], [14], []],
+        [[start, 15], [], [16, 17, 18], [19]],
+    ]
+
+    def run(rows: list[int]) -> list[torch.Tensor]:
+        enc = tokenizer.pad({"input_ids": [tokenizer(PROMPTS[r])["input_ids"] for r in rows]}, return_tensors="pt")
+        with torch.no_grad():
+            encoder_outputs = model.get_encoder()(**enc, return_dict=True)
+            decoder = _Decoder(model, encoder_outputs, enc["attention_mask"], tokenizer.pad_token_id)
+            logits = []
+            for step in range(len(feeds[0])):
+                pending = [feeds[r][step] for r in rows]
+                out = decoder.feed(pending)
+                logits.append(out)
+        return logits
+
+    batched = run([0, 1, 2])
+    for r in range(3):
+        single = run([r])
+        for step in range(len(feeds[0])):
+            if feeds[r][step]:
+                assert torch.allclose(batched[step][r], single[step][0], atol=1e-5), (r, step)
+
+
+def test_row_positions_only_touch_the_constrained_model(tiny_model, tiny_model_dir):
+    """
+    Positionsbiasen per rad kopplas in på modellens eget attention-lager;
+    T5Attention-klassen och andra T5-modeller i processen ska vara orörda.
+    """
+    import pickle
+
+    import torch
+    from transformers import T5ForConditionalGeneration
+    from transformers.models.t5.modeling_t5 import T5Attention
+
+    original = T5Attention.__dict__["compute_bias"]
+    model, tokenizer = tiny_model
+    generate_constrained(model, tokenizer, torch.device("cpu"), PROMPTS[:1], 64, JsonTemplate(tokenizer))
+    assert T5Attention.__dict__["compute_bias"] is original
+    assert "compute_bias" in vars(model.get_decoder().block[0].layer[0].SelfAttention)
+
+    other = T5ForConditionalGeneration.from_pretrained(tiny_model_dir)
+    assert "compute_bias" not in vars(other.get_decoder().block[0].layer[0].SelfAttention)
+    # Modellen ska fortfarande gå att skicka till arbetsprocesser
+    pickle.loads(pickle.dumps(model))
+
+
+def test_unsupported_transformers_fails_loudly(monkeypatch):
+    import constrained
+
+    constrained.check_transformers_support()
+    monkeypatch.setattr(constrained.transformers, "__version__", "99.0.0")
+    with pytest.raises(RuntimeError, match="transformers"):
+        constrained.check_transformers_support()
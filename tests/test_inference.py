@@ -0,0 +1,39 @@
+# tests/test_inference.py
+
+import json
+from pathlib import Path
+
+import pytest
+
+pytest.importorskip("torch")
+
+from inference import GENERATION_KWARGS, generate_batch
+
+DATA_PATH = Path(__file__).parent.parent / "data" / "all_tasks.jsonl"
+
+
+def compare_prompts(n: int) -> list[str]:
+    with open(DATA_PATH, encoding="utf-8") as f:
+        rows = [json.loads(line) for line in f if line.strip()]
+    return [r["input"] for r in rows if r["input"].startswith("compare:")][:n]
+
+
+@pytest.mark.parametrize("compare_len,faq_len", [(6, 30), (10, 60)])
+def test_compare_unchanged_when_batched_with_faq(tiny_model, compare_len, faq_len):
+    """
+    compare och faq på samma aggregat köas tillsammans men har olika
+    max_length; med beam search får det inte ändra compare-svaret.
+    """
+    import torch
+
+    model, tokenizer = tiny_model
+    device = torch.device("cpu")
+    # Båda promptarna kortas till 128 token, så ingen rad paddas – bara max_length skiljer
+    for compare in compare_prompts(2):
+        faq = "faq: " + compare.removeprefix("compare: ")
+        alone = generate_batch(model, tokenizer, device, [compare], 128, compare_len, **GENERATION_KWARGS)
+        together = generate_batch(
+            model, tokenizer, device, [compare, faq], 128, [compare_len, faq_len], **GENERATION_KWARGS
+        )
+        assert together[0] == alone[0]
+        assert together[1] == generate_batch(model, tokenizer, device, [faq], 128, faq_len, **GENERATION_KWARGS)[0]
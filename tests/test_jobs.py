@@ -0,0 +1,62 @@
+# tests/test_jobs.py
+
+import asyncio
+
+import pytest
+
+from jobs import CANCELLED, CANCELLING, SUCCEEDED, InMemoryJobBackend, Job, JobManager, SqliteJobBackend
+
+
+async def pipeline(text, **options):
+    yield {"event": "chunks", "count": 1}
+    if text == "slow":
+        await asyncio.sleep(10)
+    yield {"event": "result", "result": {"text": text, **options}, "timings": {"extract": 0.5, "total": 1.0}}
+
+
+async def wait_for(manager, job_id, status):
+    for _ in range(200):
+        job = await manager.get(job_id)
+        if job.status == status:
+            return job
+        await asyncio.sleep(0.01)
+    raise AssertionError(f"{job_id} blev aldrig {status}")
+
+
+@pytest.mark.parametrize("backend", ["memory", "sqlite"])
+def test_job_timings_and_cancel(backend, tmp_path):
+    async def main():
+        store = InMemoryJobBackend() if backend == "memory" else SqliteJobBackend(tmp_path / "jobs.sqlite")
+        manager = JobManager(store, pipeline, workers=1)
+        await manager.start()
+        try:
+            job = await manager.submit("snabb", {"order": "heading"})
+            done = await wait_for(manager, job.id, SUCCEEDED)
+            # Pipelinens egna tider, inte tiden mellan händelserna
+            assert done.timings == {"extract": 0.5, "total": 1.0}
+            assert done.result == {"text": "snabb", "order": "heading"}
+            assert done.options == {"order": "heading"}
+
+            job = await manager.submit("slow")
+            await wait_for(manager, job.id, "running")
+            assert (await manager.cancel(job.id)).status == CANCELLING
+            assert (await wait_for(manager, job.id, CANCELLED)).finished is not None
+        finally:
+            await manager.stop()
+
+    asyncio.run(main())
+
+
+def test_finished_jobs_are_evicted():
+    store = InMemoryJobBackend(ttl=3600, max_finished=2)
+    jobs = [Job(id=str(i), text="x") for i in range(3)]
+    for job in jobs:
+        store.add(job)
+        store.cancel_queued(job.id)
+    assert store.get("0") is None
+    assert store.get("1").status == CANCELLED
+
+    store.ttl = 0
+    store.add(Job(id="3", text="x"))
+    assert store.get("1") is None and store.get("2") is None
+    assert store.get("3") is not None
@@ -0,0 +1,38 @@
+# tests/test_model_registry.py
+
+import pytest
+
+pytest.importorskip("torch")
+
+
+def test_swap_status_is_reported(tiny_model_dir, tmp_path):
+    from model_registry import ModelRegistry
+
+    registry = ModelRegistry.from_config(None, None, default_path=str(tiny_model_dir))
+    registry.get("default").warmup()
+
+    with pytest.raises(Exception):
+        registry.swap("default", str(tmp_path))
+    status = registry.status()["models"]["default"]
+    assert status["swap_status"] == "failed"
+    assert status["swap_error"]
+    assert registry.get("default").ready
+
+    registry.swap("default", str(tiny_model_dir))
+    status = registry.status()["models"]["default"]
+    assert status["swap_status"] == "done"
+    assert status["swap_error"] is None
+    assert registry.status()["swapping"] == {}
+
+
+def test_invalid_swap_backend_is_reported(tiny_model_dir):
+    from model_registry import ModelEntry, ModelRegistry
+
+    registry = ModelRegistry({"default": ModelEntry("default", str(tiny_model_dir), workers=1)})
+
+    with pytest.raises(ValueError):
+        registry.swap("default", str(tiny_model_dir), backend="onnx")
+    status = registry.status()["models"]["default"]
+    assert status["swap_status"] == "failed"
+    assert "onnx" in status["swap_error"]
+    assert not registry.swapping("default")
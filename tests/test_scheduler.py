@@ -0,0 +1,65 @@
+# tests/test_scheduler.py
+
+import asyncio
+import threading
+import time
+
+from scheduler import InferenceScheduler
+
+
+def test_different_keys_run_in_parallel():
+    """
+    compare och faq köas under olika nycklar; med concurrency 2 ska de köras
+    samtidigt i stället för efter varandra.
+    """
+    running, overlap = set(), []
+    lock = threading.Lock()
+
+    def runner(key, payloads):
+        with lock:
+            running.add(key)
+            overlap.append(len(running))
+        time.sleep(0.2)
+        with lock:
+            running.discard(key)
+        return payloads
+
+    async def main():
+        scheduler = InferenceScheduler(runner, max_batch_size=4, max_wait_ms=1, concurrency=2)
+        try:
+            started = time.perf_counter()
+            results = await asyncio.gather(scheduler.submit("compare", 1), scheduler.submit("faq", 2))
+            return results, time.perf_counter() - started
+        finally:
+            scheduler.stop()
+
+    results, elapsed = asyncio.run(main())
+    assert results == [1, 2]
+    assert max(overlap) == 2
+    assert elapsed < 0.35
+
+
+def test_full_key_is_not_blocked_by_older_partial_key():
+    """
+    En full batch längre bak i kön ska skickas direkt, inte vänta tills det
+    äldre, ofulla anropet först i kön har nått max_wait.
+    """
+    def runner(key, payloads):
+        return payloads
+
+    async def main():
+        scheduler = InferenceScheduler(runner, max_batch_size=2, max_wait_ms=1000)
+        try:
+            slow = asyncio.ensure_future(scheduler.submit("compare", 0))
+            await asyncio.sleep(0.01)
+            started = time.perf_counter()
+            results = await scheduler.submit_many("extract", [1, 2])
+            elapsed = time.perf_counter() - started
+            await slow
+            return results, elapsed
+        finally:
+            scheduler.stop()
+
+    results, elapsed = asyncio.run(main())
+    assert results == [1, 2]
+    assert elapsed < 0.5
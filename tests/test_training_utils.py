@@ -0,0 +1,22 @@
+# tests/test_training_utils.py
+
+import pytest
+
+pytest.importorskip("torch")
+pytest.importorskip("datasets")
+
+
+def test_auto_profile_counts_activations(tiny_model, monkeypatch):
+    import training_utils
+
+    model, _ = tiny_model
+    params = sum(p.numel() for p in model.parameters())
+    monkeypatch.setattr(training_utils, "detect_device", lambda: "cpu")
+    # Vikterna och AdamW ryms, men inte aktiveringarna för långa rader
+    budget = params * 16 + training_utils.activation_bytes(model, 8, 64)
+    monkeypatch.setattr(training_utils, "memory_budget_bytes", lambda: budget)
+
+    assert training_utils.resource_profile(model, 8, 64, "auto").name == "standard"
+    low = training_utils.resource_profile(model, 8, 4096, "auto")
+    assert low.name == "low-memory"
+    assert low.estimated_bytes < params * 16 + training_utils.activation_bytes(model, 8, 4096)
@@ -0,0 +1,34 @@
+# tests/test_workers.py
+
+import pytest
+
+pytest.importorskip("torch")
+
+
+def test_dead_worker_is_respawned(tiny_model, tiny_model_dir):
+    from workers import ProcessWorkerPool
+
+    model, _ = tiny_model
+    pool = ProcessWorkerPool(model, str(tiny_model_dir), workers=1, threads_per_worker=1)
+    request = dict(prompts=["compare: Folksam Bas"], max_input_length=64, max_length=8, batch_size=1)
+    try:
+        expected = pool.generate(**request)
+
+        # Döda arbetaren mellan två anrop (som OOM-killern skulle göra)
+        pool._processes[0].kill()
+        pool._processes[0].join(5)
+
+        assert pool.generate(**request) == expected
+        stats = pool.stats()
+        assert stats["respawns"] == 1
+        assert stats["alive"] == 1
+    finally:
+        pool.stop()
+
+
+def test_int8_backend_is_refused(tiny_model, tiny_model_dir):
+    from workers import ProcessWorkerPool
+
+    model, _ = tiny_model
+    with pytest.raises(ValueError):
+        ProcessWorkerPool(model, str(tiny_model_dir), backend="torch-int8", workers=1)